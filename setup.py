@@ -112,6 +112,11 @@ setup(
     ],
     package_data={},
     install_requires=install_requires,
+    extras_require={
+        'fast-json': [
+            'orjson'
+        ]
+    },
     test_suite='setup.spylunking_test_suite',
     tests_require=[
         'pytest'
@@ -126,6 +131,11 @@ setup(
         './spylunking/scripts/test_publish_to_splunk.py',
         './spylunking/scripts/sp'
     ],
+    entry_points={
+        'console_scripts': [
+            'spylunking-forwarder=spylunking.scripts.forwarder:run_main'
+        ]
+    },
     use_2to3=True,
     classifiers=[
         'Development Status :: 5 - Production/Stable',
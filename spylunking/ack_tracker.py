@@ -0,0 +1,215 @@
+"""
+HEC indexer acknowledgment tracking for the HEC publishers
+
+When indexer acknowledgment is enabled on a HEC token, an HTTP 200 only
+means Splunk received a batch, not that it was indexed. Each response
+includes an ``ackId`` for the publisher's channel, and the batch is
+only done once ``/services/collector/ack`` reports that id as indexed.
+
+The ``AckTracker`` keeps a bounded window of sent but unacknowledged
+batches. Its poller thread asks HEC about every pending ``ackId`` in one
+request per ``poll_interval`` and resends any batch that has not been
+acknowledged within ``timeout`` seconds. ``stop`` returns the batches
+that are still unacknowledged so the publisher can spool them instead
+of losing them at shutdown.
+"""
+
+import threading
+import time
+
+
+class AckTracker(object):
+    """
+    Bounded window of batches waiting on HEC indexer acknowledgment
+    """
+
+    def __init__(
+            self,
+            poll_func,
+            resend_func,
+            max_pending=100,
+            timeout=60.0,
+            poll_interval=1.0,
+            name='spylunking-ack-poller'):
+        """__init__
+
+        :param poll_func: function called with ``ack_ids=<list>`` that
+                          returns the HEC ``acks`` dictionary like:
+                          ``{"0": true, "1": false}``
+        :param resend_func: function called with ``payload=<batch>``
+                            for a batch that was not acknowledged in time
+        :param max_pending: maximum number of unacknowledged batches
+        :param timeout: seconds to wait for an acknowledgment
+                        before resending the batch
+        :param poll_interval: seconds between bulk ack polls
+        :param name: poller thread name
+        """
+        self.poll_func = poll_func
+        self.resend_func = resend_func
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.name = name
+        self.pending = {}
+        self.lock = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.num_acked = 0
+        self.num_resent = 0
+    # end of __init__
+
+    def start(
+            self):
+        """start
+
+        Start the poller thread
+        """
+        if self.thread:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self.run,
+            name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+    # end of start
+
+    def stop(
+            self,
+            timeout=None):
+        """stop
+
+        Stop the poller thread and remove and return the list
+        of batches HEC has not acknowledged yet
+
+        :param timeout: seconds to wait for the thread
+        """
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        with self.lock:
+            payloads = [
+                payload
+                for payload, sent_time in self.pending.values()
+            ]
+            self.pending = {}
+            self.lock.notify_all()
+        return payloads
+    # end of stop
+
+    def add(
+            self,
+            ack_id,
+            payload):
+        """add
+
+        Track a sent batch until HEC acknowledges it
+
+        :param ack_id: ``ackId`` from the HEC response
+        :param payload: batch to resend if it is not acknowledged
+        """
+        with self.lock:
+            self.pending[ack_id] = (payload, time.time())
+    # end of add
+
+    def wait_for_room(
+            self,
+            timeout=None):
+        """wait_for_room
+
+        Wait until the window has room for another batch
+        and return True if it does
+
+        :param timeout: seconds to wait with None waiting forever
+        """
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                self.lock.wait(timeout)
+            return len(self.pending) < self.max_pending
+    # end of wait_for_room
+
+    def update(
+            self,
+            acks):
+        """update
+
+        Drop every batch HEC reports as indexed
+
+        :param acks: HEC ``acks`` dictionary of ``ackId`` to bool
+        """
+        with self.lock:
+            for ack_id in acks:
+                if acks[ack_id]:
+                    if self.pending.pop(int(ack_id), None):
+                        self.num_acked += 1
+            self.lock.notify_all()
+    # end of update
+
+    def pop_expired(
+            self):
+        """pop_expired
+
+        Remove and return the batches that were not
+        acknowledged within ``timeout`` seconds
+        """
+        expired = []
+        now = time.time()
+        with self.lock:
+            for ack_id in list(self.pending):
+                payload, sent_time = self.pending[ack_id]
+                if now - sent_time >= self.timeout:
+                    expired.append(payload)
+                    del self.pending[ack_id]
+            if expired:
+                self.lock.notify_all()
+        return expired
+    # end of pop_expired
+
+    def poll(
+            self):
+        """poll
+
+        Ask HEC about every pending ``ackId`` in one request
+        and resend the batches that timed out
+        """
+        with self.lock:
+            ack_ids = sorted(self.pending)
+        if ack_ids:
+            acks = self.poll_func(
+                ack_ids=ack_ids)
+            if acks:
+                self.update(
+                    acks=acks)
+        for payload in self.pop_expired():
+            self.num_resent += 1
+            self.resend_func(
+                payload=payload)
+    # end of poll
+
+    def run(
+            self):
+        """run
+
+        Poller thread loop
+        """
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception:
+                # the poll_func handles logging so keep polling
+                pass
+        # end of while polling
+    # end of run
+
+    def __len__(
+            self):
+        """__len__
+
+        Number of unacknowledged batches
+        """
+        with self.lock:
+            return len(self.pending)
+    # end of __len__
+
+# end of AckTracker
@@ -0,0 +1,154 @@
+"""
+Batch builder for the HEC publishers
+
+Building a batch with ``payload = payload + msg`` copies the whole
+payload for every record, which is quadratic in the batch size. The
+``BatchBuilder`` keeps a list of encoded chunks with a running byte
+count and joins them exactly once when the batch is sent.
+
+A batch is full once it reaches either the ``max_bytes`` of encoded
+bytes or the ``max_events`` number of records, and it has lingered
+once ``linger_ms`` milliseconds have passed since its first record
+or as soon as it holds a priority record.
+"""
+
+import time
+from spylunking.consts import IS_PY2
+
+
+class BatchBuilder(object):
+    """
+    Accumulate encoded log records for one HEC POST body
+    """
+
+    def __init__(
+            self,
+            max_bytes=524288,
+            max_events=0,
+            linger_ms=0):
+        """__init__
+
+        :param max_bytes: batch is full once it holds at least
+                          this many encoded bytes
+        :param max_events: batch is full once it holds this many
+                           records with 0 is an infinite number of records
+        :param linger_ms: milliseconds to wait for more records after
+                          the first record of a batch with 0 sending
+                          as soon as the queue is empty
+        """
+        self.max_bytes = max_bytes
+        self.max_events = max_events
+        self.linger_ms = linger_ms
+        self.chunks = []
+        self.num_bytes = 0
+        self.started = None
+        self.priority = False
+        # average record size carried over from earlier batches
+        self.record_bytes = 0.0
+    # end of __init__
+
+    def add(
+            self,
+            msg,
+            priority=False):
+        """add
+
+        Append a formatted record to the batch
+
+        :param msg: formatted record as a ``str`` or ``bytes``
+        :param priority: record came from a priority lane so the
+                         batch should be sent without lingering
+        """
+        if not IS_PY2 and not isinstance(msg, bytes):
+            msg = msg.encode('utf-8')
+        if not self.chunks:
+            self.started = time.time()
+        self.chunks.append(msg)
+        self.num_bytes += len(msg)
+        if priority:
+            self.priority = True
+    # end of add
+
+    def is_full(
+            self):
+        """is_full"""
+        if self.num_bytes >= self.max_bytes:
+            return True
+        return bool(
+            self.max_events > 0
+            and len(self.chunks) >= self.max_events)
+    # end of is_full
+
+    def room(
+            self,
+            default=100):
+        """room
+
+        Estimate how many more records fit in the batch from
+        the average record size
+
+        :param default: estimate before any record was seen
+        """
+        if self.chunks:
+            self.record_bytes = float(self.num_bytes) / len(self.chunks)
+        if self.record_bytes > 0:
+            num_records = int(
+                (self.max_bytes - self.num_bytes) / self.record_bytes)
+        else:
+            num_records = default
+        if self.max_events > 0:
+            num_records = min(
+                num_records,
+                self.max_events - len(self.chunks))
+        return max(1, num_records)
+    # end of room
+
+    def linger_remaining(
+            self):
+        """linger_remaining
+
+        Seconds left before this batch should be sent with 0.0
+        for an empty batch, a batch holding a priority record
+        or once the linger time has passed
+        """
+        if not self.chunks or self.linger_ms <= 0 or self.priority:
+            return 0.0
+        remaining = (
+            self.started + (self.linger_ms / 1000.0)) - time.time()
+        if remaining < 0.0:
+            return 0.0
+        return remaining
+    # end of linger_remaining
+
+    def getvalue(
+            self):
+        """getvalue
+
+        Return the batch as one contiguous ``bytes`` object
+        """
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        return b''.join(self.chunks)
+    # end of getvalue
+
+    def reset(
+            self):
+        """reset"""
+        if self.chunks:
+            self.record_bytes = float(self.num_bytes) / len(self.chunks)
+        self.chunks = []
+        self.num_bytes = 0
+        self.started = None
+        self.priority = False
+    # end of reset
+
+    def __len__(
+            self):
+        """__len__
+
+        Number of records in the batch
+        """
+        return len(self.chunks)
+    # end of __len__
+
+# end of BatchBuilder
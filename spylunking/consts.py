@@ -98,6 +98,159 @@ SPLUNK_RETRY_BACKOFF = float(os.getenv(
 SPLUNK_QUEUE_SIZE = int(os.getenv(
     'SPLUNK_QUEUE_SIZE',
     '0').strip())  # infinite queue size = 0
+SPLUNK_MAX_BATCH_BYTES = int(os.getenv(
+    'SPLUNK_MAX_BATCH_BYTES',
+    '524288').strip())
+SPLUNK_MAX_BATCH_EVENTS = int(os.getenv(
+    'SPLUNK_MAX_BATCH_EVENTS',
+    '0').strip())  # infinite events per batch = 0
+SPLUNK_LINGER_MS = int(os.getenv(
+    'SPLUNK_LINGER_MS',
+    '0').strip())
+SPLUNK_COMPRESS = bool(os.getenv(
+    'SPLUNK_COMPRESS',
+    '0').strip() == '1')
+SPLUNK_COMPRESS_MIN_BYTES = int(os.getenv(
+    'SPLUNK_COMPRESS_MIN_BYTES',
+    '1024').strip())
+SPLUNK_COMPRESS_LEVEL = int(os.getenv(
+    'SPLUNK_COMPRESS_LEVEL',
+    '6').strip())
+SPLUNK_ENDPOINT = os.getenv(
+    'SPLUNK_ENDPOINT',
+    'event').strip()  # event or raw
+SPLUNK_CHANNEL = os.getenv(
+    'SPLUNK_CHANNEL',
+    '').strip()
+SPLUNK_MAX_INFLIGHT = int(os.getenv(
+    'SPLUNK_MAX_INFLIGHT',
+    '1').strip())
+SPLUNK_USE_ACK = bool(os.getenv(
+    'SPLUNK_USE_ACK',
+    '0').strip() == '1')
+SPLUNK_ACK_WINDOW = int(os.getenv(
+    'SPLUNK_ACK_WINDOW',
+    '100').strip())
+SPLUNK_ACK_TIMEOUT = float(os.getenv(
+    'SPLUNK_ACK_TIMEOUT',
+    '60.0').strip())
+SPLUNK_ACK_POLL_INTERVAL = float(os.getenv(
+    'SPLUNK_ACK_POLL_INTERVAL',
+    '1.0').strip())
+SPLUNK_SPOOL_DIR = os.getenv(
+    'SPLUNK_SPOOL_DIR',
+    '').strip()
+SPLUNK_SPOOL_MAX_BYTES = int(os.getenv(
+    'SPLUNK_SPOOL_MAX_BYTES',
+    '268435456').strip())
+SPLUNK_SPOOL_SEGMENT_BYTES = int(os.getenv(
+    'SPLUNK_SPOOL_SEGMENT_BYTES',
+    '8388608').strip())
+SPLUNK_SPOOL_REPLAY_INTERVAL = float(os.getenv(
+    'SPLUNK_SPOOL_REPLAY_INTERVAL',
+    '5.0').strip())
+SPLUNK_QUEUE_MAX_BYTES = int(os.getenv(
+    'SPLUNK_QUEUE_MAX_BYTES',
+    '0').strip())
+SPLUNK_OVERFLOW_POLICY = os.getenv(
+    'SPLUNK_OVERFLOW_POLICY',
+    'drop-newest').strip()
+SPLUNK_OVERFLOW_LEVEL = os.getenv(
+    'SPLUNK_OVERFLOW_LEVEL',
+    'WARNING').strip()
+SPLUNK_OVERFLOW_BLOCK_TIMEOUT = float(os.getenv(
+    'SPLUNK_OVERFLOW_BLOCK_TIMEOUT',
+    '1.0').strip())
+SPLUNK_DROP_REPORT_INTERVAL = float(os.getenv(
+    'SPLUNK_DROP_REPORT_INTERVAL',
+    '60.0').strip())
+SPLUNK_PRIORITY_LANES = bool(os.getenv(
+    'SPLUNK_PRIORITY_LANES',
+    '0').strip() == '1')
+SPLUNK_PRIORITY_LEVEL = os.getenv(
+    'SPLUNK_PRIORITY_LEVEL',
+    'ERROR').strip()
+SPLUNK_PRIORITY_QUEUE_SIZE = int(os.getenv(
+    'SPLUNK_PRIORITY_QUEUE_SIZE',
+    '10000').strip())
+SPLUNK_PRIORITY_QUEUE_MAX_BYTES = int(os.getenv(
+    'SPLUNK_PRIORITY_QUEUE_MAX_BYTES',
+    '0').strip())
+SPLUNK_PRIORITY_WEIGHT = int(os.getenv(
+    'SPLUNK_PRIORITY_WEIGHT',
+    '4').strip())
+SPLUNK_ADAPTIVE_FLUSH = bool(os.getenv(
+    'SPLUNK_ADAPTIVE_FLUSH',
+    '0').strip() == '1')
+SPLUNK_TARGET_LATENCY_MS = int(os.getenv(
+    'SPLUNK_TARGET_LATENCY_MS',
+    '250').strip())
+SPLUNK_MAX_LINGER_MS = int(os.getenv(
+    'SPLUNK_MAX_LINGER_MS',
+    '1000').strip())
+SPLUNK_MIN_BATCH_BYTES = int(os.getenv(
+    'SPLUNK_MIN_BATCH_BYTES',
+    '16384').strip())
+SPLUNK_RETRY_MAX_BACKOFF = float(os.getenv(
+    'SPLUNK_RETRY_MAX_BACKOFF',
+    '60.0').strip())
+SPLUNK_RETRY_MAX_PENDING = int(os.getenv(
+    'SPLUNK_RETRY_MAX_PENDING',
+    '100').strip())
+SPLUNK_BREAKER_THRESHOLD = int(os.getenv(
+    'SPLUNK_BREAKER_THRESHOLD',
+    '5').strip())  # disable the circuit breaker = 0
+SPLUNK_BREAKER_RESET = float(os.getenv(
+    'SPLUNK_BREAKER_RESET',
+    '30.0').strip())
+SPLUNK_DEAD_LETTER_FILE = os.getenv(
+    'SPLUNK_DEAD_LETTER_FILE',
+    '').strip()  # drop rejected events = empty
+SPLUNK_FORWARDER_SOCKET = os.getenv(
+    'SPLUNK_FORWARDER_SOCKET',
+    '/tmp/spylunking-forwarder.sock').strip()
+SPLUNK_FORWARDER_SOCKET_TYPE = os.getenv(
+    'SPLUNK_FORWARDER_SOCKET_TYPE',
+    'stream').strip()  # stream or dgram
+SPLUNK_FORWARDER_MAX_EVENT_BYTES = int(os.getenv(
+    'SPLUNK_FORWARDER_MAX_EVENT_BYTES',
+    '212992').strip())
+SPLUNK_FORWARDER_SOCKET_MODE = int(os.getenv(
+    'SPLUNK_FORWARDER_SOCKET_MODE',
+    '660').strip(), 8)  # octal - 600 for only the daemon's user
+SPLUNK_MP_QUEUE_BACKEND = os.getenv(
+    'SPLUNK_MP_QUEUE_BACKEND',
+    'shm').strip()  # shm or manager
+SPLUNK_SHM_RING_BYTES = int(os.getenv(
+    'SPLUNK_SHM_RING_BYTES',
+    '16777216').strip())
+SPLUNK_MP_NUM_WORKERS = int(os.getenv(
+    'SPLUNK_MP_NUM_WORKERS',
+    '1').strip())
+SPLUNK_MP_SHARD_BY = os.getenv(
+    'SPLUNK_MP_SHARD_BY',
+    'round-robin').strip()  # round-robin or logger
+SPLUNK_MP_EMIT_BATCH_SIZE = int(os.getenv(
+    'SPLUNK_MP_EMIT_BATCH_SIZE',
+    '1').strip())
+SPLUNK_MP_EMIT_LINGER_MS = int(os.getenv(
+    'SPLUNK_MP_EMIT_LINGER_MS',
+    '50').strip())
+SPLUNK_SORT_KEYS = bool(os.getenv(
+    'SPLUNK_SORT_KEYS',
+    '1').strip() == '1')
+SPLUNK_EVENT_FORMAT = os.getenv(
+    'SPLUNK_EVENT_FORMAT',
+    'string').strip()  # string or object
+SPLUNK_INDEXED_FIELDS = os.getenv(
+    'SPLUNK_INDEXED_FIELDS',
+    '').strip()  # comma-separated keys ex: name,dc,env
+SPLUNK_JSON_ENCODER = os.getenv(
+    'SPLUNK_JSON_ENCODER',
+    'auto').strip()  # auto, orjson, ujson, rapidjson or json
+SPLUNK_QUEUE_BACKEND = os.getenv(
+    'SPLUNK_QUEUE_BACKEND',
+    'memory').strip()  # memory or manager
 SPLUNK_DEBUG = bool(os.getenv(
     'SPLUNK_DEBUG',
     '0').strip() == '1')
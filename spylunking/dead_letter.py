@@ -0,0 +1,87 @@
+"""
+Dead-letter sink for events HEC rejects
+
+When HEC rejects a batch because of one malformed event the publishers
+split the batch and resend the good events. The rejected events are
+handed to a dead-letter sink instead of being dropped with the rest of
+the batch. A sink is any callable taking ``event=<bytes>`` and
+``reason=<str>`` - for the ``MPSplunkPublisher`` it is called inside the
+worker process. ``DeadLetterFile`` appends every event as one JSON line
+to a file.
+
+::
+
+    export SPLUNK_DEAD_LETTER_FILE="<append rejected events here - empty drops>"
+
+"""
+
+import json
+import os
+import threading
+import time
+
+
+class DeadLetterFile(object):
+    """
+    Append rejected events to a JSON lines file
+    """
+
+    def __init__(
+            self,
+            path):
+        """__init__
+
+        :param path: file path for the rejected events
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.num_events = 0
+        dir_name = os.path.dirname(self.path)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+    # end of __init__
+
+    def __call__(
+            self,
+            event,
+            reason):
+        """__call__
+
+        Append one rejected event
+
+        :param event: event as ``str`` or ``bytes``
+        :param reason: why HEC rejected it
+        """
+        if isinstance(event, bytes):
+            event = event.decode('utf-8', 'replace')
+        line = '{}\n'.format(
+            json.dumps({
+                'time': time.time(),
+                'reason': reason,
+                'event': event
+            }))
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+            self.num_events += 1
+    # end of __call__
+
+# end of DeadLetterFile
+
+
+def build_dead_letter(
+        dead_letter):
+    """build_dead_letter
+
+    Return the dead-letter callable for a publisher
+    or None to drop rejected events
+
+    :param dead_letter: callable or file path
+    """
+    if callable(dead_letter):
+        return dead_letter
+    if dead_letter:
+        return DeadLetterFile(
+            path=dead_letter)
+    return None
+# end of build_dead_letter
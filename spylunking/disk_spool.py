@@ -0,0 +1,458 @@
+"""
+Disk-backed spill spool for the HEC publishers
+
+When Splunk is unreachable every failed batch and, for the
+``SplunkPublisher``, every record that did not fit in the memory queue
+would otherwise be dropped. The ``DiskSpool`` appends them to
+sequential segment files under ``spool_dir`` and a replay thread sends
+them back to HEC once it recovers, oldest segment first.
+
+Each record in a segment is a 4-byte big-endian length followed by the
+batch bytes, and every append is flushed and fsync'ed so a crash can
+only lose the frames being written. ``append_many`` writes a list of
+batches with one fsync. A truncated frame at the end of a
+segment is ignored on replay. Segments left over from a previous
+process are replayed when the spool starts.
+
+The spool stops accepting batches once it holds ``max_bytes`` and a
+new segment is started once the current one reaches ``segment_bytes``.
+Use one ``spool_dir`` per publisher process.
+
+Forked publisher processes spool below their parent's directory in
+``pid-<pid>`` directories. ``adopt_orphans`` moves the segments of
+``pid-<pid>`` directories whose process exited into a running spool so
+batches are not stranded when a prefork worker exits or is recycled.
+Each directory is claimed with an atomic rename so only one process
+adopts it.
+
+::
+
+    export SPLUNK_SPOOL_DIR="<directory for spooled batches - empty disables>"
+    export SPLUNK_SPOOL_MAX_BYTES="<max bytes on disk: 268435456>"
+    export SPLUNK_SPOOL_SEGMENT_BYTES="<bytes per segment file: 8388608>"
+    export SPLUNK_SPOOL_REPLAY_INTERVAL="<seconds between replays: 5.0>"
+
+"""
+
+import errno
+import os
+import shutil
+import struct
+import threading
+from spylunking.consts import IS_PY2
+
+
+SEGMENT_PREFIX = 'spool-'
+SEGMENT_SUFFIX = '.seg'
+FRAME_HEADER = struct.Struct('>I')
+PID_DIR_PREFIX = 'pid-'
+ADOPTED_DIR_PREFIX = 'adopted-'
+
+
+def pid_alive(
+        pid):
+    """pid_alive
+
+    Return True if a process with the pid is running
+
+    :param pid: process id
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM means the pid belongs to another user's process
+        return e.errno != errno.ESRCH
+    return True
+# end of pid_alive
+
+
+def get_orphan_pid(
+        dir_name):
+    """get_orphan_pid
+
+    Return the pid whose exit orphans a spool directory name -
+    ``pid-<pid>`` for a forked publisher or ``adopted-<pid>-<claimer>``
+    for a directory a process claimed but did not finish adopting -
+    or None if the name is not a spool directory
+
+    :param dir_name: directory name
+    """
+    if dir_name.startswith(PID_DIR_PREFIX):
+        pid = dir_name[len(PID_DIR_PREFIX):]
+    elif dir_name.startswith(ADOPTED_DIR_PREFIX):
+        pid = dir_name[len(ADOPTED_DIR_PREFIX):].partition('-')[2]
+    else:
+        return None
+    if not pid.isdigit():
+        return None
+    return int(pid)
+# end of get_orphan_pid
+
+
+def read_segment(
+        path):
+    """read_segment
+
+    Return the list of batches in a segment file and
+    skip a truncated frame at the end
+
+    :param path: segment file path
+    """
+    payloads = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(data):
+        size = FRAME_HEADER.unpack_from(data, offset)[0]
+        start = offset + FRAME_HEADER.size
+        if start + size > len(data):
+            break
+        payloads.append(data[start:start + size])
+        offset = start + size
+    return payloads
+# end of read_segment
+
+
+class DiskSpool(object):
+    """
+    Segment-file spool of batches waiting for HEC to recover
+    """
+
+    def __init__(
+            self,
+            spool_dir,
+            send_func,
+            max_bytes=268435456,
+            segment_bytes=8388608,
+            replay_interval=5.0,
+            name='spylunking-spool-replay'):
+        """__init__
+
+        :param spool_dir: directory for the segment files
+        :param send_func: function called with ``payload=<batch>``
+                          during replay that returns False when the
+                          batch should stay in the spool
+        :param max_bytes: maximum bytes held on disk
+        :param segment_bytes: start a new segment file once the
+                              current one holds this many bytes
+        :param replay_interval: seconds between replay attempts
+        :param name: replay thread name
+        """
+        self.spool_dir = spool_dir
+        self.send_func = send_func
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.replay_interval = replay_interval
+        self.name = name
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.active = None
+        self.active_path = None
+        self.active_bytes = 0
+        self.num_spooled = 0
+        self.num_replayed = 0
+        self.num_dropped = 0
+
+        if not os.path.isdir(self.spool_dir):
+            os.makedirs(self.spool_dir)
+
+        # segments left over from a previous process are replayed first
+        self.segments = sorted(
+            os.path.join(self.spool_dir, file_name)
+            for file_name in os.listdir(self.spool_dir)
+            if file_name.startswith(SEGMENT_PREFIX)
+            and file_name.endswith(SEGMENT_SUFFIX))
+        self.num_bytes = sum(
+            os.path.getsize(path)
+            for path in self.segments)
+        self.next_seq = 0
+        if self.segments:
+            self.next_seq = int(
+                os.path.basename(self.segments[-1])[
+                    len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1
+    # end of __init__
+
+    def start(
+            self):
+        """start
+
+        Start the replay thread
+        """
+        if self.thread:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self.run,
+            name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+    # end of start
+
+    def stop(
+            self,
+            timeout=None):
+        """stop
+
+        Stop the replay thread and close the current segment
+        so it is replayed by the next process
+
+        :param timeout: seconds to wait for the thread
+        """
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        with self.lock:
+            self.close_active()
+    # end of stop
+
+    def append(
+            self,
+            payload):
+        """append
+
+        Append a batch to the current segment and return
+        False if the spool is full and the batch was dropped
+
+        :param payload: batch as ``str`` or ``bytes``
+        """
+        return self.append_many(
+            payloads=[payload]) == 1
+    # end of append
+
+    def append_many(
+            self,
+            payloads):
+        """append_many
+
+        Append a list of batches in order with one fsync and return
+        how many were spooled - the batches after the first one that
+        does not fit are dropped
+
+        :param payloads: list of batches as ``str`` or ``bytes``
+        """
+        num_spooled = 0
+        with self.lock:
+            for payload in payloads:
+                if not IS_PY2 and not isinstance(payload, bytes):
+                    payload = payload.encode('utf-8')
+                frame_bytes = FRAME_HEADER.size + len(payload)
+                if self.num_bytes + frame_bytes > self.max_bytes:
+                    break
+                if (self.active is not None
+                        and self.active_bytes + frame_bytes
+                        > self.segment_bytes):
+                    self.sync_active()
+                    self.close_active()
+                if self.active is None:
+                    self.active_path = os.path.join(
+                        self.spool_dir,
+                        '{}{:012d}{}'.format(
+                            SEGMENT_PREFIX,
+                            self.next_seq,
+                            SEGMENT_SUFFIX))
+                    self.next_seq += 1
+                    self.active = open(self.active_path, 'ab')
+                    self.active_bytes = 0
+                self.active.write(FRAME_HEADER.pack(len(payload)))
+                self.active.write(payload)
+                self.active_bytes += frame_bytes
+                self.num_bytes += frame_bytes
+                num_spooled += 1
+            # end of for all batches
+            self.sync_active()
+            self.num_spooled += num_spooled
+            self.num_dropped += len(payloads) - num_spooled
+        return num_spooled
+    # end of append_many
+
+    def sync_active(
+            self):
+        """sync_active
+
+        Flush and fsync the current segment - the caller
+        must hold ``self.lock``
+        """
+        if self.active is not None:
+            self.active.flush()
+            os.fsync(self.active.fileno())
+    # end of sync_active
+
+    def adopt_orphans(
+            self,
+            base_dir):
+        """adopt_orphans
+
+        Move the segments of the spool directories under ``base_dir``
+        whose process exited into this spool and return the number of
+        adopted segments. A directory is claimed by renaming it to
+        ``adopted-<pid>-<this pid>`` first so two processes never
+        adopt the same segments.
+
+        :param base_dir: directory holding the ``pid-<pid>``
+                         spool directories
+        """
+        if not os.path.isdir(base_dir):
+            return 0
+        my_pid = os.getpid()
+        num_adopted = 0
+        for dir_name in sorted(os.listdir(base_dir)):
+            path = os.path.join(
+                base_dir,
+                dir_name)
+            pid = get_orphan_pid(
+                dir_name=dir_name)
+            if (pid is None
+                    or pid == my_pid
+                    or not os.path.isdir(path)
+                    or os.path.abspath(path) == os.path.abspath(
+                        self.spool_dir)
+                    or pid_alive(pid)):
+                continue
+            claimed_path = os.path.join(
+                base_dir,
+                '{}{}-{}'.format(
+                    ADOPTED_DIR_PREFIX,
+                    pid,
+                    my_pid))
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                # another process claimed it first
+                continue
+            segments = sorted(
+                file_name
+                for file_name in os.listdir(claimed_path)
+                if file_name.startswith(SEGMENT_PREFIX)
+                and file_name.endswith(SEGMENT_SUFFIX))
+            with self.lock:
+                for file_name in segments:
+                    new_path = os.path.join(
+                        self.spool_dir,
+                        '{}{:012d}{}'.format(
+                            SEGMENT_PREFIX,
+                            self.next_seq,
+                            SEGMENT_SUFFIX))
+                    self.next_seq += 1
+                    os.rename(
+                        os.path.join(claimed_path, file_name),
+                        new_path)
+                    self.segments.append(new_path)
+                    self.num_bytes += os.path.getsize(new_path)
+                    num_adopted += 1
+                # end of for all orphaned segments
+            shutil.rmtree(
+                claimed_path,
+                ignore_errors=True)
+        # end of for all spool directories
+        return num_adopted
+    # end of adopt_orphans
+
+    def close_active(
+            self):
+        """close_active
+
+        Close the current segment and queue it for replay - the
+        caller must hold ``self.lock``
+        """
+        if self.active is None:
+            return
+        self.active.close()
+        if self.active_bytes > 0:
+            self.segments.append(self.active_path)
+        else:
+            os.remove(self.active_path)
+        self.active = None
+        self.active_path = None
+        self.active_bytes = 0
+    # end of close_active
+
+    def replay(
+            self):
+        """replay
+
+        Send the spooled batches oldest first and return True
+        once the spool is empty. Replay stops at the first batch
+        ``send_func`` could not send and keeps it and every
+        later batch on disk.
+        """
+        while not self.stop_event.is_set():
+            with self.lock:
+                if not self.segments:
+                    self.close_active()
+                if not self.segments:
+                    return True
+                path = self.segments[0]
+            payloads = read_segment(
+                path=path)
+            for idx, payload in enumerate(payloads):
+                if not self.send_func(
+                        payload=payload):
+                    self.rewrite_segment(
+                        path=path,
+                        payloads=payloads[idx:])
+                    return False
+                self.num_replayed += 1
+            # end of for all batches in the segment
+            with self.lock:
+                self.num_bytes -= os.path.getsize(path)
+                os.remove(path)
+                self.segments.remove(path)
+        # end of while segments are left
+        return False
+    # end of replay
+
+    def rewrite_segment(
+            self,
+            path,
+            payloads):
+        """rewrite_segment
+
+        Replace a partially replayed segment with the batches that
+        still need to be sent
+
+        :param path: segment file path
+        :param payloads: batches left to send
+        """
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'wb') as f:
+            for payload in payloads:
+                f.write(FRAME_HEADER.pack(len(payload)))
+                f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            self.num_bytes -= (
+                os.path.getsize(path) - os.path.getsize(tmp_path))
+            os.rename(tmp_path, path)
+    # end of rewrite_segment
+
+    def run(
+            self):
+        """run
+
+        Replay thread loop that starts with any leftover segments
+        """
+        while True:
+            try:
+                self.replay()
+            except Exception:
+                # the send_func handles logging so keep replaying
+                pass
+            if self.stop_event.wait(self.replay_interval):
+                break
+        # end of while replaying
+    # end of run
+
+    def __len__(
+            self):
+        """__len__
+
+        Bytes held on disk
+        """
+        with self.lock:
+            return self.num_bytes
+    # end of __len__
+
+# end of DiskSpool
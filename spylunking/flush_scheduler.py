@@ -0,0 +1,184 @@
+"""
+Adaptive flush scheduling for the HEC publishers
+
+A fixed ``sleep_interval`` and ``linger_ms`` are wrong for both ends of
+the traffic range: a steady trickle of logs waits out the whole interval
+and a burst is sent in batches that are smaller than HEC can take. The
+``FlushScheduler`` plans every batch from the queue depth and the
+measured HEC POST latency instead:
+
+- when logs are waiting in the queue the batch does not linger and its
+  byte limit grows with the backlog up to ``max_batch_bytes``
+- when the queue is empty the batch lingers for the current
+  ``linger_ms`` so a trickle ships within milliseconds
+- the floor for ``linger_ms`` and the batch byte limit follow AIMD on
+  the request rate: every POST faster than ``target_latency_ms`` takes
+  ``linger_step_ms`` off the linger and every slow or failed POST
+  doubles the linger and the batch floor, so a struggling HEC gets
+  fewer, larger requests
+
+::
+
+    export SPLUNK_ADAPTIVE_FLUSH="<plan batches from depth and latency - 1|0>"
+    export SPLUNK_TARGET_LATENCY_MS="<slowest healthy HEC POST: 250>"
+    export SPLUNK_MAX_LINGER_MS="<longest adaptive linger: 1000>"
+    export SPLUNK_MIN_BATCH_BYTES="<smallest adaptive batch limit: 16384>"
+
+"""
+
+import threading
+
+
+class FlushScheduler(object):
+    """
+    AIMD planner for the batch byte limit and linger time
+    """
+
+    def __init__(
+            self,
+            min_batch_bytes=16384,
+            max_batch_bytes=524288,
+            min_linger_ms=0,
+            max_linger_ms=1000,
+            linger_step_ms=5,
+            target_latency_ms=250,
+            latency_weight=0.2):
+        """__init__
+
+        :param min_batch_bytes: smallest batch byte limit
+        :param max_batch_bytes: largest batch byte limit
+        :param min_linger_ms: shortest linger for a healthy HEC
+        :param max_linger_ms: longest linger for a struggling HEC
+        :param linger_step_ms: additive linger decrease per fast POST
+        :param target_latency_ms: POSTs slower than this back off
+        :param latency_weight: weight of the newest sample in the
+                               moving averages reported by ``stats``
+        """
+        self.min_batch_bytes = min(min_batch_bytes, max_batch_bytes)
+        self.max_batch_bytes = max_batch_bytes
+        self.min_linger_ms = min_linger_ms
+        self.max_linger_ms = max_linger_ms
+        self.linger_step_ms = linger_step_ms
+        self.target_latency_ms = target_latency_ms
+        self.latency_weight = latency_weight
+        self.lock = threading.Lock()
+        self.linger_ms = min_linger_ms
+        self.floor_batch_bytes = self.min_batch_bytes
+        self.batch_bytes = self.min_batch_bytes
+        self.latency_ms = 0.0
+        self.avg_record_bytes = 0.0
+        self.depth = 0
+        self.num_batches = 0
+        self.num_fast = 0
+        self.num_slow = 0
+    # end of __init__
+
+    def plan(
+            self,
+            batch,
+            depth):
+        """plan
+
+        Set the byte limit and linger time for the next batch
+
+        :param batch: ``BatchBuilder`` for the next batch
+        :param depth: number of logs waiting in the queue
+        """
+        with self.lock:
+            self.depth = depth
+            backlog_bytes = int(depth * self.avg_record_bytes)
+            self.batch_bytes = max(
+                self.floor_batch_bytes,
+                min(
+                    backlog_bytes,
+                    self.max_batch_bytes))
+            batch.max_bytes = self.batch_bytes
+            if depth > 0:
+                # logs are waiting so the batch fills without lingering
+                batch.linger_ms = 0
+            else:
+                batch.linger_ms = self.linger_ms
+    # end of plan
+
+    def record_batch(
+            self,
+            num_records,
+            num_bytes):
+        """record_batch
+
+        Track the average log size to turn queue depth into bytes
+
+        :param num_records: logs in the sent batch
+        :param num_bytes: bytes in the sent batch
+        """
+        if num_records <= 0:
+            return
+        with self.lock:
+            self.num_batches += 1
+            record_bytes = float(num_bytes) / num_records
+            if self.avg_record_bytes == 0.0:
+                self.avg_record_bytes = record_bytes
+            else:
+                self.avg_record_bytes += self.latency_weight * (
+                    record_bytes - self.avg_record_bytes)
+    # end of record_batch
+
+    def record_send(
+            self,
+            latency,
+            success=True):
+        """record_send
+
+        Apply AIMD to the linger and batch floor after a POST
+
+        :param latency: seconds the POST took
+        :param success: POST reached HEC
+        """
+        latency_ms = latency * 1000.0
+        with self.lock:
+            if self.latency_ms == 0.0:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms += self.latency_weight * (
+                    latency_ms - self.latency_ms)
+            if success and latency_ms <= self.target_latency_ms:
+                self.num_fast += 1
+                self.linger_ms = max(
+                    self.min_linger_ms,
+                    self.linger_ms - self.linger_step_ms)
+                self.floor_batch_bytes = max(
+                    self.min_batch_bytes,
+                    self.floor_batch_bytes - self.min_batch_bytes)
+            else:
+                self.num_slow += 1
+                self.linger_ms = min(
+                    self.max_linger_ms,
+                    max(
+                        self.linger_ms * 2,
+                        self.linger_step_ms))
+                self.floor_batch_bytes = min(
+                    self.max_batch_bytes,
+                    self.floor_batch_bytes * 2)
+    # end of record_send
+
+    def stats(
+            self):
+        """stats
+
+        Return the current scheduling decisions and measurements
+        """
+        with self.lock:
+            return {
+                'linger_ms': self.linger_ms,
+                'batch_bytes': self.batch_bytes,
+                'floor_batch_bytes': self.floor_batch_bytes,
+                'latency_ms': round(self.latency_ms, 3),
+                'avg_record_bytes': round(self.avg_record_bytes, 3),
+                'depth': self.depth,
+                'num_batches': self.num_batches,
+                'num_fast': self.num_fast,
+                'num_slow': self.num_slow
+            }
+    # end of stats
+
+# end of FlushScheduler
@@ -0,0 +1,495 @@
+"""
+Lightweight logging handler for the ``spylunking-forwarder`` daemon
+
+With many worker processes per host every ``SplunkPublisher`` opens its
+own HEC connections and runs its own batching, retries and worker
+threads. The ``ForwarderPublisher`` does none of that: it encodes each
+log record into a HEC event and hands it to the local
+``spylunking-forwarder`` daemon over a Unix domain socket with a single
+non-blocking ``sendmsg``. The daemon batches, compresses and retries
+the events for the whole host.
+
+Each frame on the socket is the record's level number, a space and the
+HEC event JSON followed by a newline. ``datagram`` sockets carry one
+frame per datagram and ``stream`` sockets carry newline-delimited
+frames. Frames without a level number are treated as INFO events.
+Linux queues only ``net.unix.max_dgram_qlen`` datagrams per socket
+(10 by default) so raise it before using ``dgram`` sockets.
+
+If the daemon is down or its socket buffer is full the record is
+dropped instead of blocking the application - ``get_stats`` reports
+the number of dropped records.
+
+Available environment variables:
+
+::
+
+    export SPLUNK_FORWARDER_SOCKET="<daemon unix socket path>"
+    export SPLUNK_FORWARDER_SOCKET_TYPE="<stream (default)|dgram>"
+    export SPLUNK_INDEX="<splunk index>"
+    export SPLUNK_SOURCE="<splunk source>"
+    export SPLUNK_SOURCETYPE="<splunk sourcetype>"
+    export SPLUNK_SORT_KEYS="<sort the HEC envelope keys - 1 (default)|0>"
+    export SPLUNK_EVENT_FORMAT="<string (default) JSON in a string|object>"
+    export SPLUNK_INDEXED_FIELDS="<comma-separated keys ex: name,dc,env>"
+    export SPLUNK_JSON_ENCODER="<auto (default)|orjson|ujson|rapidjson|json>"
+    export SPLUNK_DEBUG="<1 enable debug|0 off>"
+
+"""
+
+import errno
+import logging
+import os
+import socket
+import time
+import traceback
+from spylunking.rnow import rnow
+from spylunking.hec_envelope import EVENT_FORMATS
+from spylunking.hec_envelope import HecEnvelope
+from spylunking.hec_envelope import encode_event
+from spylunking.hec_envelope import encode_fields
+from spylunking.hec_envelope import get_indexed_fields
+from spylunking.json_encoder import get_json_encoder
+from spylunking.consts import IS_PY2
+from spylunking.consts import SPLUNK_FORWARDER_SOCKET
+from spylunking.consts import SPLUNK_FORWARDER_SOCKET_TYPE
+from spylunking.consts import SPLUNK_INDEX
+from spylunking.consts import SPLUNK_SOURCE
+from spylunking.consts import SPLUNK_SOURCETYPE
+from spylunking.consts import SPLUNK_SORT_KEYS
+from spylunking.consts import SPLUNK_EVENT_FORMAT
+from spylunking.consts import SPLUNK_INDEXED_FIELDS
+from spylunking.consts import SPLUNK_DEBUG
+
+
+SOCKET_TYPE_DGRAM = 'dgram'
+SOCKET_TYPE_STREAM = 'stream'
+
+# send errors that only mean the daemon could not take this record
+DROP_ERRNOS = (
+    errno.EAGAIN,
+    errno.EWOULDBLOCK,
+    errno.ENOBUFS,
+    errno.EMSGSIZE)
+
+
+def get_socket_type(
+        socket_type):
+    """get_socket_type
+
+    Return the ``socket`` module type for a socket type name
+
+    :param socket_type: ``dgram`` or ``stream``
+    """
+    if socket_type == SOCKET_TYPE_STREAM:
+        return socket.SOCK_STREAM
+    if socket_type == SOCKET_TYPE_DGRAM:
+        return socket.SOCK_DGRAM
+    raise ValueError(
+        'unsupported forwarder socket_type={} - please use: {} or {}'.format(
+            socket_type,
+            SOCKET_TYPE_DGRAM,
+            SOCKET_TYPE_STREAM))
+# end of get_socket_type
+
+
+def build_frame(
+        event,
+        levelno=logging.INFO):
+    """build_frame
+
+    Return the list of buffers for one forwarder frame
+
+    :param event: HEC event as a ``str`` or ``bytes``
+    :param levelno: logging level number of the record
+    """
+    if not IS_PY2 and not isinstance(event, bytes):
+        event = event.encode('utf-8')
+    return [
+        '{} '.format(levelno).encode('utf-8'),
+        event,
+        b'\n'
+    ]
+# end of build_frame
+
+
+def parse_frame(
+        frame):
+    """parse_frame
+
+    Return the level number and HEC event in a forwarder frame
+    as a tuple - frames without a level number are INFO events
+
+    :param frame: frame as ``bytes``
+    """
+    frame = frame.rstrip(b'\r\n')
+    head, sep, event = frame.partition(b' ')
+    if sep and head.isdigit():
+        return int(head), event
+    return logging.INFO, frame
+# end of parse_frame
+
+
+class ForwarderPublisher(logging.Handler):
+    """
+    A logging handler that sends encoded HEC events to the
+    local ``spylunking-forwarder`` daemon without blocking
+    """
+
+    def __init__(
+            self,
+            socket_path=None,
+            socket_type=None,
+            index=None,
+            hostname=None,
+            source=None,
+            sourcetype='json',
+            reconnect_interval=1.0,
+            max_pending_bytes=1048576,
+            sort_keys=None,
+            event_format=None,
+            indexed_fields=None,
+            json_encoder=None,
+            debug=False,
+            **kwargs):
+        """__init__
+
+        Initialize the ForwarderPublisher
+
+        :param socket_path: path to the daemon's Unix domain socket
+        :param socket_type: ``stream`` (default) or ``dgram``
+        :param index: Splunk index
+        :param hostname: hostname for the HEC events
+        :param source: source for log records
+        :param sourcetype: json
+        :param reconnect_interval: seconds to wait before connecting
+                                   again after the daemon went away
+        :param max_pending_bytes: most bytes a ``stream`` socket holds
+                                  back after a partial send before it
+                                  reconnects
+        :param sort_keys: sort the HEC envelope keys - the
+                          constant keys are encoded once either way
+        :param event_format: ``string`` sends each formatted log as
+                             a JSON string and ``object`` sends the
+                             dictionary from a formatter's
+                             ``format_event`` as a nested JSON object
+        :param indexed_fields: list or comma-separated string of
+                               drill-down keys like ``name,dc,env``
+                               to send as HEC indexed ``fields``
+        :param json_encoder: ``auto``, ``orjson``, ``ujson``,
+                             ``rapidjson`` or ``json`` encoder
+                             for the HEC events
+        :param debug: enable debug mode
+        """
+        logging.Handler.__init__(self)
+
+        self.socket_path = socket_path
+        if self.socket_path is None:
+            self.socket_path = SPLUNK_FORWARDER_SOCKET
+        self.socket_type = socket_type
+        if self.socket_type is None:
+            self.socket_type = SPLUNK_FORWARDER_SOCKET_TYPE
+        self.sock_type = get_socket_type(
+            self.socket_type)
+        self.index = index
+        if self.index is None:
+            self.index = SPLUNK_INDEX
+        self.source = source
+        if self.source is None:
+            self.source = SPLUNK_SOURCE
+        self.sourcetype = sourcetype
+        if self.sourcetype is None:
+            self.sourcetype = SPLUNK_SOURCETYPE
+        if hostname is None:
+            self.hostname = socket.gethostname()
+        else:
+            self.hostname = hostname
+        self.reconnect_interval = reconnect_interval
+        self.max_pending_bytes = max_pending_bytes
+        self.sort_keys = sort_keys
+        if self.sort_keys is None:
+            self.sort_keys = SPLUNK_SORT_KEYS
+        self.event_format = event_format
+        if self.event_format is None:
+            self.event_format = SPLUNK_EVENT_FORMAT
+        if self.event_format not in EVENT_FORMATS:
+            raise ValueError(
+                'unsupported event_format={} please use one of: {}'.format(
+                    self.event_format,
+                    EVENT_FORMATS))
+        self.indexed_fields = indexed_fields
+        if self.indexed_fields is None:
+            self.indexed_fields = SPLUNK_INDEXED_FIELDS
+        self.indexed_fields = get_indexed_fields(
+            self.indexed_fields)
+        self.json_encoder = get_json_encoder(
+            json_encoder)
+        self.debug = SPLUNK_DEBUG or debug
+        self.build_envelope()
+
+        self.sock = None
+        self.pid = None
+        self.retry_at = 0.0
+        # bytes of a partially sent stream frame
+        self.pending = b''
+        self.num_sent = 0
+        self.num_dropped = 0
+        self.num_connects = 0
+
+        self.debug_log(
+            'ready socket_path={} socket_type={}'.format(
+                self.socket_path,
+                self.socket_type))
+    # end of __init__
+
+    def write_log(
+            self,
+            log_message):
+        """write_log
+
+        Write logs to stdout
+
+        :param log_message: message to log
+        """
+        print('{} fwdpub {}'.format(
+            rnow(),
+            log_message))
+    # end of write_log
+
+    def debug_log(
+            self,
+            log_message):
+        """debug_log
+
+        Write logs that only show up in debug mode.
+        To turn on debugging with environment variables
+        please set this environment variable:
+
+        ::
+
+            export SPLUNK_DEBUG="1"
+
+        :param log_message: message to log
+        """
+        if self.debug:
+            print('{} fwdpub DEBUG {}'.format(
+                rnow(),
+                log_message))
+    # end of debug_log
+
+    def build_envelope(
+            self):
+        """build_envelope
+
+        Encode the HEC envelope fields that are the same for every
+        log - call it again after changing the ``hostname``,
+        ``index``, ``source`` or ``sourcetype``
+        """
+        self.envelope = HecEnvelope(
+            host=self.hostname,
+            index=self.index,
+            source=self.source,
+            sourcetype=self.sourcetype,
+            sort_keys=self.sort_keys,
+            fields=bool(self.indexed_fields),
+            encoder=self.json_encoder)
+    # end of build_envelope
+
+    def get_fields(
+            self,
+            record):
+        """get_fields
+
+        Return the HEC indexed ``fields`` for a log as JSON
+        text or None without ``indexed_fields``
+
+        :param record: log record
+        """
+        if not self.indexed_fields:
+            return None
+        return encode_fields(
+            handler=self,
+            record=record,
+            keys=self.indexed_fields)
+    # end of get_fields
+
+    def format_record(
+            self,
+            record):
+        """format_record
+
+        Convert a log record into a HEC event
+
+        :param record: message to format
+        """
+        return self.envelope.encode(
+            event=encode_event(
+                handler=self,
+                record=record,
+                event_format=self.event_format),
+            created=record.created,
+            source=record.pathname,
+            encoded=True,
+            fields=self.get_fields(
+                record))
+    # end of format_record
+
+    def emit(
+            self,
+            record):
+        """emit
+
+        Send the record to the forwarder daemon
+
+        :param record: LogRecord to send to Splunk
+                       https://docs.python.org/3/library/logging.html
+        """
+        try:
+            event = self.format_record(
+                record)
+        except Exception as e:
+            self.write_log(
+                'Exception in forwarder logging handler={}'.format(e))
+            self.write_log(
+                traceback.format_exc())
+            return
+
+        self.send_event(
+            event=event,
+            levelno=record.levelno)
+    # end of emit
+
+    def get_socket(
+            self):
+        """get_socket
+
+        Return the connected socket or None while the daemon
+        is unreachable. A forked child connects its own socket.
+        """
+        pid = os.getpid()
+        if self.sock is not None:
+            if self.pid == pid:
+                return self.sock
+            # the parent's socket is left for the parent to use
+            self.sock = None
+            self.pending = b''
+        now = time.time()
+        if now < self.retry_at:
+            return None
+        sock = None
+        try:
+            sock = socket.socket(
+                socket.AF_UNIX,
+                self.sock_type)
+            sock.connect(
+                self.socket_path)
+            sock.setblocking(False)
+        except (socket.error, OSError) as e:
+            if sock is not None:
+                sock.close()
+            self.retry_at = now + self.reconnect_interval
+            self.debug_log(
+                'failed connecting to {} ex={}'.format(
+                    self.socket_path,
+                    e))
+            return None
+        self.sock = sock
+        self.pid = pid
+        self.num_connects += 1
+        return self.sock
+    # end of get_socket
+
+    def close_socket(
+            self):
+        """close_socket
+
+        Close the socket so the next record reconnects
+        """
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+        self.sock = None
+        self.pending = b''
+        self.retry_at = time.time() + self.reconnect_interval
+    # end of close_socket
+
+    def send_event(
+            self,
+            event,
+            levelno=logging.INFO):
+        """send_event
+
+        Send one HEC event with a single non-blocking ``sendmsg``
+        and return False if it was dropped
+
+        :param event: HEC event as a ``str`` or ``bytes``
+        :param levelno: logging level number of the record
+        """
+        sock = self.get_socket()
+        if sock is None:
+            self.num_dropped += 1
+            return False
+        buffers = build_frame(
+            event=event,
+            levelno=levelno)
+        if self.pending:
+            buffers.insert(0, self.pending)
+        try:
+            if hasattr(sock, 'sendmsg'):
+                sent = sock.sendmsg(buffers)
+            else:
+                sent = sock.send(b''.join(buffers))
+        except (socket.error, OSError) as e:
+            self.num_dropped += 1
+            if e.errno not in DROP_ERRNOS:
+                self.debug_log(
+                    'lost the forwarder ex={}'.format(
+                        e))
+                self.close_socket()
+            return False
+
+        if self.sock_type == socket.SOCK_STREAM:
+            frame_bytes = sum(len(buf) for buf in buffers)
+            if sent < frame_bytes:
+                self.pending = b''.join(buffers)[sent:]
+                if len(self.pending) > self.max_pending_bytes:
+                    # the daemon discards the partial frame on reconnect
+                    self.num_dropped += 1
+                    self.close_socket()
+                    return False
+            else:
+                self.pending = b''
+        self.num_sent += 1
+        return True
+    # end of send_event
+
+    def get_stats(
+            self):
+        """get_stats
+
+        Return the number of sent and dropped records
+        """
+        return {
+            'sent': self.num_sent,
+            'dropped': self.num_dropped,
+            'connects': self.num_connects,
+            'pending_bytes': len(self.pending)
+        }
+    # end of get_stats
+
+    def close(
+            self):
+        """close"""
+        self.acquire()
+        try:
+            if self.sock is not None and self.pid == os.getpid():
+                self.sock.close()
+            self.sock = None
+        finally:
+            self.release()
+        logging.Handler.close(self)
+    # end of close
+
+# end of ForwarderPublisher
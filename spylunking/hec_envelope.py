@@ -0,0 +1,276 @@
+"""
+Pre-encoded HEC event envelopes
+
+The ``host``, ``index``, ``source`` and ``sourcetype`` of a HEC event
+are the same for every log a publisher sends, so ``HecEnvelope``
+encodes them once into a template and each log only encodes its
+``time`` and ``event``. With the ``json`` encoder the output matches
+``json.dumps`` of the envelope dictionary with or without
+``sort_keys``.
+
+With the ``string`` event format (the default) the formatted log is
+sent as a JSON string, so a JSON formatter's output is encoded twice
+and every quote in it is escaped. With the ``object`` event format a
+formatter with a ``format_event`` method (like the ``SplunkFormatter``)
+returns a dictionary that is encoded once as a nested JSON object.
+Splunk indexes the same ``_raw`` event either way.
+
+``indexed_fields`` names drill-down keys like ``name``, ``dc`` and
+``env`` to send as HEC indexed ``fields`` with every event so searches
+can filter on them with ``key::value`` or ``tstats`` instead of
+extracting them from every event at search time. The values come from
+the formatter's ``get_current_fields`` (the ``LOG_FIELDS_DICT`` fields
+of a ``SplunkFormatter``) or the log record's ``extra`` attributes.
+The ``raw`` endpoint does not support indexed fields.
+
+Each log's ``event``, ``source`` and ``fields`` are encoded with the
+publisher's ``JsonEncoder`` (``SPLUNK_JSON_ENCODER``).
+
+::
+
+    export SPLUNK_SORT_KEYS="<sort the HEC envelope keys - 1 (default)|0>"
+    export SPLUNK_EVENT_FORMAT="<string (default) JSON in a string|object>"
+    export SPLUNK_INDEXED_FIELDS="<comma-separated keys ex: name,dc,env>"
+    export SPLUNK_JSON_ENCODER="<auto (default)|orjson|ujson|rapidjson|json>"
+
+"""
+
+import json
+from spylunking.json_encoder import get_json_encoder
+
+
+EVENT_FORMAT_STRING = 'string'
+EVENT_FORMAT_OBJECT = 'object'
+EVENT_FORMATS = [
+    EVENT_FORMAT_STRING,
+    EVENT_FORMAT_OBJECT
+]
+
+ENVELOPE_KEYS = [
+    'time',
+    'host',
+    'index',
+    'source',
+    'sourcetype',
+    'fields',
+    'event'
+]
+
+
+class HecEnvelope(object):
+    """
+    Encode HEC event envelopes from a template holding
+    the fields that do not change between logs
+    """
+
+    def __init__(
+            self,
+            host=None,
+            index=None,
+            source=None,
+            sourcetype=None,
+            sort_keys=True,
+            fields=False,
+            encoder=None):
+        """__init__
+
+        :param host: hostname for the events
+        :param index: Splunk index
+        :param source: source for the events with None using
+                       each log's ``source`` passed to ``encode``
+        :param sourcetype: Splunk sourcetype
+        :param sort_keys: sort the envelope keys like
+                          ``json.dumps(sort_keys=True)``
+        :param fields: envelopes carry the indexed ``fields``
+                       passed to ``encode``
+        :param encoder: ``JsonEncoder`` or encoder name for
+                        each log's ``event`` and ``source``
+        """
+        self.host = host
+        self.index = index
+        self.source = source
+        self.sourcetype = sourcetype
+        self.sort_keys = sort_keys
+        self.fields = fields
+        self.encoder = get_json_encoder(
+            encoder)
+        self.template = None
+        self.build()
+    # end of __init__
+
+    def build(
+            self):
+        """build
+
+        Encode the constant fields into ``self.template``
+        """
+        constants = {
+            'host': self.host,
+            'index': self.index,
+            'sourcetype': self.sourcetype
+        }
+        if self.source is not None:
+            constants['source'] = self.source
+        keys = ENVELOPE_KEYS
+        if not self.fields:
+            keys = [
+                key for key in keys
+                if key != 'fields'
+            ]
+        if self.sort_keys:
+            keys = sorted(keys)
+        parts = []
+        for key in keys:
+            if key in constants:
+                value = json.dumps(
+                    constants[key]).replace('%', '%%')
+            else:
+                value = '%({})s'.format(
+                    key)
+            parts.append(
+                '{}: {}'.format(
+                    json.dumps(key).replace('%', '%%'),
+                    value))
+        self.template = '{' + ', '.join(parts) + '}'
+    # end of build
+
+    def encode(
+            self,
+            event,
+            created,
+            source=None,
+            encoded=False,
+            fields=None):
+        """encode
+
+        Return the HEC event envelope for one log as a ``str``
+
+        :param event: formatted log
+        :param created: log time in seconds since the epoch
+        :param source: source for the log when the
+                       envelope has no ``source``
+        :param encoded: ``event`` is already JSON text
+                        like the output of ``encode_event``
+        :param fields: indexed fields as JSON text
+                       from ``encode_fields``
+        """
+        if not encoded:
+            event = self.encoder.dumps(
+                event)
+        values = {
+            'time': float.__repr__(float(created)),
+            'event': event
+        }
+        if self.source is None:
+            values['source'] = self.encoder.dumps(
+                source)
+        if self.fields:
+            values['fields'] = fields or '{}'
+        return self.template % values
+    # end of encode
+
+# end of HecEnvelope
+
+
+def encode_event(
+        handler,
+        record,
+        event_format=EVENT_FORMAT_STRING):
+    """encode_event
+
+    Return the HEC ``event`` for a log record as JSON text
+
+    :param handler: publisher formatting the record - only a
+                    formatter with a ``format_event`` method returning
+                    a dictionary can send ``object`` events
+    :param record: ``logging.LogRecord`` to format
+    :param event_format: ``string`` or ``object``
+    """
+    encoder = get_json_encoder(
+        getattr(handler, 'json_encoder', None))
+    formatter = handler.formatter
+    format_event = getattr(
+        formatter,
+        'format_event',
+        None)
+    if event_format == EVENT_FORMAT_OBJECT and format_event is not None:
+        event = format_event(
+            record)
+        # keep the formatter's handling of datetimes and other extras
+        jsonify = getattr(
+            formatter,
+            'jsonify_log_record',
+            None)
+        if jsonify is not None:
+            return jsonify(
+                event)
+        return encoder.dumps(
+            event)
+    return encoder.dumps(
+        handler.format(record))
+# end of encode_event
+
+
+def get_indexed_fields(
+        indexed_fields):
+    """get_indexed_fields
+
+    Return the list of indexed field keys
+
+    :param indexed_fields: list of keys or a
+                           comma-separated string of keys
+    """
+    if not indexed_fields:
+        return []
+    if isinstance(indexed_fields, (list, tuple)):
+        keys = indexed_fields
+    else:
+        keys = indexed_fields.split(',')
+    return [
+        key.strip()
+        for key in keys
+        if key.strip()
+    ]
+# end of get_indexed_fields
+
+
+def encode_fields(
+        handler,
+        record,
+        keys):
+    """encode_fields
+
+    Return the HEC indexed ``fields`` for a log record as JSON
+    text. HEC only indexes string values (or lists of them) and
+    keys without a value are left out.
+
+    :param handler: publisher formatting the record
+    :param record: ``logging.LogRecord`` to format
+    :param keys: list of indexed field keys
+    """
+    current = {}
+    get_current_fields = getattr(
+        handler.formatter,
+        'get_current_fields',
+        None)
+    if get_current_fields is not None:
+        current = get_current_fields() or {}
+    fields = {}
+    for key in keys:
+        value = current.get(key)
+        if value is None:
+            value = record.__dict__.get(key)
+        if value is None or value == '':
+            continue
+        if isinstance(value, (list, tuple)):
+            fields[key] = [
+                str(item)
+                for item in value
+            ]
+        else:
+            fields[key] = str(value)
+    return get_json_encoder(
+        getattr(handler, 'json_encoder', None)).dumps(
+            fields,
+            sort_keys=True)
+# end of encode_fields
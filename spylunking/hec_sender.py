@@ -0,0 +1,672 @@
+"""
+HEC send, retry, spool and ack logic shared by the publishers
+
+``SplunkPublisher`` and ``MPSplunkPublisher`` both mix in ``HecSender``
+for building the HEC urls and envelopes, filling batches from their
+queues, POSTing batches, bisecting rejected batches, retrying,
+spooling and dead-lettering batches that could not be sent and
+tracking HEC indexer acknowledgments. The publishers own the queues,
+threads and processes and set the attributes these methods use in
+their ``__init__``.
+"""
+
+import collections
+import json
+import logging
+import time
+import traceback
+import spylunking.send_to_splunk as send_to_splunk
+from spylunking.send_to_splunk import HEC_ENDPOINT_RAW
+from spylunking.ppj import ppj
+from spylunking.hec_envelope import HecEnvelope
+from spylunking.hec_envelope import encode_fields
+from spylunking.retry_scheduler import get_backoff
+
+
+class HecSender(object):
+    """
+    Mixin for the HEC publishers that sends, retries,
+    spools and acknowledges batches
+    """
+
+    def build_urls(
+            self):
+        """build_urls
+
+        Build the HEC collector and ack urls for the ``self.channel``
+        """
+        self.url = send_to_splunk.build_collector_url(
+            host=self.host,
+            port=self.port,
+            endpoint=self.endpoint,
+            channel=self.channel,
+            hostname=self.hostname,
+            index=self.index,
+            source=self.source,
+            sourcetype=self.sourcetype)
+        self.ack_url = send_to_splunk.build_ack_url(
+            host=self.host,
+            port=self.port,
+            channel=self.channel)
+    # end of build_urls
+
+    def build_envelope(
+            self):
+        """build_envelope
+
+        Encode the HEC envelope fields that are the same for every
+        log - call it again after changing the ``hostname``,
+        ``index``, ``source`` or ``sourcetype``
+        """
+        self.envelope = HecEnvelope(
+            host=self.hostname,
+            index=self.index,
+            source=self.source,
+            sourcetype=self.sourcetype,
+            sort_keys=self.sort_keys,
+            fields=bool(self.indexed_fields),
+            encoder=self.json_encoder)
+    # end of build_envelope
+
+    def get_fields(
+            self,
+            record):
+        """get_fields
+
+        Return the HEC indexed ``fields`` for a log as JSON
+        text or None without ``indexed_fields``
+
+        :param record: log record
+        """
+        if not self.indexed_fields:
+            return None
+        return encode_fields(
+            handler=self,
+            record=record,
+            keys=self.indexed_fields)
+    # end of get_fields
+
+    def read_queue(
+            self,
+            use_queue,
+            timeout=None):
+        """read_queue
+
+        Take as many logs as fit in the ``self.batch`` from the queue
+        in one call and return a tuple of True if any came from a
+        priority lane and the list of logs. A new batch wakes up for
+        its first log while a lingering batch only wakes up once
+        enough logs to fill it are queued.
+
+        :param use_queue: queue holding the messages
+        :param timeout: seconds to wait with None waiting
+                        for a log or a ``wake``
+        """
+        if self.pending:
+            msgs = self.pending
+            self.pending = []
+            return self.pending_priority, msgs
+        room = self.batch.room()
+        min_items = 1
+        if len(self.batch) > 0 and self.batch.linger_ms > 0:
+            min_items = room
+        return use_queue.get_many(
+            max_items=room,
+            timeout=timeout,
+            min_items=min_items)
+    # end of read_queue
+
+    def fill_batch(
+            self,
+            priority,
+            msgs):
+        """fill_batch
+
+        Add logs to the ``self.batch`` and keep the ones that
+        did not fit for the next batch
+
+        :param priority: logs came from a priority lane
+        :param msgs: list of formatted logs
+        """
+        for idx, msg in enumerate(msgs):
+            self.batch.add(
+                msg,
+                priority=priority)
+            if self.batch.is_full():
+                self.pending = msgs[idx + 1:]
+                self.pending_priority = priority
+                return
+    # end of fill_batch
+
+    def get_read_timeout(
+            self,
+            use_queue=None):
+        """get_read_timeout
+
+        Seconds to block on the queue for the next message. A batch
+        holding messages only waits out the rest of its ``linger_ms``
+        while an empty batch waits (None) until the first message
+        arrives or the queue is woken up on shutdown. An empty batch
+        only waits until the next drop report is due once the queue
+        dropped messages, so an idle queue still reports them.
+
+        :param use_queue: queue holding the messages
+        """
+        if len(self.batch) > 0:
+            if self.batch.linger_ms > 0:
+                return self.batch.linger_remaining()
+            return None
+        if use_queue is not None and use_queue.has_dropped():
+            return max(
+                0.0,
+                self.last_drop_report
+                + self.drop_report_interval
+                - time.time())
+        return None
+    # end of get_read_timeout
+
+    def plan_batch(
+            self,
+            use_queue):
+        """plan_batch
+
+        Let the ``self.scheduler`` set the byte limit and linger
+        for a new batch from the queue depth
+
+        :param use_queue: queue holding the messages
+        """
+        if self.scheduler is not None and len(self.batch) == 0:
+            self.scheduler.plan(
+                batch=self.batch,
+                depth=use_queue.qsize())
+    # end of plan_batch
+
+    def add_drop_report(
+            self,
+            use_queue):
+        """add_drop_report
+
+        Every ``drop_report_interval`` seconds add one event to the
+        ``self.batch`` counting the logs the queue dropped instead
+        of printing a line for each dropped log
+
+        :param use_queue: queue holding the messages
+        """
+        now = time.time()
+        if now - self.last_drop_report < self.drop_report_interval:
+            return
+        self.last_drop_report = now
+        num_dropped, num_dropped_bytes = use_queue.pop_dropped()
+        if num_dropped == 0:
+            return
+        msg = (
+            '{} log records dropped ({} bytes) queue_size={} '
+            'queue_max_bytes={} overflow_policy={}').format(
+                num_dropped,
+                num_dropped_bytes,
+                self.queue_size,
+                self.queue_max_bytes,
+                self.overflow_policy)
+        self.write_log(msg)
+        try:
+            self.batch.add(
+                self.format_record(
+                    logging.LogRecord(
+                        name=__name__,
+                        level=logging.WARNING,
+                        pathname=__file__,
+                        lineno=0,
+                        msg=msg,
+                        args=None,
+                        exc_info=None)))
+        except Exception as e:
+            self.write_log(
+                'failed adding the dropped report with ex={}'.format(
+                    e))
+    # end of add_drop_report
+
+    def send_payload(
+            self,
+            payload,
+            resend=False,
+            spool_on_failure=True,
+            attempt=0,
+            rejected=None):
+        """send_payload
+
+        POST a batch to the Splunk endpoint. This runs on the
+        worker or on a ``self.sender_pool`` thread.
+
+        :param payload: batch to send to Splunk
+        :param resend: batch is being resent by the ``self.ack_tracker``
+                       so do not wait for room in the ack window
+        :param spool_on_failure: retry or spool the batch if Splunk
+                                 could not be reached - the spool
+                                 replay keeps its own batches
+        :param attempt: number of times the batch was retried
+        :param rejected: list that collects ``(payload, error)`` when
+                         HEC rejects the batch instead of splitting it
+
+        Returns False if the batch could not be sent and
+        should be tried again later
+        """
+        use_payload = payload
+        url = self.url
+        start_time = None
+        self.debug_log('splunk url={}'.format(
+            url))
+
+        if not self.breaker.allow():
+            # HEC keeps failing so hold the batch without a POST
+            self.debug_log(
+                'circuit breaker open - not sending')
+            if spool_on_failure:
+                # jitter spreads the held batches past the probe
+                self.defer_payload(
+                    payload=payload,
+                    attempt=attempt,
+                    delay=self.breaker.remaining() + get_backoff(
+                        attempt=1,
+                        backoff=self.retry_backoff,
+                        max_backoff=self.retry_max_backoff))
+            return False
+
+        if self.ack_tracker is not None and not resend:
+            while not self.ack_tracker.wait_for_room(
+                    timeout=self.ack_poll_interval):
+                self.debug_log(
+                    'ack window full pending={}'.format(
+                        len(self.ack_tracker)))
+                if self.is_shutting_down(
+                        shutdown_event=self.shutdown_event):
+                    break
+        # end of waiting for room in the ack window
+
+        try:
+            if self.debug:
+                try:
+                    msg_dict = json.loads(use_payload)
+                    if not isinstance(msg_dict['event'], dict):
+                        msg_dict['event'] = json.loads(
+                            msg_dict['event'])
+                    self.debug_log((
+                        'sending payload: {}').format(
+                            ppj(msg_dict)))
+                except Exception:
+                    self.debug_log((
+                        'sending data payload: {}').format(
+                            use_payload))
+            headers = {
+                'Authorization': 'Splunk {}'.format(
+                    self.token)
+            }
+            if self.endpoint == HEC_ENDPOINT_RAW or self.use_ack:
+                headers['X-Splunk-Request-Channel'] = self.channel
+            if self.compress:
+                use_payload, compressed = \
+                    send_to_splunk.compress_payload(
+                        data=use_payload,
+                        level=self.compress_level,
+                        min_bytes=self.compress_min_bytes)
+                if compressed:
+                    headers['Content-Encoding'] = 'gzip'
+            start_time = time.time()
+            response = send_to_splunk.send_to_splunk(
+                session=self.session,
+                url=url,
+                data=use_payload,
+                headers=headers,
+                verify=self.verify,
+                timeout=self.timeout)
+            self.breaker.record_success()
+            if self.scheduler is not None:
+                self.scheduler.record_send(
+                    latency=time.time() - start_time)
+            if self.ack_tracker is not None:
+                self.track_ack(
+                    response=response,
+                    payload=payload)
+            self.debug_log('payload sent success')
+        except Exception as e:
+            try:
+                self.write_log(
+                    'Exception in Splunk logging handler: {}'.format(
+                        e))
+                self.write_log(traceback.format_exc())
+            except Exception:
+                self.debug_log(
+                    'Exception encountered,'
+                    'but traceback could not be formatted')
+            if not send_to_splunk.is_retryable_error(e):
+                # HEC answered so it is up
+                self.breaker.record_success()
+                if rejected is not None:
+                    rejected.append((
+                        payload,
+                        e))
+                else:
+                    self.handle_rejected_payload(
+                        payload=payload,
+                        error=e,
+                        attempt=attempt)
+                return True
+            self.breaker.record_failure()
+            if self.scheduler is not None and start_time:
+                self.scheduler.record_send(
+                    latency=time.time() - start_time,
+                    success=False)
+            if spool_on_failure:
+                self.defer_payload(
+                    payload=payload,
+                    attempt=attempt + 1,
+                    delay=get_backoff(
+                        attempt=attempt + 1,
+                        backoff=self.retry_backoff,
+                        max_backoff=self.retry_max_backoff))
+            return False
+        return True
+    # end of send_payload
+
+    def handle_rejected_payload(
+            self,
+            payload,
+            error,
+            attempt=0):
+        """handle_rejected_payload
+
+        Split a batch HEC rejected for its content or size and resend
+        the parts so one malformed event does not drop the whole batch.
+        With an ``invalid-event-number`` in the error body HEC already
+        indexed the events before it, so that event goes to the
+        ``self.dead_letter`` sink and only the events after it are
+        resent. Without one the batch is bisected until the rejected
+        events are isolated.
+
+        :param payload: batch HEC rejected
+        :param error: exception raised by ``send_to_splunk``
+        :param attempt: retry number of the batch
+        """
+        work = collections.deque([(
+            send_to_splunk.split_payload(
+                payload=payload,
+                endpoint=self.endpoint),
+            error)])
+        while work:
+            events, error = work.popleft()
+            reason = str(error)
+            if len(events) <= 1 or not send_to_splunk.is_split_error(error):
+                for event in events:
+                    self.send_dead_letter(
+                        event=event,
+                        reason=reason)
+                continue
+            invalid = send_to_splunk.get_invalid_event_number(error)
+            if invalid is not None and 0 <= invalid < len(events):
+                self.send_dead_letter(
+                    event=events[invalid],
+                    reason=reason)
+                parts = [events[invalid + 1:]]
+            else:
+                middle = len(events) // 2
+                parts = [events[:middle], events[middle:]]
+            for part in parts:
+                if not part:
+                    continue
+                self.debug_log(
+                    'resending {} events of a rejected batch'.format(
+                        len(part)))
+                rejected = []
+                self.send_payload(
+                    payload=b''.join(part),
+                    resend=True,
+                    attempt=attempt,
+                    rejected=rejected)
+                for part_payload, part_error in rejected:
+                    work.append((
+                        part,
+                        part_error))
+            # end of for all parts
+        # end of while rejected parts are left
+    # end of handle_rejected_payload
+
+    def send_dead_letter(
+            self,
+            event,
+            reason):
+        """send_dead_letter
+
+        Hand an event HEC rejected to the ``self.dead_letter`` sink
+
+        :param event: rejected event
+        :param reason: HEC error
+        """
+        self.num_dead_letters += 1
+        if self.dead_letter is None:
+            self.debug_log(
+                'dropping rejected event={}'.format(
+                    event))
+            return
+        try:
+            self.dead_letter(
+                event=event,
+                reason=reason)
+        except Exception as e:
+            self.write_log(
+                'failed to dead-letter a rejected event with ex={}'.format(
+                    e))
+    # end of send_dead_letter
+
+    def keep_unsent(
+            self,
+            payloads,
+            reason):
+        """keep_unsent
+
+        Spool the batches that are still unsent at shutdown and
+        hand the ones the spool cannot take to the
+        ``self.dead_letter`` sink. Returns a tuple of the number
+        of spooled, dead-lettered and dropped batches.
+
+        :param payloads: list of unsent batches
+        :param reason: why the batches were not sent
+        """
+        num_spooled = 0
+        num_dead_letters = 0
+        for payload in payloads:
+            if self.spool is not None and self.spool.append(
+                    payload=payload):
+                num_spooled += 1
+            elif self.dead_letter is not None:
+                self.send_dead_letter(
+                    event=payload,
+                    reason=reason)
+                num_dead_letters += 1
+        # end of for all unsent batches
+        num_dropped = len(payloads) - num_spooled - num_dead_letters
+        if num_dead_letters or num_dropped:
+            self.write_log(
+                'shutdown - {} batches {} - spooled={} '
+                'dead-lettered={} dropped={}'.format(
+                    len(payloads),
+                    reason,
+                    num_spooled,
+                    num_dead_letters,
+                    num_dropped))
+        return num_spooled, num_dead_letters, num_dropped
+    # end of keep_unsent
+
+    def retry_payload(
+            self,
+            payload,
+            attempt):
+        """retry_payload
+
+        Send a batch again from the ``self.retry_scheduler``
+
+        :param payload: batch to resend
+        :param attempt: retry number
+        """
+        self.debug_log(
+            'retrying batch attempt={}'.format(
+                attempt))
+        self.send_payload(
+            payload=payload,
+            attempt=attempt)
+    # end of retry_payload
+
+    def defer_payload(
+            self,
+            payload,
+            attempt,
+            delay):
+        """defer_payload
+
+        Hand a batch that was not sent to the ``self.retry_scheduler``
+        while it has retries left. While the ``self.breaker`` is open
+        the batch goes to the ``self.spool`` instead and it is dropped
+        once there is nowhere left to keep it.
+
+        :param payload: batch that was not sent
+        :param attempt: retry number for the next try
+        :param delay: seconds to wait before the next try
+        """
+        retry = bool(
+            self.retry_scheduler is not None
+            and attempt <= self.retry_count)
+        if self.spool is not None and not self.breaker.is_closed():
+            # divert to disk while HEC is down
+            retry = False
+        if retry and self.retry_scheduler.schedule(
+                payload=payload,
+                attempt=attempt,
+                delay=delay):
+            self.debug_log(
+                'retrying batch in {:.2f}s attempt={}'.format(
+                    delay,
+                    attempt))
+            return
+        if self.spool is not None:
+            if self.spool.append(
+                    payload=payload):
+                self.debug_log(
+                    'spooled batch to disk')
+                return
+            self.write_log(
+                'spool full - log data will be dropped.')
+            return
+        self.write_log(
+            'batch could not be sent or retried - '
+            'log data will be dropped.')
+    # end of defer_payload
+
+    def get_retry_stats(
+            self):
+        """get_retry_stats
+
+        Return the circuit breaker state, the number of batches
+        waiting for a retry and the number of rejected events
+        """
+        stats = self.breaker.stats()
+        stats['dead_letters'] = self.num_dead_letters
+        stats['retry_pending'] = 0
+        if self.retry_scheduler is not None:
+            stats['retry_pending'] = len(self.retry_scheduler)
+        return stats
+    # end of get_retry_stats
+
+    def replay_payload(
+            self,
+            payload):
+        """replay_payload
+
+        Send a batch from the ``self.spool`` and return False
+        to keep it in the spool
+
+        :param payload: spooled batch
+        """
+        return self.send_payload(
+            payload=payload,
+            spool_on_failure=False)
+    # end of replay_payload
+
+    def resend_payload(
+            self,
+            payload):
+        """resend_payload
+
+        Resend a batch that HEC did not acknowledge in time
+
+        :param payload: batch to resend
+        """
+        self.debug_log(
+            'resending unacknowledged batch')
+        self.send_payload(
+            payload=payload,
+            resend=True)
+    # end of resend_payload
+
+    def track_ack(
+            self,
+            response,
+            payload):
+        """track_ack
+
+        Hold a sent batch in the ``self.ack_tracker`` window
+        until HEC acknowledges its ``ackId``
+
+        :param response: HEC response for the batch
+        :param payload: batch that was sent
+        """
+        ack_id = None
+        try:
+            ack_id = response.json().get(
+                'ackId',
+                None)
+        except Exception:
+            ack_id = None
+        if ack_id is None:
+            self.debug_log(
+                'no ackId in the HEC response - please confirm '
+                'indexer acknowledgment is enabled for the token')
+            return
+        self.ack_tracker.add(
+            ack_id=ack_id,
+            payload=payload)
+    # end of track_ack
+
+    def poll_acks(
+            self,
+            ack_ids):
+        """poll_acks
+
+        Ask HEC which batches are indexed with one request for
+        all pending ``ackId`` values and return the ``acks`` dictionary
+
+        :param ack_ids: list of pending ``ackId`` values
+        """
+        try:
+            response = send_to_splunk.send_to_splunk(
+                session=self.session,
+                url=self.ack_url,
+                data=json.dumps({
+                    'acks': ack_ids
+                }),
+                headers={
+                    'Authorization': 'Splunk {}'.format(
+                        self.token),
+                    'X-Splunk-Request-Channel': self.channel
+                },
+                verify=self.verify,
+                timeout=self.timeout)
+            return response.json().get(
+                'acks',
+                {})
+        except Exception as e:
+            self.write_log(
+                'Failed polling acks={} with ex={}'.format(
+                    len(ack_ids),
+                    e))
+        return None
+    # end of poll_acks
+
+# end of HecSender
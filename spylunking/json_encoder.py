@@ -0,0 +1,284 @@
+"""
+Pluggable JSON encoders
+
+``SplunkFormatter`` and the publishers encode every log with a
+``JsonEncoder``. With ``auto`` (the default) it uses the fastest
+installed encoder of ``orjson``, ``ujson`` and ``rapidjson`` and falls
+back to the standard library ``json`` module. Values JSON does not
+support (datetimes, exceptions, UUIDs, enums, bytes, dataclasses and
+other extras) go through the same ``json_default`` with every encoder
+so a log reads the same whichever encoder is installed. An encoder
+that fails on a value (like an integer too big for ``orjson``) falls
+back to ``json`` for that log.
+
+::
+
+    export SPLUNK_JSON_ENCODER="<auto (default)|orjson|ujson|rapidjson|json>"
+
+The logging JSON configs can pick an encoder for a formatter:
+
+::
+
+    "splunk": {
+      "()": "spylunking.log.setup_logging.SplunkFormatter",
+      "json_encoder": "orjson"
+    }
+
+"""
+
+import base64
+import datetime
+import importlib
+import json
+import traceback
+import types
+import uuid
+from spylunking.consts import SPLUNK_JSON_ENCODER
+try:
+    # python 3.7 and newer
+    import dataclasses
+except ImportError:
+    dataclasses = None
+try:
+    # python 3.4 and newer or the enum34 backport
+    import enum
+except ImportError:
+    enum = None
+
+
+JSON_ENCODER_AUTO = 'auto'
+JSON_ENCODER_ORJSON = 'orjson'
+JSON_ENCODER_UJSON = 'ujson'
+JSON_ENCODER_RAPIDJSON = 'rapidjson'
+JSON_ENCODER_JSON = 'json'
+# fastest first for auto
+JSON_ENCODERS = [
+    JSON_ENCODER_ORJSON,
+    JSON_ENCODER_UJSON,
+    JSON_ENCODER_RAPIDJSON,
+    JSON_ENCODER_JSON
+]
+
+encoders = {}
+
+
+def json_default(
+        obj):
+    """json_default
+
+    Convert a value JSON does not support into one it does - this
+    matches the ``python-json-logger`` ``JsonEncoder``
+
+    :param obj: value to convert
+    """
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, BaseException):
+        return '{}: {}'.format(
+            obj.__class__.__name__,
+            obj)
+    if isinstance(obj, types.TracebackType):
+        return ''.join(traceback.format_tb(obj)).strip()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if enum is not None:
+        if isinstance(obj, enum.Enum):
+            return obj.value
+        if isinstance(obj, enum.EnumMeta):
+            return [
+                member.value
+                for member in obj
+            ]
+    if isinstance(obj, (bytes, bytearray)):
+        return base64.urlsafe_b64encode(obj).decode('utf-8')
+    if (dataclasses is not None
+            and dataclasses.is_dataclass(obj)
+            and not isinstance(obj, type)):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, type):
+        return obj.__name__
+    try:
+        return str(obj)
+    except Exception:
+        pass
+    try:
+        return repr(obj)
+    except Exception:
+        pass
+    return '__could_not_encode__'
+# end of json_default
+
+
+class JsonEncoder(object):
+    """
+    Encode logs with the fastest installed JSON encoder
+    """
+
+    def __init__(
+            self,
+            name=None):
+        """__init__
+
+        :param name: ``auto``, ``orjson``, ``ujson``, ``rapidjson``
+                     or ``json`` - a named encoder that is not
+                     installed falls back to ``json``
+        """
+        self.requested = name
+        if self.requested is None:
+            self.requested = SPLUNK_JSON_ENCODER
+        self.requested = str(self.requested).strip().lower()
+        if (self.requested != JSON_ENCODER_AUTO
+                and self.requested not in JSON_ENCODERS):
+            raise ValueError(
+                'unsupported json_encoder={} please use one of: {}'.format(
+                    self.requested,
+                    [JSON_ENCODER_AUTO] + JSON_ENCODERS))
+        candidates = [
+            self.requested
+        ]
+        if self.requested == JSON_ENCODER_AUTO:
+            candidates = JSON_ENCODERS
+        self.name = JSON_ENCODER_JSON
+        self.module = None
+        for candidate in candidates:
+            if candidate == JSON_ENCODER_JSON:
+                break
+            try:
+                self.module = importlib.import_module(
+                    candidate)
+                self.name = candidate
+                break
+            except ImportError:
+                continue
+        # end of for all candidates
+        self.encode = getattr(
+            self,
+            'encode_{}'.format(
+                self.name))
+        self.sorted_options = None
+        self.options = None
+        if self.name == JSON_ENCODER_ORJSON:
+            # let json_default handle datetimes and dataclasses
+            # like the other encoders
+            self.options = (
+                self.module.OPT_NON_STR_KEYS
+                | self.module.OPT_PASSTHROUGH_DATETIME
+                | self.module.OPT_PASSTHROUGH_DATACLASS)
+            self.sorted_options = (
+                self.options
+                | self.module.OPT_SORT_KEYS)
+    # end of __init__
+
+    def encode_orjson(
+            self,
+            obj,
+            sort_keys=False):
+        """encode_orjson
+
+        :param obj: value to encode
+        :param sort_keys: sort dictionary keys
+        """
+        options = self.options
+        if sort_keys:
+            options = self.sorted_options
+        return self.module.dumps(
+            obj,
+            default=json_default,
+            option=options).decode('utf-8')
+    # end of encode_orjson
+
+    def encode_ujson(
+            self,
+            obj,
+            sort_keys=False):
+        """encode_ujson
+
+        :param obj: value to encode
+        :param sort_keys: sort dictionary keys
+        """
+        return self.module.dumps(
+            obj,
+            default=json_default,
+            sort_keys=sort_keys,
+            ensure_ascii=False,
+            escape_forward_slashes=False)
+    # end of encode_ujson
+
+    def encode_rapidjson(
+            self,
+            obj,
+            sort_keys=False):
+        """encode_rapidjson
+
+        :param obj: value to encode
+        :param sort_keys: sort dictionary keys
+        """
+        return self.module.dumps(
+            obj,
+            default=json_default,
+            sort_keys=sort_keys,
+            ensure_ascii=False)
+    # end of encode_rapidjson
+
+    def encode_json(
+            self,
+            obj,
+            sort_keys=False):
+        """encode_json
+
+        :param obj: value to encode
+        :param sort_keys: sort dictionary keys
+        """
+        return json.dumps(
+            obj,
+            default=json_default,
+            sort_keys=sort_keys)
+    # end of encode_json
+
+    def dumps(
+            self,
+            obj,
+            sort_keys=False):
+        """dumps
+
+        Return ``obj`` as JSON text
+
+        :param obj: value to encode
+        :param sort_keys: sort dictionary keys
+        """
+        try:
+            return self.encode(
+                obj,
+                sort_keys=sort_keys)
+        except Exception:
+            if self.name == JSON_ENCODER_JSON:
+                raise
+            return self.encode_json(
+                obj,
+                sort_keys=sort_keys)
+    # end of dumps
+
+# end of JsonEncoder
+
+
+def get_json_encoder(
+        name=None):
+    """get_json_encoder
+
+    Return the shared ``JsonEncoder`` for a name
+
+    :param name: ``auto``, ``orjson``, ``ujson``, ``rapidjson``
+                 or ``json`` with None using ``SPLUNK_JSON_ENCODER``
+    """
+    if isinstance(name, JsonEncoder):
+        return name
+    if name is None:
+        name = SPLUNK_JSON_ENCODER
+    key = str(name).strip().lower()
+    encoder = encoders.get(key)
+    if encoder is None:
+        encoder = JsonEncoder(
+            name=key)
+        encoders[key] = encoder
+    return encoder
+# end of get_json_encoder
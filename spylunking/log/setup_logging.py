@@ -33,9 +33,57 @@ Splunk optional tuning environment variables:
     export SPLUNK_VERIFY="<verify certs on HTTP POST>"
     export SPLUNK_TIMEOUT="<timeout in seconds>"
     export SPLUNK_QUEUE_SIZE="<num msgs allowed in queue - 0=infinite>"
+    export SPLUNK_QUEUE_BACKEND="<memory (default) in-process|manager>"
+    export SPLUNK_MAX_BATCH_BYTES="<max encoded bytes per POST: 524288>"
+    export SPLUNK_MAX_BATCH_EVENTS="<max logs per POST - 0=infinite>"
+    export SPLUNK_LINGER_MS="<wait in ms for more logs per batch - 0=off>"
+    export SPLUNK_COMPRESS="<gzip POST bodies - 1 enable|0 off>"
+    export SPLUNK_COMPRESS_MIN_BYTES="<only gzip POST bodies this size: 1024>"
+    export SPLUNK_COMPRESS_LEVEL="<gzip level 1 fastest - 9 smallest: 6>"
+    export SPLUNK_ENDPOINT="<event (default) envelope|raw line events>"
+    export SPLUNK_CHANNEL="<HEC channel uuid - defaults to a new uuid>"
+    export SPLUNK_MAX_INFLIGHT="<concurrent POSTs per publisher: 1>"
+    export SPLUNK_USE_ACK="<wait for HEC indexer acks - 1 enable|0 off>"
+    export SPLUNK_ACK_WINDOW="<max unacknowledged batches in memory: 100>"
+    export SPLUNK_ACK_TIMEOUT="<resend unacknowledged batches after: 60.0>"
+    export SPLUNK_ACK_POLL_INTERVAL="<seconds between ack polls: 1.0>"
+    export SPLUNK_SPOOL_DIR="<spool failed batches to disk - empty disables>"
+    export SPLUNK_SPOOL_MAX_BYTES="<max spooled bytes on disk: 268435456>"
+    export SPLUNK_SPOOL_SEGMENT_BYTES="<bytes per spool segment: 8388608>"
+    export SPLUNK_SPOOL_REPLAY_INTERVAL="<seconds between replays: 5.0>"
+    export SPLUNK_QUEUE_MAX_BYTES="<bytes allowed in queue - 0=infinite>"
+    export SPLUNK_OVERFLOW_POLICY="<drop-newest (default)|drop-oldest|
+                                    drop-below-level|block>"
+    export SPLUNK_OVERFLOW_LEVEL="<lowest drop-below-level level: WARNING>"
+    export SPLUNK_OVERFLOW_BLOCK_TIMEOUT="<seconds block waits for room: 1.0>"
+    export SPLUNK_DROP_REPORT_INTERVAL="<seconds between dropped reports: 60.0>"
+    export SPLUNK_PRIORITY_LANES="<split logs into priority lanes - 1|0>"
+    export SPLUNK_PRIORITY_LEVEL="<lowest priority lane level: ERROR>"
+    export SPLUNK_PRIORITY_QUEUE_SIZE="<num msgs in the priority lane: 10000>"
+    export SPLUNK_PRIORITY_QUEUE_MAX_BYTES="<bytes in the priority lane: 0>"
+    export SPLUNK_PRIORITY_WEIGHT="<priority logs drained per other log: 4>"
+    export SPLUNK_ADAPTIVE_FLUSH="<plan batches from depth and latency - 1|0>"
+    export SPLUNK_TARGET_LATENCY_MS="<slowest healthy HEC POST: 250>"
+    export SPLUNK_MAX_LINGER_MS="<longest adaptive linger: 1000>"
+    export SPLUNK_MIN_BATCH_BYTES="<smallest adaptive batch limit: 16384>"
     export SPLUNK_SLEEP_INTERVAL="<sleep in seconds per batch>"
     export SPLUNK_RETRY_COUNT="<attempts per log to retry publishing>"
     export SPLUNK_RETRY_BACKOFF="<cooldown in seconds per failed POST>"
+    export SPLUNK_RETRY_MAX_BACKOFF="<longest retry backoff in seconds: 60.0>"
+    export SPLUNK_RETRY_MAX_PENDING="<max batches waiting for a retry: 100>"
+    export SPLUNK_BREAKER_THRESHOLD="<failed POSTs that open the breaker: 5>"
+    export SPLUNK_BREAKER_RESET="<seconds before probing HEC again: 30.0>"
+    export SPLUNK_DEAD_LETTER_FILE="<append rejected events here - empty drops>"
+    export SPLUNK_SORT_KEYS="<sort the HEC envelope keys - 1 (default)|0>"
+    export SPLUNK_EVENT_FORMAT="<string (default) JSON in a string|object>"
+    export SPLUNK_INDEXED_FIELDS="<comma-separated keys ex: name,dc,env>"
+    export SPLUNK_JSON_ENCODER="<auto (default)|orjson|ujson|rapidjson|json>"
+    export SPLUNK_MP_QUEUE_BACKEND="<shm (default) shared memory|manager>"
+    export SPLUNK_SHM_RING_BYTES="<ring bytes without a max bytes: 16777216>"
+    export SPLUNK_MP_NUM_WORKERS="<worker processes sending to Splunk: 1>"
+    export SPLUNK_MP_SHARD_BY="<round-robin (default)|logger name hash>"
+    export SPLUNK_MP_EMIT_BATCH_SIZE="<logs per queue put from emit: 1>"
+    export SPLUNK_MP_EMIT_LINGER_MS="<longest wait in ms for a queue put: 50>"
     export SPLUNK_DEBUG="<debug the publisher - 1 enable debug|0 off>"
     export SPLUNK_VERBOSE="<debug the sp command line tool - 1 enable|0 off>"
 
@@ -48,12 +96,14 @@ Change the absolute path to the logging config JSON file:
 """
 
 import os
-import datetime
 import json
 import logging.config
 import spylunking.get_token as get_token
 from pythonjsonlogger import jsonlogger
 from spylunking.ppj import ppj
+from spylunking.json_encoder import get_json_encoder
+from spylunking.timestamp_cache import ISO_TIMESTAMP_FORMAT
+from spylunking.timestamp_cache import TimestampCache
 from spylunking.consts import SPLUNK_USER
 from spylunking.consts import SPLUNK_PASSWORD
 from spylunking.consts import SPLUNK_HOST
@@ -68,6 +118,46 @@ from spylunking.consts import SPLUNK_TIMEOUT
 from spylunking.consts import SPLUNK_SLEEP_INTERVAL
 from spylunking.consts import SPLUNK_RETRY_COUNT
 from spylunking.consts import SPLUNK_QUEUE_SIZE
+from spylunking.consts import SPLUNK_MAX_BATCH_BYTES
+from spylunking.consts import SPLUNK_MAX_BATCH_EVENTS
+from spylunking.consts import SPLUNK_LINGER_MS
+from spylunking.consts import SPLUNK_COMPRESS
+from spylunking.consts import SPLUNK_COMPRESS_MIN_BYTES
+from spylunking.consts import SPLUNK_COMPRESS_LEVEL
+from spylunking.consts import SPLUNK_ENDPOINT
+from spylunking.consts import SPLUNK_CHANNEL
+from spylunking.consts import SPLUNK_MAX_INFLIGHT
+from spylunking.consts import SPLUNK_USE_ACK
+from spylunking.consts import SPLUNK_ACK_WINDOW
+from spylunking.consts import SPLUNK_ACK_TIMEOUT
+from spylunking.consts import SPLUNK_ACK_POLL_INTERVAL
+from spylunking.consts import SPLUNK_SPOOL_DIR
+from spylunking.consts import SPLUNK_SPOOL_MAX_BYTES
+from spylunking.consts import SPLUNK_SPOOL_SEGMENT_BYTES
+from spylunking.consts import SPLUNK_SPOOL_REPLAY_INTERVAL
+from spylunking.consts import SPLUNK_QUEUE_MAX_BYTES
+from spylunking.consts import SPLUNK_OVERFLOW_POLICY
+from spylunking.consts import SPLUNK_OVERFLOW_LEVEL
+from spylunking.consts import SPLUNK_OVERFLOW_BLOCK_TIMEOUT
+from spylunking.consts import SPLUNK_DROP_REPORT_INTERVAL
+from spylunking.consts import SPLUNK_PRIORITY_LANES
+from spylunking.consts import SPLUNK_PRIORITY_LEVEL
+from spylunking.consts import SPLUNK_PRIORITY_QUEUE_SIZE
+from spylunking.consts import SPLUNK_PRIORITY_QUEUE_MAX_BYTES
+from spylunking.consts import SPLUNK_PRIORITY_WEIGHT
+from spylunking.consts import SPLUNK_ADAPTIVE_FLUSH
+from spylunking.consts import SPLUNK_TARGET_LATENCY_MS
+from spylunking.consts import SPLUNK_MAX_LINGER_MS
+from spylunking.consts import SPLUNK_MIN_BATCH_BYTES
+from spylunking.consts import SPLUNK_RETRY_MAX_BACKOFF
+from spylunking.consts import SPLUNK_RETRY_MAX_PENDING
+from spylunking.consts import SPLUNK_BREAKER_THRESHOLD
+from spylunking.consts import SPLUNK_BREAKER_RESET
+from spylunking.consts import SPLUNK_DEAD_LETTER_FILE
+from spylunking.consts import SPLUNK_SORT_KEYS
+from spylunking.consts import SPLUNK_EVENT_FORMAT
+from spylunking.consts import SPLUNK_INDEXED_FIELDS
+from spylunking.consts import SPLUNK_JSON_ENCODER
 from spylunking.consts import SPLUNK_DEBUG
 from spylunking.consts import SPLUNK_HANDLER_NAME
 from spylunking.consts import SPLUNK_LOG_NAME
@@ -76,11 +166,147 @@ from spylunking.consts import SPLUNK_ENV_NAME
 from spylunking.consts import LOG_HANDLER_NAME
 
 
+# splunk handler config keys that are only overridden
+# when their environment variable is set
+SPLUNK_HANDLER_ENV_OVERRIDES = [
+    ('max_batch_bytes', 'SPLUNK_MAX_BATCH_BYTES', SPLUNK_MAX_BATCH_BYTES),
+    ('max_batch_events', 'SPLUNK_MAX_BATCH_EVENTS', SPLUNK_MAX_BATCH_EVENTS),
+    ('linger_ms', 'SPLUNK_LINGER_MS', SPLUNK_LINGER_MS),
+    ('compress', 'SPLUNK_COMPRESS', SPLUNK_COMPRESS),
+    ('compress_min_bytes', 'SPLUNK_COMPRESS_MIN_BYTES',
+        SPLUNK_COMPRESS_MIN_BYTES),
+    ('compress_level', 'SPLUNK_COMPRESS_LEVEL', SPLUNK_COMPRESS_LEVEL),
+    ('endpoint', 'SPLUNK_ENDPOINT', SPLUNK_ENDPOINT),
+    ('channel', 'SPLUNK_CHANNEL', SPLUNK_CHANNEL),
+    ('max_inflight', 'SPLUNK_MAX_INFLIGHT', SPLUNK_MAX_INFLIGHT),
+    ('use_ack', 'SPLUNK_USE_ACK', SPLUNK_USE_ACK),
+    ('ack_window', 'SPLUNK_ACK_WINDOW', SPLUNK_ACK_WINDOW),
+    ('ack_timeout', 'SPLUNK_ACK_TIMEOUT', SPLUNK_ACK_TIMEOUT),
+    ('ack_poll_interval', 'SPLUNK_ACK_POLL_INTERVAL',
+        SPLUNK_ACK_POLL_INTERVAL),
+    ('spool_dir', 'SPLUNK_SPOOL_DIR', SPLUNK_SPOOL_DIR),
+    ('spool_max_bytes', 'SPLUNK_SPOOL_MAX_BYTES', SPLUNK_SPOOL_MAX_BYTES),
+    ('spool_segment_bytes', 'SPLUNK_SPOOL_SEGMENT_BYTES',
+        SPLUNK_SPOOL_SEGMENT_BYTES),
+    ('spool_replay_interval', 'SPLUNK_SPOOL_REPLAY_INTERVAL',
+        SPLUNK_SPOOL_REPLAY_INTERVAL),
+    ('queue_max_bytes', 'SPLUNK_QUEUE_MAX_BYTES', SPLUNK_QUEUE_MAX_BYTES),
+    ('overflow_policy', 'SPLUNK_OVERFLOW_POLICY', SPLUNK_OVERFLOW_POLICY),
+    ('overflow_level', 'SPLUNK_OVERFLOW_LEVEL', SPLUNK_OVERFLOW_LEVEL),
+    ('overflow_block_timeout', 'SPLUNK_OVERFLOW_BLOCK_TIMEOUT',
+        SPLUNK_OVERFLOW_BLOCK_TIMEOUT),
+    ('drop_report_interval', 'SPLUNK_DROP_REPORT_INTERVAL',
+        SPLUNK_DROP_REPORT_INTERVAL),
+    ('priority_lanes', 'SPLUNK_PRIORITY_LANES', SPLUNK_PRIORITY_LANES),
+    ('priority_level', 'SPLUNK_PRIORITY_LEVEL', SPLUNK_PRIORITY_LEVEL),
+    ('priority_queue_size', 'SPLUNK_PRIORITY_QUEUE_SIZE',
+        SPLUNK_PRIORITY_QUEUE_SIZE),
+    ('priority_queue_max_bytes', 'SPLUNK_PRIORITY_QUEUE_MAX_BYTES',
+        SPLUNK_PRIORITY_QUEUE_MAX_BYTES),
+    ('priority_weight', 'SPLUNK_PRIORITY_WEIGHT', SPLUNK_PRIORITY_WEIGHT),
+    ('adaptive_flush', 'SPLUNK_ADAPTIVE_FLUSH', SPLUNK_ADAPTIVE_FLUSH),
+    ('target_latency_ms', 'SPLUNK_TARGET_LATENCY_MS',
+        SPLUNK_TARGET_LATENCY_MS),
+    ('max_linger_ms', 'SPLUNK_MAX_LINGER_MS', SPLUNK_MAX_LINGER_MS),
+    ('min_batch_bytes', 'SPLUNK_MIN_BATCH_BYTES', SPLUNK_MIN_BATCH_BYTES),
+    ('retry_max_backoff', 'SPLUNK_RETRY_MAX_BACKOFF',
+        SPLUNK_RETRY_MAX_BACKOFF),
+    ('retry_max_pending', 'SPLUNK_RETRY_MAX_PENDING',
+        SPLUNK_RETRY_MAX_PENDING),
+    ('breaker_threshold', 'SPLUNK_BREAKER_THRESHOLD',
+        SPLUNK_BREAKER_THRESHOLD),
+    ('breaker_reset', 'SPLUNK_BREAKER_RESET', SPLUNK_BREAKER_RESET),
+    ('dead_letter', 'SPLUNK_DEAD_LETTER_FILE', SPLUNK_DEAD_LETTER_FILE),
+    ('sort_keys', 'SPLUNK_SORT_KEYS', SPLUNK_SORT_KEYS),
+    ('event_format', 'SPLUNK_EVENT_FORMAT', SPLUNK_EVENT_FORMAT),
+    ('indexed_fields', 'SPLUNK_INDEXED_FIELDS', SPLUNK_INDEXED_FIELDS),
+    ('json_encoder', 'SPLUNK_JSON_ENCODER', SPLUNK_JSON_ENCODER)
+]
+
+
 class SplunkFormatter(jsonlogger.JsonFormatter):
     """SplunkFormatter"""
 
     fields_to_add = {}
     org_fields = {}
+    encoder = None
+
+    def __init__(
+            self,
+            *args,
+            **kwargs):
+        """__init__
+
+        Logs are encoded with a ``JsonEncoder`` when ``json_encoder``
+        is an encoder name (``auto``, ``orjson``, ``ujson``,
+        ``rapidjson`` or ``json``) or not set (``SPLUNK_JSON_ENCODER``).
+        A ``json.JSONEncoder`` class, ``json_default`` or
+        ``json_indent`` keeps the ``python-json-logger`` encoding.
+
+        :param args: ``JsonFormatter`` arguments
+        :param kwargs: ``JsonFormatter`` keyword arguments
+        """
+        json_encoder = kwargs.get(
+            'json_encoder')
+        use_encoder = (
+            json_encoder is None
+            or isinstance(json_encoder, str))
+        if use_encoder:
+            kwargs.pop(
+                'json_encoder',
+                None)
+        super(
+            SplunkFormatter,
+            self).__init__(
+                *args,
+                **kwargs)
+        self.timestamp_caches = {}
+        if (use_encoder
+                and not getattr(self, 'json_default', None)
+                and getattr(self, 'json_indent', None) is None):
+            self.encoder = get_json_encoder(
+                json_encoder)
+    # end of __init__
+
+    def jsonify_log_record(
+            self,
+            log_record):
+        """jsonify_log_record
+
+        :param log_record: log dictionary to encode
+        """
+        if self.encoder is None:
+            return super(
+                SplunkFormatter,
+                self).jsonify_log_record(
+                    log_record)
+        return self.encoder.dumps(
+            log_record)
+    # end of jsonify_log_record
+
+    def format_created(
+            self,
+            created,
+            fmt,
+            utc=False):
+        """format_created
+
+        Format a log's ``record.created`` with a ``TimestampCache``
+        so ``strftime`` only runs once per second
+
+        :param created: log time in seconds since the epoch
+        :param fmt: ``strftime`` format
+        :param utc: format in UTC instead of local time
+        """
+        cache = self.timestamp_caches.get((fmt, utc))
+        if cache is None:
+            cache = TimestampCache(
+                fmt=fmt,
+                utc=utc)
+            self.timestamp_caches[(fmt, utc)] = cache
+        return cache.format(
+            created)
+    # end of format_created
 
     def set_fields(
             self,
@@ -137,9 +363,10 @@ class SplunkFormatter(jsonlogger.JsonFormatter):
                 record,
                 message_dict)
         if not log_record.get('timestamp'):
-            now = datetime.datetime.utcnow().strftime(
-                '%Y-%m-%dT%H:%M:%S.%fZ')
-            log_record['timestamp'] = now
+            log_record['timestamp'] = self.format_created(
+                created=record.created,
+                fmt=ISO_TIMESTAMP_FORMAT,
+                utc=True)
     # end of add_fields
 
     def format(
@@ -150,22 +377,36 @@ class SplunkFormatter(jsonlogger.JsonFormatter):
 
         :param record: message object to format
         """
+        return '{}{}'.format(
+            self.prefix,
+            self.jsonify_log_record(
+                self.format_event(
+                    record,
+                    datefmt=datefmt)))
+    # end of format
 
-        now = datetime.datetime.now()
-        utc_now = datetime.datetime.utcnow()
-        asctime = None
-        if self.datefmt:
-            asctime = now.strftime(
-                self.datefmt)
-        else:
-            asctime = now.strftime(
-                datefmt)
+    def format_event(
+            self,
+            record,
+            datefmt='%Y:%m:%d %H:%M:%S.%f'):
+        """format_event
 
+        Return the log as a dictionary so a publisher
+        can encode it once as a nested JSON object
+
+        :param record: message object to format
+        """
+
+        # both times come from the log so they always agree
         message = {
             'time': record.created,
-            'timestamp': utc_now.strftime(
-                '%Y-%m-%dT%H:%M:%S.%fZ'),
-            'asctime': asctime,
+            'timestamp': self.format_created(
+                created=record.created,
+                fmt=ISO_TIMESTAMP_FORMAT,
+                utc=True),
+            'asctime': self.format_created(
+                created=record.created,
+                fmt=self.datefmt or datefmt),
             'path': record.pathname,
             'message': record.getMessage(),
             'exc': None,
@@ -192,13 +433,9 @@ class SplunkFormatter(jsonlogger.JsonFormatter):
             log_record,
             record,
             message)
-        use_log_record = self.process_log_record(
+        return self.process_log_record(
             log_record)
-        return '{}{}'.format(
-            self.prefix,
-            self.jsonify_log_record(
-                use_log_record))
-    # end of format
+    # end of format_event
 
 # end of SplunkFormatter
 
@@ -376,6 +613,12 @@ def setup_logging(
 
                 # end of checking for sleep_interval changes
 
+                for key, env_key, env_value in SPLUNK_HANDLER_ENV_OVERRIDES:
+                    if os.getenv(env_key, None) is not None:
+                        config['handlers'][splunk_handler_name][key] = \
+                            env_value
+                # end of checking for batch and tuning changes
+
                 if found_splunk_handler:
                     config['root']['handlers'].append(
                         splunk_handler_name)
@@ -0,0 +1,385 @@
+"""
+Host-wide log forwarder daemon for the ``ForwarderPublisher``
+
+The ``LogForwarder`` listens on a Unix domain socket for the frames
+that ``ForwarderPublisher`` handlers send and queues the pre-encoded
+HEC events in one ``SplunkPublisher``, so a single process per host
+does all of the batching, compression, retries, spooling and acks for
+every worker process on it. Start it with the ``spylunking-forwarder``
+command.
+
+``dgram`` sockets read one frame per datagram. ``stream`` sockets read
+newline-delimited frames and drop a partial frame when a client
+disconnects. Frames larger than ``max_event_bytes`` are dropped. Every
+dropped frame is counted in the ``dropped_frames`` stat.
+
+The socket file is created with ``socket_mode`` (``0o660`` by default)
+so only the daemon's user and group can send it events.
+
+The ``SplunkPublisher`` must use the ``event`` endpoint because the
+handlers send complete HEC event envelopes.
+
+::
+
+    export SPLUNK_FORWARDER_SOCKET="<unix socket path to listen on>"
+    export SPLUNK_FORWARDER_SOCKET_TYPE="<stream (default)|dgram>"
+    export SPLUNK_FORWARDER_MAX_EVENT_BYTES="<largest frame: 212992>"
+    export SPLUNK_FORWARDER_SOCKET_MODE="<octal socket file mode: 660>"
+
+"""
+
+import errno
+import os
+import select
+import socket
+import stat
+import threading
+from spylunking.rnow import rnow
+from spylunking.splunk_publisher import SplunkPublisher
+from spylunking.forwarder_publisher import get_socket_type
+from spylunking.forwarder_publisher import parse_frame
+from spylunking.consts import SPLUNK_FORWARDER_SOCKET
+from spylunking.consts import SPLUNK_FORWARDER_SOCKET_TYPE
+from spylunking.consts import SPLUNK_FORWARDER_MAX_EVENT_BYTES
+from spylunking.consts import SPLUNK_FORWARDER_SOCKET_MODE
+from spylunking.consts import SPLUNK_DEBUG
+
+
+class LogForwarder(object):
+    """
+    Receive encoded HEC events over a Unix domain socket
+    and publish them with one ``SplunkPublisher``
+    """
+
+    def __init__(
+            self,
+            socket_path=None,
+            socket_type=None,
+            max_event_bytes=None,
+            socket_mode=None,
+            poll_interval=0.5,
+            publisher=None,
+            debug=False,
+            **kwargs):
+        """__init__
+
+        :param socket_path: path of the Unix domain socket to listen on
+        :param socket_type: ``stream`` (default) or ``dgram``
+        :param max_event_bytes: largest frame accepted
+        :param socket_mode: file mode for the socket - processes
+                            need write permission to connect
+        :param poll_interval: seconds between checks for ``stop``
+        :param publisher: ``SplunkPublisher`` for the events - by
+                          default one is built with ``kwargs``
+        :param debug: enable debug mode
+        """
+        self.socket_path = socket_path
+        if self.socket_path is None:
+            self.socket_path = SPLUNK_FORWARDER_SOCKET
+        self.socket_type = socket_type
+        if self.socket_type is None:
+            self.socket_type = SPLUNK_FORWARDER_SOCKET_TYPE
+        self.sock_type = get_socket_type(
+            self.socket_type)
+        self.max_event_bytes = max_event_bytes
+        if self.max_event_bytes is None:
+            self.max_event_bytes = SPLUNK_FORWARDER_MAX_EVENT_BYTES
+        self.socket_mode = socket_mode
+        if self.socket_mode is None:
+            self.socket_mode = SPLUNK_FORWARDER_SOCKET_MODE
+        self.poll_interval = poll_interval
+        self.debug = SPLUNK_DEBUG or debug
+        self.publisher = publisher
+        if self.publisher is None:
+            self.publisher = SplunkPublisher(
+                debug=debug,
+                **kwargs)
+
+        self.sock = None
+        # stream connections and their partial frames
+        self.conns = {}
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.num_received = 0
+        self.num_dropped = 0
+        self.num_clients = 0
+    # end of __init__
+
+    def write_log(
+            self,
+            log_message):
+        """write_log
+
+        Write logs to stdout
+
+        :param log_message: message to log
+        """
+        print('{} forwarder {}'.format(
+            rnow(),
+            log_message))
+    # end of write_log
+
+    def debug_log(
+            self,
+            log_message):
+        """debug_log
+
+        Write logs that only show up in debug mode
+
+        :param log_message: message to log
+        """
+        if self.debug:
+            print('{} forwarder DEBUG {}'.format(
+                rnow(),
+                log_message))
+    # end of debug_log
+
+    def bind(
+            self):
+        """bind
+
+        Listen on the socket and replace a stale socket
+        file left behind by an earlier daemon
+        """
+        if os.path.exists(self.socket_path):
+            if not stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                raise ValueError(
+                    'not replacing socket_path={} - it is not '
+                    'a socket'.format(
+                        self.socket_path))
+            os.remove(self.socket_path)
+        self.sock = socket.socket(
+            socket.AF_UNIX,
+            self.sock_type)
+        self.sock.bind(
+            self.socket_path)
+        os.chmod(
+            self.socket_path,
+            self.socket_mode)
+        if self.sock_type == socket.SOCK_DGRAM:
+            try:
+                self.sock.setsockopt(
+                    socket.SOL_SOCKET,
+                    socket.SO_RCVBUF,
+                    self.max_event_bytes * 64)
+            except (socket.error, OSError):
+                pass
+        else:
+            self.sock.listen(128)
+        self.sock.setblocking(False)
+        self.write_log(
+            'listening on {} socket_type={}'.format(
+                self.socket_path,
+                self.socket_type))
+    # end of bind
+
+    def start(
+            self):
+        """start
+
+        Bind the socket and start the receive thread
+        """
+        if self.thread:
+            return
+        self.bind()
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self.run,
+            name='spylunking-forwarder')
+        self.thread.daemon = True
+        self.thread.start()
+    # end of start
+
+    def handle_frame(
+            self,
+            frame):
+        """handle_frame
+
+        Queue the HEC event in one frame
+
+        :param frame: frame as ``bytes``
+        """
+        if not frame.strip():
+            return
+        levelno, event = parse_frame(
+            frame)
+        self.num_received += 1
+        self.publisher.enqueue(
+            record=event,
+            levelno=levelno)
+    # end of handle_frame
+
+    def read_datagrams(
+            self):
+        """read_datagrams
+
+        Read every datagram that is waiting on the socket
+        """
+        while True:
+            try:
+                frame = self.sock.recv(
+                    self.max_event_bytes)
+            except (socket.error, OSError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.write_log(
+                        'failed reading datagram ex={}'.format(
+                            e))
+                return
+            self.handle_frame(
+                frame)
+        # end of while datagrams are waiting
+    # end of read_datagrams
+
+    def accept_client(
+            self):
+        """accept_client
+
+        Accept a new stream connection
+        """
+        try:
+            conn, address = self.sock.accept()
+        except (socket.error, OSError):
+            return
+        conn.setblocking(False)
+        self.conns[conn] = b''
+        self.num_clients += 1
+        self.debug_log(
+            'client connected clients={}'.format(
+                len(self.conns)))
+    # end of accept_client
+
+    def close_client(
+            self,
+            conn):
+        """close_client
+
+        Close a stream connection and drop its partial frame
+
+        :param conn: connection to close
+        """
+        partial = self.conns.pop(conn, b'')
+        if partial:
+            self.num_dropped += 1
+            self.debug_log(
+                'dropped partial frame bytes={} from a closed '
+                'client'.format(
+                    len(partial)))
+        try:
+            conn.close()
+        except Exception:
+            pass
+    # end of close_client
+
+    def read_stream(
+            self,
+            conn):
+        """read_stream
+
+        Read the frames waiting on a stream connection
+
+        :param conn: readable connection
+        """
+        try:
+            data = conn.recv(65536)
+        except (socket.error, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b''
+        if not data:
+            self.close_client(
+                conn)
+            return
+        frames = (self.conns[conn] + data).split(b'\n')
+        # the last piece is the start of the next frame
+        self.conns[conn] = frames.pop()
+        for frame in frames:
+            if len(frame) > self.max_event_bytes:
+                self.num_dropped += 1
+                continue
+            self.handle_frame(
+                frame)
+        if len(self.conns[conn]) > self.max_event_bytes:
+            # drops and counts the oversized partial frame
+            self.close_client(
+                conn)
+    # end of read_stream
+
+    def run(
+            self):
+        """run
+
+        Receive thread loop
+        """
+        while not self.stop_event.is_set():
+            try:
+                readable = select.select(
+                    [self.sock] + list(self.conns),
+                    [],
+                    [],
+                    self.poll_interval)[0]
+            except (select.error, OSError, ValueError) as e:
+                self.write_log(
+                    'select failed ex={}'.format(
+                        e))
+                continue
+            for sock in readable:
+                try:
+                    if sock is not self.sock:
+                        self.read_stream(
+                            sock)
+                    elif self.sock_type == socket.SOCK_DGRAM:
+                        self.read_datagrams()
+                    else:
+                        self.accept_client()
+                except Exception as e:
+                    self.write_log(
+                        'failed receiving events ex={}'.format(
+                            e))
+            # end of for all readable sockets
+        # end of while running
+    # end of run
+
+    def get_stats(
+            self):
+        """get_stats
+
+        Return the forwarder counts and the publisher's stats
+        """
+        stats = self.publisher.get_stats()
+        stats.update({
+            'received': self.num_received,
+            'dropped_frames': self.num_dropped,
+            'clients': len(self.conns),
+            'num_clients': self.num_clients
+        })
+        return stats
+    # end of get_stats
+
+    def stop(
+            self,
+            timeout=None):
+        """stop
+
+        Stop receiving, remove the socket and send every
+        queued event before shutting down the publisher
+
+        :param timeout: seconds to wait for the receive thread
+        """
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        for conn in list(self.conns):
+            self.close_client(
+                conn)
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        self.publisher.flush(
+            timeout=timeout)
+        self.publisher.shutdown()
+    # end of stop
+
+# end of LogForwarder
@@ -0,0 +1,1216 @@
+"""
+In-process queue backends for the Splunk publishers
+
+The ``SplunkPublisher`` consumer is a thread inside the same process
+as the code calling ``emit()``, so there is no reason to pay for a
+``multiprocessing.Manager()`` server process and a pickled IPC round
+trip per log record. The ``MemoryQueue`` is a ``collections.deque``
+with a wakeup event: ``put_nowait`` is an ``append`` and ``get`` is a
+``popleft`` that only blocks when the deque is empty.
+
+The ``manager`` backend hosts a ``MemoryQueue`` in a
+``multiprocessing.managers.BaseManager`` server process so a worker
+process can share it. The ``shm`` backend is a ``ShmRingQueue`` in
+shared memory that a worker process reads without the manager round
+trip (see ``spylunking.shm_ring``).
+
+A queue can be bounded by the number of records (``maxsize``) and by
+the bytes it holds (``max_bytes``). When a bounded queue is full the
+``overflow_policy`` decides what ``offer`` does:
+
+- ``drop-newest`` - drop the new record (default)
+- ``drop-oldest`` - drop the oldest records to make room
+- ``drop-below-level`` - drop new records below ``overflow_level`` and
+  drop the oldest records to make room for the rest
+- ``block`` - wait up to ``block_timeout`` seconds for room and then
+  drop the new record
+
+Dropped records are counted so the publishers can send one aggregated
+"N records dropped" event instead of printing a line per record.
+
+A ``LaneQueue`` splits records by level into priority lanes that each
+have their own ``MemoryQueue`` capacity, so a backlog of INFO records
+is shed before the ERROR records behind it. The consumer drains the
+lanes in weighted priority order.
+
+Supported queue backends and limits:
+
+::
+
+    export SPLUNK_QUEUE_BACKEND="<memory (default)|manager|shm>"
+    export SPLUNK_QUEUE_MAX_BYTES="<bytes allowed in queue - 0=infinite>"
+    export SPLUNK_OVERFLOW_POLICY="<drop-newest (default)|drop-oldest|
+                                    drop-below-level|block>"
+    export SPLUNK_OVERFLOW_LEVEL="<lowest drop-below-level level: WARNING>"
+    export SPLUNK_OVERFLOW_BLOCK_TIMEOUT="<seconds block waits for room: 1.0>"
+    export SPLUNK_PRIORITY_LANES="<split records into priority lanes - 1|0>"
+    export SPLUNK_PRIORITY_LEVEL="<lowest priority lane level: ERROR>"
+    export SPLUNK_PRIORITY_QUEUE_SIZE="<num msgs in the priority lane: 10000>"
+    export SPLUNK_PRIORITY_QUEUE_MAX_BYTES="<bytes in the priority lane: 0>"
+    export SPLUNK_PRIORITY_WEIGHT="<priority records drained per other: 4>"
+
+"""
+
+import collections
+import logging
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from multiprocessing.managers import DictProxy
+from spylunking.consts import IS_PY2
+
+if IS_PY2:
+    from Queue import Empty  # noqa
+    from Queue import Full  # noqa
+else:
+    from queue import Empty  # noqa
+    from queue import Full  # noqa
+
+
+QUEUE_BACKEND_MEMORY = 'memory'
+QUEUE_BACKEND_MANAGER = 'manager'
+QUEUE_BACKEND_SHM = 'shm'
+QUEUE_BACKENDS = [
+    QUEUE_BACKEND_MEMORY,
+    QUEUE_BACKEND_MANAGER,
+    QUEUE_BACKEND_SHM
+]
+
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_BELOW_LEVEL = 'drop-below-level'
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_POLICIES = [
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_DROP_BELOW_LEVEL,
+    OVERFLOW_BLOCK
+]
+
+
+def get_level(
+        level):
+    """get_level
+
+    Convert a level name like ``WARNING`` or a number into
+    a logging level number
+
+    :param level: level name or number
+    """
+    if isinstance(level, int):
+        return level
+    level = str(level).strip()
+    if level.isdigit():
+        return int(level)
+    levelno = logging.getLevelName(level.upper())
+    if not isinstance(levelno, int):
+        raise ValueError(
+            'unsupported log level={}'.format(
+                level))
+    return levelno
+# end of get_level
+
+
+class MemoryQueue(object):
+    """
+    A ``queue.Queue``-compatible, in-process FIFO for a single
+    consumer thread and any number of producer threads.
+
+    Producers on an unbounded queue never take a lock:
+    ``collections.deque.append`` and ``collections.deque.popleft`` are
+    atomic, and the consumer only waits on the ``threading.Event`` when
+    it finds fewer items than it asked for. A producer only sets the
+    event while the consumer is waiting and the queue holds the
+    ``wake_items`` the consumer asked for, so a busy queue costs no
+    wakeups. A queue with a ``max_bytes`` budget takes ``self.lock``
+    to keep the byte count consistent. With the ``drop-below-level``
+    policy every item is queued with its level under ``self.lock`` so
+    ``offer`` can evict the oldest item below the ``overflow_level``
+    before any item at the level.
+    """
+
+    def __init__(
+            self,
+            maxsize=0,
+            max_bytes=0,
+            overflow_policy=OVERFLOW_DROP_NEWEST,
+            overflow_level=logging.WARNING,
+            block_timeout=1.0):
+        """__init__
+
+        :param maxsize: maximum number of queued items before
+                        ``put_nowait`` raises ``queue.Full`` with
+                        0 is an infinite number of items
+        :param max_bytes: maximum bytes of queued ``str`` or ``bytes``
+                          items with 0 is an infinite number of bytes
+        :param overflow_policy: what ``offer`` does when the queue
+                                is full - one of ``OVERFLOW_POLICIES``
+        :param overflow_level: lowest level ``drop-below-level`` keeps
+        :param block_timeout: seconds ``block`` waits for room
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                'unsupported overflow policy={} please use one of: '
+                '{}'.format(
+                    overflow_policy,
+                    OVERFLOW_POLICIES))
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.overflow_level = get_level(overflow_level)
+        self.block_timeout = block_timeout
+        self.items = collections.deque()
+        self.num_bytes = 0
+        self.num_dropped = 0
+        self.num_dropped_bytes = 0
+        self.lock = threading.Lock()
+        self.not_empty = threading.Event()
+        self.not_full = threading.Event()
+        self.bounded = bool(maxsize > 0 or max_bytes > 0)
+        # items are (levelno, item) tuples when tracking levels
+        self.track_levels = bool(
+            self.bounded
+            and overflow_policy == OVERFLOW_DROP_BELOW_LEVEL)
+        self.num_below_level = 0
+        self.waiting = False
+        self.wake_items = 1
+        self.woken = False
+    # end of __init__
+
+    def put_nowait(
+            self,
+            item,
+            levelno=logging.NOTSET):
+        """put_nowait
+
+        Add an item without blocking
+
+        :param item: item to queue
+        :param levelno: logging level number of the record
+        """
+        if self.maxsize > 0 and len(self.items) >= self.maxsize:
+            self.wake_full()
+            raise Full()
+        if self.track_levels:
+            with self.lock:
+                if self.maxsize > 0 and len(self.items) >= self.maxsize:
+                    self.wake_full()
+                    raise Full()
+                size = len(item)
+                if self.max_bytes > 0:
+                    if (self.items
+                            and self.num_bytes + size > self.max_bytes):
+                        self.wake_full()
+                        raise Full()
+                    self.num_bytes += size
+                self.items.append((levelno, item))
+                if levelno < self.overflow_level:
+                    self.num_below_level += 1
+        elif self.max_bytes > 0:
+            size = len(item)
+            with self.lock:
+                # always take one item so a record larger
+                # than the budget does not block forever
+                if self.items and self.num_bytes + size > self.max_bytes:
+                    self.wake_full()
+                    raise Full()
+                self.num_bytes += size
+                self.items.append(item)
+        else:
+            self.items.append(item)
+        # read after the append so a consumer that starts
+        # waiting concurrently either sees the item or the flag
+        if self.waiting and len(self.items) >= self.wake_items:
+            self.not_empty.set()
+    # end of put_nowait
+
+    def wake_full(
+            self):
+        """wake_full
+
+        Wake a waiting consumer because the queue is full
+        """
+        if self.waiting:
+            self.not_empty.set()
+    # end of wake_full
+
+    def wake(
+            self):
+        """wake
+
+        Wake the consumer without an item - used on shutdown
+        """
+        self.woken = True
+        self.not_empty.set()
+    # end of wake
+
+    def wait_for_items(
+            self,
+            min_items=1,
+            timeout=None):
+        """wait_for_items
+
+        Wait until the queue holds ``min_items`` items or is full and
+        return True, or return False after ``timeout`` seconds or
+        a ``wake``
+
+        :param min_items: number of items to wait for
+        :param timeout: seconds to wait with None waiting forever
+        """
+        if self.maxsize > 0:
+            min_items = min(min_items, self.maxsize)
+        if len(self.items) >= min_items:
+            return True
+        end_time = None
+        if timeout is not None:
+            end_time = time.time() + timeout
+        self.wake_items = min_items
+        try:
+            while True:
+                # flag and clear before checking again so a put that
+                # races with the check still leaves the event set
+                self.waiting = True
+                self.not_empty.clear()
+                if len(self.items) >= min_items or self.full():
+                    return True
+                if self.woken:
+                    self.woken = False
+                    return False
+                remaining = None
+                if end_time is not None:
+                    remaining = end_time - time.time()
+                    if remaining <= 0:
+                        return False
+                self.not_empty.wait(
+                    remaining)
+            # end of waiting for items
+        finally:
+            self.waiting = False
+    # end of wait_for_items
+
+    def put(
+            self,
+            item,
+            block=True,
+            timeout=None):
+        """put
+
+        Add an item, waiting up to ``timeout`` seconds for room
+        in a bounded queue when ``block`` is True
+
+        :param item: item to queue
+        :param block: wait for room
+        :param timeout: seconds to wait with None waiting forever
+        """
+        if not block or not self.bounded:
+            self.put_nowait(
+                item)
+            return
+
+        end_time = None
+        if timeout is not None:
+            end_time = time.time() + timeout
+        while True:
+            # clear before trying again so a get that races
+            # with the attempt still leaves the event set
+            self.not_full.clear()
+            try:
+                self.put_nowait(
+                    item)
+                return
+            except Full:
+                pass
+            remaining = None
+            if end_time is not None:
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    raise Full()
+            self.not_full.wait(
+                remaining)
+        # end of waiting for room
+    # end of put
+
+    def offer(
+            self,
+            item,
+            levelno=logging.NOTSET):
+        """offer
+
+        Add an item and apply the ``overflow_policy`` if the queue is
+        full. Returns False if the item was not queued - the caller
+        decides whether to drop it with ``record_drop``. Older items
+        evicted to make room are counted as dropped here.
+
+        :param item: item to queue
+        :param levelno: logging level number of the record
+        """
+        try:
+            self.put_nowait(
+                item,
+                levelno)
+            return True
+        except Full:
+            pass
+
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            try:
+                self.put(
+                    item,
+                    block=True,
+                    timeout=self.block_timeout)
+                return True
+            except Full:
+                return False
+        elif (self.overflow_policy == OVERFLOW_DROP_OLDEST
+                or (self.overflow_policy == OVERFLOW_DROP_BELOW_LEVEL
+                    and levelno >= self.overflow_level)):
+            while True:
+                evicted = None
+                if self.track_levels:
+                    # items below the level go before any at the level
+                    evicted = self.evict_below_level()
+                try:
+                    if evicted is None:
+                        evicted = self.get_nowait()
+                except Empty:
+                    return False
+                self.record_drop(
+                    evicted)
+                try:
+                    self.put_nowait(
+                        item,
+                        levelno)
+                    return True
+                except Full:
+                    pass
+            # end of evicting items
+        return False
+    # end of offer
+
+    def evict_below_level(
+            self):
+        """evict_below_level
+
+        Remove and return the oldest item below the
+        ``overflow_level`` or None if every item is at the level
+        """
+        with self.lock:
+            if self.num_below_level == 0:
+                return None
+            for idx, (levelno, item) in enumerate(self.items):
+                if levelno < self.overflow_level:
+                    del self.items[idx]
+                    self.num_below_level -= 1
+                    if self.max_bytes > 0:
+                        self.num_bytes -= len(item)
+                    break
+            else:
+                return None
+        self.not_full.set()
+        return item
+    # end of evict_below_level
+
+    def offer_many(
+            self,
+            items):
+        """offer_many
+
+        ``offer`` a list of items in one call so a publisher in
+        another process pays for one round trip to the
+        ``QueueManager`` instead of one per item. Items that
+        were not queued are counted as dropped.
+
+        Returns the number of queued items
+
+        :param items: list of ``(item, levelno)`` tuples
+        """
+        num_queued = 0
+        for item, levelno in items:
+            if self.offer(
+                    item,
+                    levelno):
+                num_queued += 1
+            else:
+                self.record_drop(
+                    item)
+        return num_queued
+    # end of offer_many
+
+    def record_drop(
+            self,
+            item):
+        """record_drop
+
+        Count a dropped item for the next ``pop_dropped``
+
+        :param item: dropped item
+        """
+        with self.lock:
+            self.num_dropped += 1
+            self.num_dropped_bytes += len(item)
+    # end of record_drop
+
+    def pop_dropped(
+            self):
+        """pop_dropped
+
+        Return the number of dropped items and their bytes since
+        the last call as a tuple and reset both counters
+        """
+        with self.lock:
+            dropped = (
+                self.num_dropped,
+                self.num_dropped_bytes)
+            self.num_dropped = 0
+            self.num_dropped_bytes = 0
+        return dropped
+    # end of pop_dropped
+
+    def has_dropped(
+            self):
+        """has_dropped
+
+        Return True if items were dropped since the last ``pop_dropped``
+        """
+        return self.num_dropped > 0
+    # end of has_dropped
+
+    def popleft(
+            self):
+        """popleft
+
+        Remove the oldest item, release its bytes and wake a
+        producer blocked on a full queue
+        """
+        if self.track_levels:
+            with self.lock:
+                levelno, item = self.items.popleft()
+                if levelno < self.overflow_level:
+                    self.num_below_level -= 1
+                if self.max_bytes > 0:
+                    self.num_bytes -= len(item)
+        elif self.max_bytes > 0:
+            with self.lock:
+                item = self.items.popleft()
+                self.num_bytes -= len(item)
+        else:
+            item = self.items.popleft()
+        if self.bounded:
+            self.not_full.set()
+        return item
+    # end of popleft
+
+    def get_nowait(
+            self):
+        """get_nowait
+
+        Remove and return the oldest item or raise ``queue.Empty``
+        """
+        try:
+            return self.popleft()
+        except IndexError:
+            raise Empty()
+    # end of get_nowait
+
+    def get_priority(
+            self,
+            block=True,
+            timeout=None):
+        """get_priority
+
+        ``get`` for consumers that also read a ``LaneQueue`` - returns
+        a tuple of False (a single lane has no priority records)
+        and the oldest item
+
+        :param block: wait for an item
+        :param timeout: seconds to wait with None waiting forever
+        """
+        return False, self.get(
+            block=block,
+            timeout=timeout)
+    # end of get_priority
+
+    def get_many(
+            self,
+            max_items=0,
+            timeout=None,
+            min_items=1):
+        """get_many
+
+        Wait up to ``timeout`` seconds for ``min_items`` items and then
+        remove and return a tuple of False (a single lane has no
+        priority records) and a list of up to ``max_items`` items, which
+        is empty if nothing arrived. This drains the queue in one call
+        instead of one ``get`` and one ``empty`` per item.
+
+        :param max_items: most items to return with 0 returning all
+        :param timeout: seconds to wait with None waiting forever
+        :param min_items: number of items to wait for
+        """
+        self.wait_for_items(
+            min_items=min_items,
+            timeout=timeout)
+        items = []
+        while max_items <= 0 or len(items) < max_items:
+            try:
+                items.append(self.popleft())
+            except IndexError:
+                break
+        return False, items
+    # end of get_many
+
+    def get(
+            self,
+            block=True,
+            timeout=None):
+        """get
+
+        Remove and return the oldest item, waiting up to ``timeout``
+        seconds for one to arrive when ``block`` is True
+
+        :param block: wait for an item
+        :param timeout: seconds to wait with None waiting forever
+        """
+        try:
+            return self.popleft()
+        except IndexError:
+            if not block:
+                raise Empty()
+        if self.wait_for_items(
+                min_items=1,
+                timeout=timeout):
+            try:
+                return self.popleft()
+            except IndexError:
+                pass
+        raise Empty()
+    # end of get
+
+    def qsize(
+            self):
+        """qsize"""
+        return len(self.items)
+    # end of qsize
+
+    def empty(
+            self):
+        """empty"""
+        return len(self.items) == 0
+    # end of empty
+
+    def full(
+            self):
+        """full"""
+        if self.maxsize > 0 and len(self.items) >= self.maxsize:
+            return True
+        return self.max_bytes > 0 and self.num_bytes >= self.max_bytes
+    # end of full
+
+    def __str__(
+            self):
+        """__str__"""
+        return 'MemoryQueue(size={} maxsize={} bytes={} max_bytes={})'.format(
+            len(self.items),
+            self.maxsize,
+            self.num_bytes,
+            self.max_bytes)
+    # end of __str__
+
+# end of MemoryQueue
+
+
+class LaneQueue(object):
+    """
+    Priority lanes of ``MemoryQueue`` objects for a single consumer
+
+    Each record goes to the first lane whose minimum level it meets and
+    is subject to that lane's capacity and overflow policy. The consumer
+    takes up to ``weight`` records from a lane before moving on to the
+    next lane, so the priority lane is drained first without starving
+    the others.
+    """
+
+    def __init__(
+            self,
+            lanes):
+        """__init__
+
+        :param lanes: list of ``(min_level, weight, MemoryQueue)``
+                      tuples ordered from the highest priority lane
+                      down to a catch-all lane with a ``min_level``
+                      of ``logging.NOTSET``
+        """
+        self.lanes = lanes
+        self.weights = [
+            max(1, weight)
+            for min_level, weight, lane in lanes
+        ]
+        self.credits = list(self.weights)
+        self.lock = threading.Lock()
+        self.num_dropped = 0
+        self.num_dropped_bytes = 0
+        self.woken = False
+        # one wakeup event for all lanes
+        self.not_empty = threading.Event()
+        for min_level, weight, lane in self.lanes:
+            lane.not_empty = self.not_empty
+    # end of __init__
+
+    def wake(
+            self):
+        """wake
+
+        Wake the consumer without an item - used on shutdown
+        """
+        self.woken = True
+        self.not_empty.set()
+    # end of wake
+
+    def ready(
+            self,
+            min_items):
+        """ready
+
+        Return True if a priority lane holds an item, the
+        last lane holds ``min_items`` items or any lane is full
+
+        :param min_items: number of items the consumer waits for
+        """
+        for min_level, weight, lane in self.lanes[:-1]:
+            if not lane.empty() or lane.full():
+                return True
+        lane = self.lanes[-1][2]
+        return bool(
+            lane.qsize() >= min_items
+            or lane.full())
+    # end of ready
+
+    def wait_for_items(
+            self,
+            min_items=1,
+            timeout=None):
+        """wait_for_items
+
+        Wait until a priority item arrives or the last lane holds
+        ``min_items`` items and return True, or return False after
+        ``timeout`` seconds or a ``wake``
+
+        :param min_items: number of items to wait for
+        :param timeout: seconds to wait with None waiting forever
+        """
+        last_lane = self.lanes[-1][2]
+        if last_lane.maxsize > 0:
+            min_items = min(min_items, last_lane.maxsize)
+        if self.ready(min_items):
+            return True
+        end_time = None
+        if timeout is not None:
+            end_time = time.time() + timeout
+        # every priority item wakes the consumer
+        for min_level, weight, lane in self.lanes:
+            lane.wake_items = 1
+        last_lane.wake_items = min_items
+        try:
+            while True:
+                for min_level, weight, lane in self.lanes:
+                    lane.waiting = True
+                self.not_empty.clear()
+                if self.ready(min_items):
+                    return True
+                if self.woken:
+                    self.woken = False
+                    return False
+                remaining = None
+                if end_time is not None:
+                    remaining = end_time - time.time()
+                    if remaining <= 0:
+                        return False
+                self.not_empty.wait(
+                    remaining)
+            # end of waiting for items
+        finally:
+            for min_level, weight, lane in self.lanes:
+                lane.waiting = False
+    # end of wait_for_items
+
+    def get_lane(
+            self,
+            levelno):
+        """get_lane
+
+        Return the lane for a logging level number
+
+        :param levelno: logging level number of the record
+        """
+        for min_level, weight, lane in self.lanes:
+            if levelno >= min_level:
+                return lane
+        return self.lanes[-1][2]
+    # end of get_lane
+
+    def put_nowait(
+            self,
+            item):
+        """put_nowait
+
+        Add an item to the lowest priority lane without blocking
+
+        :param item: item to queue
+        """
+        self.lanes[-1][2].put_nowait(
+            item)
+    # end of put_nowait
+
+    def put(
+            self,
+            item,
+            block=True,
+            timeout=None):
+        """put
+
+        Add an item to the lowest priority lane
+
+        :param item: item to queue
+        :param block: wait for room
+        :param timeout: seconds to wait with None waiting forever
+        """
+        self.lanes[-1][2].put(
+            item,
+            block=block,
+            timeout=timeout)
+    # end of put
+
+    def offer(
+            self,
+            item,
+            levelno=logging.NOTSET):
+        """offer
+
+        Add an item to the lane for its level and apply that
+        lane's ``overflow_policy`` if the lane is full
+
+        :param item: item to queue
+        :param levelno: logging level number of the record
+        """
+        return self.get_lane(
+            levelno).offer(
+                item,
+                levelno)
+    # end of offer
+
+    def offer_many(
+            self,
+            items):
+        """offer_many
+
+        ``offer`` a list of items to their lanes in one call and
+        count the items that were not queued as dropped
+
+        Returns the number of queued items
+
+        :param items: list of ``(item, levelno)`` tuples
+        """
+        num_queued = 0
+        for item, levelno in items:
+            if self.offer(
+                    item,
+                    levelno):
+                num_queued += 1
+            else:
+                self.record_drop(
+                    item)
+        return num_queued
+    # end of offer_many
+
+    def record_drop(
+            self,
+            item):
+        """record_drop
+
+        Count a dropped item for the next ``pop_dropped``
+
+        :param item: dropped item
+        """
+        with self.lock:
+            self.num_dropped += 1
+            self.num_dropped_bytes += len(item)
+    # end of record_drop
+
+    def pop_dropped(
+            self):
+        """pop_dropped
+
+        Return the number of dropped items and their bytes across all
+        lanes since the last call as a tuple and reset the counters
+        """
+        with self.lock:
+            num_dropped = self.num_dropped
+            num_dropped_bytes = self.num_dropped_bytes
+            self.num_dropped = 0
+            self.num_dropped_bytes = 0
+        for min_level, weight, lane in self.lanes:
+            lane_dropped, lane_dropped_bytes = lane.pop_dropped()
+            num_dropped += lane_dropped
+            num_dropped_bytes += lane_dropped_bytes
+        return num_dropped, num_dropped_bytes
+    # end of pop_dropped
+
+    def has_dropped(
+            self):
+        """has_dropped
+
+        Return True if any lane dropped items since
+        the last ``pop_dropped``
+        """
+        return self.num_dropped > 0 or any(
+            lane.has_dropped()
+            for min_level, weight, lane in self.lanes)
+    # end of has_dropped
+
+    def get_priority_nowait(
+            self):
+        """get_priority_nowait
+
+        Remove and return a tuple of True if the item came from a
+        priority lane and the item, using the lane weights, or raise
+        ``queue.Empty``
+        """
+        for attempt in range(2):
+            for idx, (min_level, weight, lane) in enumerate(self.lanes):
+                if self.credits[idx] <= 0:
+                    continue
+                try:
+                    item = lane.get_nowait()
+                except Empty:
+                    continue
+                self.credits[idx] -= 1
+                return idx < len(self.lanes) - 1, item
+            # end of for all lanes with credits left
+            self.credits = list(self.weights)
+        raise Empty()
+    # end of get_priority_nowait
+
+    def get_priority(
+            self,
+            block=True,
+            timeout=None):
+        """get_priority
+
+        Remove and return a tuple of True if the item came from a
+        priority lane and the item, waiting up to ``timeout`` seconds
+        for one to arrive when ``block`` is True
+
+        :param block: wait for an item
+        :param timeout: seconds to wait with None waiting forever
+        """
+        try:
+            return self.get_priority_nowait()
+        except Empty:
+            if not block:
+                raise
+        if self.wait_for_items(
+                min_items=1,
+                timeout=timeout):
+            return self.get_priority_nowait()
+        raise Empty()
+    # end of get_priority
+
+    def get_many(
+            self,
+            max_items=0,
+            timeout=None,
+            min_items=1):
+        """get_many
+
+        Wait up to ``timeout`` seconds for a priority item or
+        ``min_items`` items and then remove and return a tuple of True
+        if any item came from a priority lane and a list of up to
+        ``max_items`` items taken with the lane weights
+
+        :param max_items: most items to return with 0 returning all
+        :param timeout: seconds to wait with None waiting forever
+        :param min_items: number of items to wait for
+        """
+        self.wait_for_items(
+            min_items=min_items,
+            timeout=timeout)
+        priority = False
+        items = []
+        while max_items <= 0 or len(items) < max_items:
+            try:
+                item_priority, item = self.get_priority_nowait()
+            except Empty:
+                break
+            priority = priority or item_priority
+            items.append(item)
+        return priority, items
+    # end of get_many
+
+    def get_nowait(
+            self):
+        """get_nowait
+
+        Remove and return the next item or raise ``queue.Empty``
+        """
+        return self.get_priority_nowait()[1]
+    # end of get_nowait
+
+    def get(
+            self,
+            block=True,
+            timeout=None):
+        """get
+
+        Remove and return the next item
+
+        :param block: wait for an item
+        :param timeout: seconds to wait with None waiting forever
+        """
+        return self.get_priority(
+            block=block,
+            timeout=timeout)[1]
+    # end of get
+
+    def qsize(
+            self):
+        """qsize"""
+        return sum(
+            lane.qsize()
+            for min_level, weight, lane in self.lanes)
+    # end of qsize
+
+    def empty(
+            self):
+        """empty"""
+        return all(
+            lane.empty()
+            for min_level, weight, lane in self.lanes)
+    # end of empty
+
+    def full(
+            self):
+        """full"""
+        return all(
+            lane.full()
+            for min_level, weight, lane in self.lanes)
+    # end of full
+
+    def __str__(
+            self):
+        """__str__"""
+        return 'LaneQueue({})'.format(
+            ' '.join(
+                '{}={}'.format(
+                    logging.getLevelName(min_level),
+                    lane)
+                for min_level, weight, lane in self.lanes))
+    # end of __str__
+
+# end of LaneQueue
+
+
+QUEUE_METHODS = (
+    'put_nowait',
+    'put',
+    'offer',
+    'offer_many',
+    'record_drop',
+    'pop_dropped',
+    'has_dropped',
+    'get_nowait',
+    'get',
+    'get_priority',
+    'get_many',
+    'wake',
+    'qsize',
+    'empty',
+    'full',
+    '__str__')
+
+
+class QueueManager(BaseManager):
+    """
+    Manager server hosting ``MemoryQueue`` objects
+    for publishers with a worker process
+    """
+
+# end of QueueManager
+
+
+# set in the QueueManager server process by mark_manager_server
+manager_server = {
+    'active': False
+}
+
+
+def mark_manager_server():
+    """mark_manager_server
+
+    ``QueueManager`` server process initializer that marks the process
+    so a forked publisher never starts threads or another manager in it
+    """
+    manager_server['active'] = True
+# end of mark_manager_server
+
+
+def in_manager_server():
+    """in_manager_server
+
+    Return True inside a ``QueueManager`` server process
+    """
+    return manager_server['active']
+# end of in_manager_server
+
+
+def start_queue_manager():
+    """start_queue_manager
+
+    Start and return a ``QueueManager`` server process
+    """
+    manager = QueueManager()
+    manager.start(
+        mark_manager_server)
+    return manager
+# end of start_queue_manager
+
+
+QueueManager.register(
+    'MemoryQueue',
+    MemoryQueue,
+    exposed=QUEUE_METHODS)
+
+
+def build_lane_queue(
+        priority_level=logging.ERROR,
+        priority_queue_size=0,
+        priority_max_bytes=0,
+        priority_weight=4,
+        **queue_args):
+    """build_lane_queue
+
+    Build a ``LaneQueue`` with a priority lane for records at or above
+    ``priority_level`` and a lane for every other record
+
+    :param priority_level: lowest level for the priority lane
+    :param priority_queue_size: maximum number of items in the
+                                priority lane with 0 is infinite
+    :param priority_max_bytes: maximum bytes in the priority lane
+                               with 0 is infinite
+    :param priority_weight: priority records drained for each
+                            record from the other lane
+    :param queue_args: ``MemoryQueue`` arguments for the other lane
+    """
+    priority_args = dict(queue_args)
+    priority_args['maxsize'] = priority_queue_size
+    priority_args['max_bytes'] = priority_max_bytes
+    return LaneQueue(
+        lanes=[
+            (
+                get_level(priority_level),
+                priority_weight,
+                MemoryQueue(**priority_args)
+            ),
+            (
+                logging.NOTSET,
+                1,
+                MemoryQueue(**queue_args)
+            )
+        ])
+# end of build_lane_queue
+
+
+QueueManager.register(
+    'LaneQueue',
+    build_lane_queue,
+    exposed=QUEUE_METHODS)
+QueueManager.register(
+    'dict',
+    dict,
+    DictProxy)
+
+
+def build_queue(
+        backend=QUEUE_BACKEND_MEMORY,
+        queue_size=0,
+        max_bytes=0,
+        overflow_policy=OVERFLOW_DROP_NEWEST,
+        overflow_level=logging.WARNING,
+        block_timeout=1.0,
+        priority_lanes=False,
+        priority_level=logging.ERROR,
+        priority_queue_size=0,
+        priority_max_bytes=0,
+        priority_weight=4,
+        shm_ring_bytes=16777216,
+        manager=None):
+    """build_queue
+
+    Build a queue for a publisher and return it with the
+    ``QueueManager`` that owns it (``None`` for the
+    in-process and shared memory backends)
+
+    :param backend: ``memory`` for an in-process ``MemoryQueue``,
+                    ``manager`` for a ``MemoryQueue`` hosted in a
+                    ``QueueManager`` server process or ``shm`` for a
+                    ``ShmRingQueue`` without priority lanes
+    :param queue_size: maximum number of queued items with
+                       0 is an infinite number of items
+    :param max_bytes: maximum bytes of queued items with
+                      0 is an infinite number of bytes
+    :param overflow_policy: what ``offer`` does when the queue is full
+    :param overflow_level: lowest level ``drop-below-level`` keeps
+    :param block_timeout: seconds ``block`` waits for room
+    :param priority_lanes: build a ``LaneQueue`` with a priority lane
+    :param priority_level: lowest level for the priority lane
+    :param priority_queue_size: maximum number of items in the
+                                priority lane with 0 is infinite
+    :param priority_max_bytes: maximum bytes in the priority lane
+                               with 0 is infinite
+    :param priority_weight: priority records drained for each
+                            record from the other lane
+    :param shm_ring_bytes: ``shm`` ring size when ``max_bytes`` is 0
+    :param manager: started ``QueueManager`` to host a ``manager``
+                    queue in instead of starting a new one
+    """
+    if backend == QUEUE_BACKEND_SHM:
+        if priority_lanes:
+            raise ValueError(
+                'the shm queue backend does not support priority lanes')
+        # imported here because shm_ring imports this module
+        from spylunking.shm_ring import ShmRingQueue
+        return ShmRingQueue(
+            capacity=max_bytes or shm_ring_bytes,
+            maxsize=queue_size,
+            overflow_policy=overflow_policy,
+            overflow_level=overflow_level,
+            block_timeout=block_timeout), None
+    queue_args = {
+        'maxsize': queue_size,
+        'max_bytes': max_bytes,
+        'overflow_policy': overflow_policy,
+        'overflow_level': overflow_level,
+        'block_timeout': block_timeout
+    }
+    queue_type = 'MemoryQueue'
+    if priority_lanes:
+        queue_type = 'LaneQueue'
+        queue_args.update({
+            'priority_level': priority_level,
+            'priority_queue_size': priority_queue_size,
+            'priority_max_bytes': priority_max_bytes,
+            'priority_weight': priority_weight
+        })
+    if backend == QUEUE_BACKEND_MANAGER:
+        if manager is None:
+            manager = start_queue_manager()
+        return getattr(manager, queue_type)(**queue_args), manager
+    elif backend == QUEUE_BACKEND_MEMORY:
+        if priority_lanes:
+            return build_lane_queue(**queue_args), None
+        return MemoryQueue(**queue_args), None
+    else:
+        raise ValueError(
+            'unsupported queue backend={} please use one of: {}'.format(
+                backend,
+                QUEUE_BACKENDS))
+# end of build_queue
@@ -24,23 +24,91 @@ Supported environment variables:
     export SPLUNK_VERIFY="<verify certs on HTTP POST>"
     export SPLUNK_TIMEOUT="<timeout in seconds>"
     export SPLUNK_QUEUE_SIZE="<num msgs allowed in queue - 0=infinite>"
+    export SPLUNK_MAX_BATCH_BYTES="<max encoded bytes per POST: 524288>"
+    export SPLUNK_MAX_BATCH_EVENTS="<max logs per POST - 0=infinite>"
+    export SPLUNK_LINGER_MS="<wait in ms for more logs per batch - 0=off>"
+    export SPLUNK_COMPRESS="<gzip POST bodies - 1 enable|0 off>"
+    export SPLUNK_COMPRESS_MIN_BYTES="<only gzip POST bodies this size: 1024>"
+    export SPLUNK_COMPRESS_LEVEL="<gzip level 1 fastest - 9 smallest: 6>"
+    export SPLUNK_ENDPOINT="<event (default) envelope|raw line events>"
+    export SPLUNK_CHANNEL="<HEC channel uuid - defaults to a new uuid>"
+    export SPLUNK_MAX_INFLIGHT="<concurrent POSTs per publisher: 1>"
+    export SPLUNK_USE_ACK="<wait for HEC indexer acks - 1 enable|0 off>"
+    export SPLUNK_ACK_WINDOW="<max unacknowledged batches in memory: 100>"
+    export SPLUNK_ACK_TIMEOUT="<resend unacknowledged batches after: 60.0>"
+    export SPLUNK_ACK_POLL_INTERVAL="<seconds between ack polls: 1.0>"
+    export SPLUNK_SPOOL_DIR="<spool failed batches to disk - empty disables>"
+    export SPLUNK_SPOOL_MAX_BYTES="<max spooled bytes on disk: 268435456>"
+    export SPLUNK_SPOOL_SEGMENT_BYTES="<bytes per spool segment: 8388608>"
+    export SPLUNK_SPOOL_REPLAY_INTERVAL="<seconds between replays: 5.0>"
+    export SPLUNK_QUEUE_MAX_BYTES="<bytes allowed in queue - 0=infinite>"
+    export SPLUNK_OVERFLOW_POLICY="<drop-newest (default)|drop-oldest|
+                                    drop-below-level|block>"
+    export SPLUNK_OVERFLOW_LEVEL="<lowest drop-below-level level: WARNING>"
+    export SPLUNK_OVERFLOW_BLOCK_TIMEOUT="<seconds block waits for room: 1.0>"
+    export SPLUNK_DROP_REPORT_INTERVAL="<seconds between dropped reports: 60.0>"
+    export SPLUNK_PRIORITY_LANES="<split logs into priority lanes - 1|0>"
+    export SPLUNK_PRIORITY_LEVEL="<lowest priority lane level: ERROR>"
+    export SPLUNK_PRIORITY_QUEUE_SIZE="<num msgs in the priority lane: 10000>"
+    export SPLUNK_PRIORITY_QUEUE_MAX_BYTES="<bytes in the priority lane: 0>"
+    export SPLUNK_PRIORITY_WEIGHT="<priority logs drained per other log: 4>"
+    export SPLUNK_ADAPTIVE_FLUSH="<plan batches from depth and latency - 1|0>"
+    export SPLUNK_TARGET_LATENCY_MS="<slowest healthy HEC POST: 250>"
+    export SPLUNK_MAX_LINGER_MS="<longest adaptive linger: 1000>"
+    export SPLUNK_MIN_BATCH_BYTES="<smallest adaptive batch limit: 16384>"
     export SPLUNK_SLEEP_INTERVAL="<sleep in seconds per batch>"
     export SPLUNK_RETRY_COUNT="<attempts per log to retry publishing>"
     export SPLUNK_RETRY_BACKOFF="<cooldown in seconds per failed POST>"
+    export SPLUNK_RETRY_MAX_BACKOFF="<longest retry backoff in seconds: 60.0>"
+    export SPLUNK_RETRY_MAX_PENDING="<max batches waiting for a retry: 100>"
+    export SPLUNK_BREAKER_THRESHOLD="<failed POSTs that open the breaker: 5>"
+    export SPLUNK_BREAKER_RESET="<seconds before probing HEC again: 30.0>"
+    export SPLUNK_DEAD_LETTER_FILE="<append rejected events here - empty drops>"
+    export SPLUNK_SORT_KEYS="<sort the HEC envelope keys - 1 (default)|0>"
+    export SPLUNK_EVENT_FORMAT="<string (default) JSON in a string|object>"
+    export SPLUNK_INDEXED_FIELDS="<comma-separated keys ex: name,dc,env>"
+    export SPLUNK_JSON_ENCODER="<auto (default)|orjson|ujson|rapidjson|json>"
+    export SPLUNK_MP_QUEUE_BACKEND="<shm (default) shared memory|manager>"
+    export SPLUNK_SHM_RING_BYTES="<ring bytes without a max bytes: 16777216>"
+    export SPLUNK_MP_NUM_WORKERS="<worker processes sending to Splunk: 1>"
+    export SPLUNK_MP_SHARD_BY="<round-robin (default)|logger name hash>"
+    export SPLUNK_MP_EMIT_BATCH_SIZE="<logs per queue put from emit: 1>"
+    export SPLUNK_MP_EMIT_LINGER_MS="<longest wait in ms for a queue put: 50>"
     export SPLUNK_DEBUG="<1 enable debug|0 off>"
 
 """
 
 import json
 import logging
+import os
+import threading
 import time
 import traceback
+import uuid
+import zlib
 import requests
 import signal
 import multiprocessing
-import spylunking.send_to_splunk as send_to_splunk
+from spylunking.send_to_splunk import HEC_ENDPOINT_RAW
 from spylunking.rnow import rnow
-from spylunking.ppj import ppj
+from spylunking.hec_sender import HecSender
+from spylunking.batch_builder import BatchBuilder
+from spylunking.hec_envelope import EVENT_FORMATS
+from spylunking.hec_envelope import encode_event
+from spylunking.hec_envelope import get_indexed_fields
+from spylunking.json_encoder import get_json_encoder
+from spylunking.sender_pool import SenderPool
+from spylunking.ack_tracker import AckTracker
+from spylunking.disk_spool import DiskSpool
+from spylunking.dead_letter import build_dead_letter
+from spylunking.flush_scheduler import FlushScheduler
+from spylunking.retry_scheduler import CircuitBreaker
+from spylunking.retry_scheduler import RetryScheduler
+from spylunking.memory_queue import QUEUE_BACKEND_MANAGER
+from spylunking.memory_queue import QUEUE_BACKEND_SHM
+from spylunking.memory_queue import build_queue
+from spylunking.memory_queue import get_level
+from spylunking.shm_ring import SHM_SUPPORTED
 from spylunking.consts import SPLUNK_HOST
 from spylunking.consts import SPLUNK_PORT
 from spylunking.consts import SPLUNK_TOKEN
@@ -53,13 +121,67 @@ from spylunking.consts import SPLUNK_SLEEP_INTERVAL
 from spylunking.consts import SPLUNK_RETRY_COUNT
 from spylunking.consts import SPLUNK_RETRY_BACKOFF
 from spylunking.consts import SPLUNK_QUEUE_SIZE
+from spylunking.consts import SPLUNK_MAX_BATCH_BYTES
+from spylunking.consts import SPLUNK_MAX_BATCH_EVENTS
+from spylunking.consts import SPLUNK_LINGER_MS
+from spylunking.consts import SPLUNK_COMPRESS
+from spylunking.consts import SPLUNK_COMPRESS_MIN_BYTES
+from spylunking.consts import SPLUNK_COMPRESS_LEVEL
+from spylunking.consts import SPLUNK_ENDPOINT
+from spylunking.consts import SPLUNK_CHANNEL
+from spylunking.consts import SPLUNK_MAX_INFLIGHT
+from spylunking.consts import SPLUNK_USE_ACK
+from spylunking.consts import SPLUNK_ACK_WINDOW
+from spylunking.consts import SPLUNK_ACK_TIMEOUT
+from spylunking.consts import SPLUNK_ACK_POLL_INTERVAL
+from spylunking.consts import SPLUNK_SPOOL_DIR
+from spylunking.consts import SPLUNK_SPOOL_MAX_BYTES
+from spylunking.consts import SPLUNK_SPOOL_SEGMENT_BYTES
+from spylunking.consts import SPLUNK_SPOOL_REPLAY_INTERVAL
+from spylunking.consts import SPLUNK_QUEUE_MAX_BYTES
+from spylunking.consts import SPLUNK_OVERFLOW_POLICY
+from spylunking.consts import SPLUNK_OVERFLOW_LEVEL
+from spylunking.consts import SPLUNK_OVERFLOW_BLOCK_TIMEOUT
+from spylunking.consts import SPLUNK_DROP_REPORT_INTERVAL
+from spylunking.consts import SPLUNK_PRIORITY_LANES
+from spylunking.consts import SPLUNK_PRIORITY_LEVEL
+from spylunking.consts import SPLUNK_PRIORITY_QUEUE_SIZE
+from spylunking.consts import SPLUNK_PRIORITY_QUEUE_MAX_BYTES
+from spylunking.consts import SPLUNK_PRIORITY_WEIGHT
+from spylunking.consts import SPLUNK_ADAPTIVE_FLUSH
+from spylunking.consts import SPLUNK_TARGET_LATENCY_MS
+from spylunking.consts import SPLUNK_MAX_LINGER_MS
+from spylunking.consts import SPLUNK_MIN_BATCH_BYTES
+from spylunking.consts import SPLUNK_RETRY_MAX_BACKOFF
+from spylunking.consts import SPLUNK_RETRY_MAX_PENDING
+from spylunking.consts import SPLUNK_BREAKER_THRESHOLD
+from spylunking.consts import SPLUNK_BREAKER_RESET
+from spylunking.consts import SPLUNK_DEAD_LETTER_FILE
+from spylunking.consts import SPLUNK_SORT_KEYS
+from spylunking.consts import SPLUNK_EVENT_FORMAT
+from spylunking.consts import SPLUNK_INDEXED_FIELDS
+from spylunking.consts import SPLUNK_MP_QUEUE_BACKEND
+from spylunking.consts import SPLUNK_SHM_RING_BYTES
+from spylunking.consts import SPLUNK_MP_NUM_WORKERS
+from spylunking.consts import SPLUNK_MP_SHARD_BY
+from spylunking.consts import SPLUNK_MP_EMIT_BATCH_SIZE
+from spylunking.consts import SPLUNK_MP_EMIT_LINGER_MS
 from spylunking.consts import SPLUNK_DEBUG
 from spylunking.consts import SPLUNK_HOSTNAME
-from requests.packages.urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 
 
-class MPSplunkPublisher(logging.Handler):
+SHARD_BY_ROUND_ROBIN = 'round-robin'
+SHARD_BY_LOGGER = 'logger'
+SHARD_BY = [
+    SHARD_BY_ROUND_ROBIN,
+    SHARD_BY_LOGGER
+]
+# bytes in each worker's shared stats slot
+STATS_SLOT_BYTES = 4096
+
+
+class MPSplunkPublisher(HecSender, logging.Handler):
     """
     A logging handler to send logs to a Splunk Enterprise instance
     running the Splunk HTTP Event Collector.
@@ -90,7 +212,55 @@ class MPSplunkPublisher(logging.Handler):
             debug=False,
             retry_count=20,
             run_once=False,
-            retry_backoff=2.0):
+            retry_backoff=2.0,
+            max_batch_bytes=None,
+            max_batch_events=None,
+            linger_ms=None,
+            compress=None,
+            compress_min_bytes=None,
+            compress_level=None,
+            endpoint=None,
+            channel=None,
+            max_inflight=None,
+            use_ack=None,
+            ack_window=None,
+            ack_timeout=None,
+            ack_poll_interval=None,
+            spool_dir=None,
+            spool_max_bytes=None,
+            spool_segment_bytes=None,
+            spool_replay_interval=None,
+            queue_max_bytes=None,
+            overflow_policy=None,
+            overflow_level=None,
+            overflow_block_timeout=None,
+            drop_report_interval=None,
+            priority_lanes=None,
+            priority_level=None,
+            priority_queue_size=None,
+            priority_queue_max_bytes=None,
+            priority_weight=None,
+            adaptive_flush=None,
+            target_latency_ms=None,
+            max_linger_ms=None,
+            min_batch_bytes=None,
+            retry_max_backoff=None,
+            retry_max_pending=None,
+            breaker_threshold=None,
+            breaker_reset=None,
+            dead_letter=None,
+            queue_backend=None,
+            shm_ring_bytes=None,
+            num_workers=None,
+            shard_by=None,
+            supervise_interval=1.0,
+            shutdown_timeout=30.0,
+            emit_batch_size=None,
+            emit_linger_ms=None,
+            sort_keys=None,
+            event_format=None,
+            indexed_fields=None,
+            json_encoder=None):
         """__init__
 
         Initialize the MPSplunkPublisher with support for
@@ -112,10 +282,130 @@ class MPSplunkPublisher(logging.Handler):
                            before dropping new logs with
                            0 is an infinite number of messages
         :param debug: debug the publisher
-        :param retry_count: number of publish retries per log record
-        :param retry_backoff: cooldown timer in seconds
+        :param retry_count: number of retries per failed batch
+        :param retry_backoff: base of the jittered exponential
+                              backoff between retries in seconds
         :param run_once: flag used by tests for publishing once
                          and shutting down
+        :param max_batch_bytes: send a batch once it holds this many
+                                encoded bytes
+        :param max_batch_events: send a batch once it holds this many
+                                 logs with 0 is an infinite number of logs
+        :param linger_ms: milliseconds to wait for more logs after the
+                          first log in a batch with 0 sending as soon
+                          as the queue is empty
+        :param compress: gzip POST bodies from the worker
+        :param compress_min_bytes: only gzip POST bodies that are
+                                   at least this many bytes
+        :param compress_level: gzip level from 1 (fastest)
+                               to 9 (smallest)
+        :param endpoint: ``event`` to POST JSON envelopes to
+                         ``/services/collector`` or ``raw`` to POST
+                         newline-delimited formatted logs to
+                         ``/services/collector/raw``
+        :param channel: HEC channel uuid sent in the
+                        ``X-Splunk-Request-Channel`` header
+                        - defaults to a new uuid per publisher
+        :param max_inflight: number of concurrent HTTP POSTs sharing
+                             the ``requests.Session`` connection pool
+                             with 1 sending from the worker - above
+                             1 batches can reach HEC out of order
+        :param use_ack: track HEC indexer acknowledgments for each batch
+                        on the ``channel`` (the HEC token must have
+                        indexer acknowledgment enabled)
+        :param ack_window: maximum number of unacknowledged batches
+                           to hold in memory before sending blocks
+        :param ack_timeout: seconds to wait for an acknowledgment
+                            before resending a batch
+        :param ack_poll_interval: seconds between bulk ack polls
+        :param spool_dir: directory to spool batches to while Splunk
+                          is unreachable with None or an empty string
+                          turning the spool off
+        :param spool_max_bytes: maximum bytes held in the spool
+        :param spool_segment_bytes: bytes per spool segment file
+        :param spool_replay_interval: seconds between attempts to
+                                      replay the spool to Splunk
+        :param queue_max_bytes: queue this many bytes of logs before
+                                applying the ``overflow_policy`` with
+                                0 is an infinite number of bytes
+        :param overflow_policy: ``drop-newest`` (default), ``drop-oldest``,
+                                ``drop-below-level`` or ``block`` when
+                                the queue is full
+        :param overflow_level: ``drop-below-level`` drops new logs below
+                               this level and makes room for the rest
+        :param overflow_block_timeout: seconds ``block`` waits for room
+                                       before dropping the log
+        :param drop_report_interval: seconds between the events
+                                     counting dropped logs
+        :param priority_lanes: queue logs at or above the
+                               ``priority_level`` in their own lane that
+                               is drained first and sent without waiting
+        :param priority_level: lowest level for the priority lane
+        :param priority_queue_size: queue this number of priority logs
+                                    with 0 is an infinite number
+        :param priority_queue_max_bytes: queue this many bytes of
+                                         priority logs with 0 is an
+                                         infinite number of bytes
+        :param priority_weight: priority logs drained for each
+                                log from the other lane
+        :param adaptive_flush: plan each batch's byte limit and linger
+                               from the queue depth and HEC latency
+                               with a ``FlushScheduler``
+        :param target_latency_ms: HEC POSTs slower than this make the
+                                  adaptive scheduler back off
+        :param max_linger_ms: longest adaptive linger
+        :param min_batch_bytes: smallest adaptive batch byte limit
+        :param retry_max_backoff: longest backoff between retries
+        :param retry_max_pending: maximum batches waiting for a retry
+        :param breaker_threshold: consecutive failed POSTs that stop
+                                  sending until HEC recovers - 0
+                                  disables the circuit breaker
+        :param breaker_reset: seconds before an open circuit breaker
+                              lets a probe batch through
+        :param dead_letter: file path or callable taking ``event`` and
+                            ``reason`` for the events HEC rejects
+                            - a callable runs in the worker process
+        :param queue_backend: ``shm`` for a shared memory ring buffer
+                              or ``manager`` for a ``QueueManager``
+                              queue - priority lanes and python
+                              versions without
+                              ``multiprocessing.shared_memory``
+                              use ``manager``
+        :param shm_ring_bytes: ``shm`` ring size when
+                               ``queue_max_bytes`` is 0
+        :param num_workers: number of worker processes sending to
+                            Splunk - each worker reads its own queue
+                            shard and keeps its own HTTP session,
+                            channel and ``spool_dir/worker-<n>``
+        :param shard_by: ``round-robin`` (default) spreads logs evenly
+                         across the workers and ``logger`` sends every
+                         log from a logger to the same worker to keep
+                         them in order
+        :param supervise_interval: seconds between checks for crashed
+                                   workers to restart
+        :param shutdown_timeout: seconds ``shutdown`` waits for each
+                                 worker to send the logs left in its
+                                 queue shard and exit
+        :param emit_batch_size: buffer this many logs in the logging
+                                process and put them on the queue with
+                                one ``offer_many`` call with 1 putting
+                                each log as it is emitted
+        :param emit_linger_ms: longest time in milliseconds a buffered
+                               log waits for the rest of its
+                               ``emit_batch_size`` - logs at or above
+                               the ``priority_level`` are put at once
+        :param sort_keys: sort the HEC envelope keys - the
+                          constant keys are encoded once either way
+        :param event_format: ``string`` sends each formatted log as
+                             a JSON string and ``object`` sends the
+                             dictionary from a formatter's
+                             ``format_event`` as a nested JSON object
+        :param indexed_fields: list or comma-separated string of
+                               drill-down keys like ``name,dc,env``
+                               to send as HEC indexed ``fields``
+        :param json_encoder: ``auto``, ``orjson``, ``ujson``,
+                             ``rapidjson`` or ``json`` encoder
+                             for the HEC events
         """
 
         logging.Handler.__init__(self)
@@ -160,20 +450,253 @@ class MPSplunkPublisher(logging.Handler):
         self.queue_size = queue_size
         if self.queue_size is None:
             self.queue_size = SPLUNK_QUEUE_SIZE
-
-        self.log_payload = ''
-
-        self.session = requests.Session()
+        self.max_batch_bytes = max_batch_bytes
+        if self.max_batch_bytes is None:
+            self.max_batch_bytes = SPLUNK_MAX_BATCH_BYTES
+        self.max_batch_events = max_batch_events
+        if self.max_batch_events is None:
+            self.max_batch_events = SPLUNK_MAX_BATCH_EVENTS
+        self.linger_ms = linger_ms
+        if self.linger_ms is None:
+            self.linger_ms = SPLUNK_LINGER_MS
+        self.compress = compress
+        if self.compress is None:
+            self.compress = SPLUNK_COMPRESS
+        self.compress_min_bytes = compress_min_bytes
+        if self.compress_min_bytes is None:
+            self.compress_min_bytes = SPLUNK_COMPRESS_MIN_BYTES
+        self.compress_level = compress_level
+        if self.compress_level is None:
+            self.compress_level = SPLUNK_COMPRESS_LEVEL
+        self.endpoint = endpoint
+        if self.endpoint is None:
+            self.endpoint = SPLUNK_ENDPOINT
+        self.channel = channel
+        if self.channel is None:
+            self.channel = SPLUNK_CHANNEL
+        # generated channels are regenerated for each extra worker
+        self.channel_generated = not self.channel
+        if not self.channel:
+            self.channel = str(uuid.uuid4())
+        self.max_inflight = max_inflight
+        if self.max_inflight is None:
+            self.max_inflight = SPLUNK_MAX_INFLIGHT
+        self.use_ack = use_ack
+        if self.use_ack is None:
+            self.use_ack = SPLUNK_USE_ACK
+        self.ack_window = ack_window
+        if self.ack_window is None:
+            self.ack_window = SPLUNK_ACK_WINDOW
+        self.ack_timeout = ack_timeout
+        if self.ack_timeout is None:
+            self.ack_timeout = SPLUNK_ACK_TIMEOUT
+        self.ack_poll_interval = ack_poll_interval
+        if self.ack_poll_interval is None:
+            self.ack_poll_interval = SPLUNK_ACK_POLL_INTERVAL
+        self.spool_dir = spool_dir
+        if self.spool_dir is None:
+            self.spool_dir = SPLUNK_SPOOL_DIR
+        self.spool_max_bytes = spool_max_bytes
+        if self.spool_max_bytes is None:
+            self.spool_max_bytes = SPLUNK_SPOOL_MAX_BYTES
+        self.spool_segment_bytes = spool_segment_bytes
+        if self.spool_segment_bytes is None:
+            self.spool_segment_bytes = SPLUNK_SPOOL_SEGMENT_BYTES
+        self.spool_replay_interval = spool_replay_interval
+        if self.spool_replay_interval is None:
+            self.spool_replay_interval = SPLUNK_SPOOL_REPLAY_INTERVAL
+        self.queue_max_bytes = queue_max_bytes
+        if self.queue_max_bytes is None:
+            self.queue_max_bytes = SPLUNK_QUEUE_MAX_BYTES
+        self.overflow_policy = overflow_policy
+        if self.overflow_policy is None:
+            self.overflow_policy = SPLUNK_OVERFLOW_POLICY
+        self.overflow_level = overflow_level
+        if self.overflow_level is None:
+            self.overflow_level = SPLUNK_OVERFLOW_LEVEL
+        self.overflow_block_timeout = overflow_block_timeout
+        if self.overflow_block_timeout is None:
+            self.overflow_block_timeout = SPLUNK_OVERFLOW_BLOCK_TIMEOUT
+        self.drop_report_interval = drop_report_interval
+        if self.drop_report_interval is None:
+            self.drop_report_interval = SPLUNK_DROP_REPORT_INTERVAL
+        self.last_drop_report = time.time()
+        self.priority_lanes = priority_lanes
+        if self.priority_lanes is None:
+            self.priority_lanes = SPLUNK_PRIORITY_LANES
+        self.priority_level = priority_level
+        if self.priority_level is None:
+            self.priority_level = SPLUNK_PRIORITY_LEVEL
+        self.priority_queue_size = priority_queue_size
+        if self.priority_queue_size is None:
+            self.priority_queue_size = SPLUNK_PRIORITY_QUEUE_SIZE
+        self.priority_queue_max_bytes = priority_queue_max_bytes
+        if self.priority_queue_max_bytes is None:
+            self.priority_queue_max_bytes = SPLUNK_PRIORITY_QUEUE_MAX_BYTES
+        self.priority_weight = priority_weight
+        if self.priority_weight is None:
+            self.priority_weight = SPLUNK_PRIORITY_WEIGHT
+        self.adaptive_flush = adaptive_flush
+        if self.adaptive_flush is None:
+            self.adaptive_flush = SPLUNK_ADAPTIVE_FLUSH
+        self.target_latency_ms = target_latency_ms
+        if self.target_latency_ms is None:
+            self.target_latency_ms = SPLUNK_TARGET_LATENCY_MS
+        self.max_linger_ms = max_linger_ms
+        if self.max_linger_ms is None:
+            self.max_linger_ms = SPLUNK_MAX_LINGER_MS
+        self.min_batch_bytes = min_batch_bytes
+        if self.min_batch_bytes is None:
+            self.min_batch_bytes = SPLUNK_MIN_BATCH_BYTES
+        self.retry_max_backoff = retry_max_backoff
+        if self.retry_max_backoff is None:
+            self.retry_max_backoff = SPLUNK_RETRY_MAX_BACKOFF
+        self.retry_max_pending = retry_max_pending
+        if self.retry_max_pending is None:
+            self.retry_max_pending = SPLUNK_RETRY_MAX_PENDING
+        self.breaker_threshold = breaker_threshold
+        if self.breaker_threshold is None:
+            self.breaker_threshold = SPLUNK_BREAKER_THRESHOLD
+        self.breaker_reset = breaker_reset
+        if self.breaker_reset is None:
+            self.breaker_reset = SPLUNK_BREAKER_RESET
+        self.dead_letter = dead_letter
+        if self.dead_letter is None:
+            self.dead_letter = SPLUNK_DEAD_LETTER_FILE
+        self.dead_letter = build_dead_letter(
+            dead_letter=self.dead_letter)
+        self.sort_keys = sort_keys
+        if self.sort_keys is None:
+            self.sort_keys = SPLUNK_SORT_KEYS
+        self.event_format = event_format
+        if self.event_format is None:
+            self.event_format = SPLUNK_EVENT_FORMAT
+        if self.event_format not in EVENT_FORMATS:
+            raise ValueError(
+                'unsupported event_format={} please use one of: {}'.format(
+                    self.event_format,
+                    EVENT_FORMATS))
+        self.indexed_fields = indexed_fields
+        if self.indexed_fields is None:
+            self.indexed_fields = SPLUNK_INDEXED_FIELDS
+        self.indexed_fields = get_indexed_fields(
+            self.indexed_fields)
+        self.json_encoder = get_json_encoder(
+            json_encoder)
+        self.num_dead_letters = 0
+        self.breaker = CircuitBreaker(
+            failure_threshold=self.breaker_threshold,
+            reset_timeout=self.breaker_reset)
+
+        self.batch = BatchBuilder(
+            max_bytes=self.max_batch_bytes,
+            max_events=self.max_batch_events,
+            linger_ms=self.linger_ms)
+        # logs read from the queue that did not fit in the last batch
+        self.pending = []
+        self.pending_priority = False
+        self.scheduler = None
+        if self.adaptive_flush:
+            self.scheduler = FlushScheduler(
+                min_batch_bytes=self.min_batch_bytes,
+                max_batch_bytes=self.max_batch_bytes,
+                min_linger_ms=self.linger_ms,
+                max_linger_ms=max(self.linger_ms, self.max_linger_ms),
+                target_latency_ms=self.target_latency_ms)
+
+        self.session = None
         self.num_sent = 0
+        # started in the worker process by start_sender_pool
+        self.sender_pool = None
+        # started in the worker process by start_ack_tracker
+        self.ack_tracker = None
+        # started in the worker process by start_retry_scheduler
+        self.retry_scheduler = None
+        # started in the worker process by start_spool
+        self.spool = None
 
         # Multiprocesing entities
         self.run_once = run_once
         self.processes = []
-        self.manager = multiprocessing.Manager()
-        self.queue = self.manager.Queue(maxsize=self.queue_size)
+        self.num_workers = num_workers
+        if self.num_workers is None:
+            self.num_workers = SPLUNK_MP_NUM_WORKERS
+        self.num_workers = max(1, int(self.num_workers))
+        self.shard_by = shard_by
+        if self.shard_by is None:
+            self.shard_by = SPLUNK_MP_SHARD_BY
+        if self.shard_by not in SHARD_BY:
+            raise ValueError(
+                'unsupported shard_by={} please use one of: {}'.format(
+                    self.shard_by,
+                    SHARD_BY))
+        self.supervise_interval = supervise_interval
+        self.shutdown_timeout = shutdown_timeout
+        # set in each worker process by run_worker
+        self.worker_index = 0
+        self.in_worker = False
+        self.next_shard = 0
+        # logger name to queue shard
+        self.logger_shards = {}
+        self.supervisor = None
+        self.num_restarts = 0
+        self.emit_batch_size = emit_batch_size
+        if self.emit_batch_size is None:
+            self.emit_batch_size = SPLUNK_MP_EMIT_BATCH_SIZE
+        self.emit_linger_ms = emit_linger_ms
+        if self.emit_linger_ms is None:
+            self.emit_linger_ms = SPLUNK_MP_EMIT_LINGER_MS
+        # logs waiting in this process for one put per queue shard
+        self.emit_buffers = []
+        self.num_buffered = 0
+        self.emit_buffer_time = 0.0
+        self.emit_pid = os.getpid()
+        self.emit_flusher = None
+        # one force_flush sends from the calling thread at a time
+        self.force_flush_lock = threading.Lock()
+        self.emit_priority_level = get_level(
+            self.priority_level)
+        self.queue_backend = queue_backend
+        if self.queue_backend is None:
+            self.queue_backend = SPLUNK_MP_QUEUE_BACKEND
+        if self.queue_backend == QUEUE_BACKEND_SHM and (
+                not SHM_SUPPORTED or self.priority_lanes):
+            self.queue_backend = QUEUE_BACKEND_MANAGER
+        self.shm_ring_bytes = shm_ring_bytes
+        if self.shm_ring_bytes is None:
+            self.shm_ring_bytes = SPLUNK_SHM_RING_BYTES
+        # one queue shard per worker sharing one manager
+        # that is only started for the manager backend
+        self.queues = []
+        self.manager = None
+        for worker_index in range(self.num_workers):
+            use_queue, self.manager = build_queue(
+                backend=self.queue_backend,
+                queue_size=self.queue_size,
+                max_bytes=self.queue_max_bytes,
+                overflow_policy=self.overflow_policy,
+                overflow_level=self.overflow_level,
+                block_timeout=self.overflow_block_timeout,
+                priority_lanes=self.priority_lanes,
+                priority_level=self.priority_level,
+                priority_queue_size=self.priority_queue_size,
+                priority_max_bytes=self.priority_queue_max_bytes,
+                priority_weight=self.priority_weight,
+                shm_ring_bytes=self.shm_ring_bytes,
+                manager=self.manager)
+            self.queues.append(use_queue)
+            self.emit_buffers.append([])
+        self.queue = self.queues[0]
+        # adaptive flush stats published by each worker process
+        # as json in its own shared memory slot
+        self.stats = [
+            multiprocessing.Array(
+                'c',
+                STATS_SLOT_BYTES)
+            for worker_index in range(self.num_workers)
+        ]
         self.shutdown_event = multiprocessing.Event()
         self.shutdown_ack = multiprocessing.Event()
-        self.already_done = multiprocessing.Event()
 
         self.debug = debug
         if SPLUNK_DEBUG:
@@ -188,6 +711,9 @@ class MPSplunkPublisher(logging.Handler):
         if hostname is None:
             self.hostname = SPLUNK_HOSTNAME
 
+        self.build_urls()
+        self.build_envelope()
+
         self.debug_log('preparing to override loggers')
 
         # prevent infinite recursion by silencing requests and urllib3 loggers
@@ -201,20 +727,31 @@ class MPSplunkPublisher(logging.Handler):
         if not self.verify:
             requests.packages.urllib3.disable_warnings()
 
-        # Set up automatic retry with back-off
         self.debug_log('preparing to create a Requests session')
-        retry = Retry(
-            total=self.retry_count,
-            backoff_factor=self.retry_backoff,
-            method_whitelist=False,  # Retry for any HTTP verb
-            status_forcelist=[500, 502, 503, 504])
-        self.session.mount('https://', HTTPAdapter(max_retries=retry))
+        self.session = self.build_session()
 
         self.start_worker()
 
         self.debug_log('class initialize complete')
     # end of __init__
 
+    def build_session(
+            self):
+        """build_session
+
+        Return a new ``requests.Session`` with a connection
+        pool sized for ``max_inflight`` POSTs
+        """
+        session = requests.Session()
+        # retries are scheduled by the publisher instead of urllib3
+        session.mount(
+            'https://',
+            HTTPAdapter(
+                max_retries=0,
+                pool_maxsize=max(10, self.max_inflight)))
+        return session
+    # end of build_session
+
     def emit(
             self,
             record):
@@ -228,6 +765,10 @@ class MPSplunkPublisher(logging.Handler):
         """
         self.debug_log('emit - start')
 
+        levelno = record.levelno
+        shard = self.get_shard_index(
+            record.name)
+        use_queue = self.queues[shard]
         try:
             record = self.format_record(
                 record)
@@ -243,10 +784,18 @@ class MPSplunkPublisher(logging.Handler):
             try:
                 self.debug_log(
                     'writing to queue={}'.format(
-                        self.queue))
+                        use_queue))
+                if self.emit_batch_size > 1:
+                    self.buffer_record(
+                        shard=shard,
+                        record=record,
+                        levelno=levelno)
                 # Put log message into queue; worker thread will pick up
-                self.queue.put(
-                    record)
+                elif not use_queue.offer(
+                        record,
+                        levelno):
+                    use_queue.record_drop(
+                        record)
             except Exception:
                 self.write_log(
                     'log queue full; log data will be dropped.')
@@ -258,38 +807,275 @@ class MPSplunkPublisher(logging.Handler):
         self.debug_log('emit - done')
     # end of emit
 
+    def get_shard_index(
+            self,
+            name):
+        """get_shard_index
+
+        Return the position of the queue shard for a log record.
+        ``emit`` runs under the handler lock so the round-robin
+        position does not need its own lock.
+
+        :param name: name of the record's logger
+        """
+        if self.num_workers == 1:
+            return 0
+        if self.shard_by == SHARD_BY_LOGGER:
+            shard = self.logger_shards.get(name)
+            if shard is None:
+                shard = zlib.crc32(
+                    name.encode('utf-8')) % self.num_workers
+                self.logger_shards[name] = shard
+        else:
+            shard = self.next_shard
+            self.next_shard = (shard + 1) % self.num_workers
+        return shard
+    # end of get_shard_index
+
+    def get_shard(
+            self,
+            name):
+        """get_shard
+
+        Return the queue shard for a log record
+
+        :param name: name of the record's logger
+        """
+        return self.queues[self.get_shard_index(name)]
+    # end of get_shard
+
+    def check_emit_pid(
+            self):
+        """check_emit_pid
+
+        Drop the logs a forked child copied from its parent's
+        emit buffers - the parent still puts them on the queue
+        """
+        pid = os.getpid()
+        if pid != self.emit_pid:
+            self.emit_pid = pid
+            self.emit_buffers = [[] for use_queue in self.queues]
+            self.num_buffered = 0
+            self.emit_flusher = None
+    # end of check_emit_pid
+
+    def buffer_record(
+            self,
+            shard,
+            record,
+            levelno):
+        """buffer_record
+
+        Buffer a formatted log and put the buffers on their queue
+        shards once ``emit_batch_size`` logs are buffered, the oldest
+        has waited ``emit_linger_ms`` or the log is at or above the
+        ``priority_level``. The caller must hold the handler lock.
+
+        :param shard: position of the log's queue shard
+        :param record: formatted log
+        :param levelno: logging level number of the log
+        """
+        self.check_emit_pid()
+        now = time.time()
+        if self.num_buffered == 0:
+            self.emit_buffer_time = now
+        self.emit_buffers[shard].append(
+            (record, levelno))
+        self.num_buffered += 1
+        if (self.num_buffered >= self.emit_batch_size
+                or levelno >= self.emit_priority_level
+                or (now - self.emit_buffer_time) * 1000.0
+                >= self.emit_linger_ms):
+            self.flush_emit_buffers()
+        elif self.emit_flusher is None:
+            self.emit_flusher = threading.Thread(
+                target=self.run_emit_flusher,
+                name='mpsplunkpub-emit-flusher')
+            self.emit_flusher.daemon = True
+            self.emit_flusher.start()
+    # end of buffer_record
+
+    def flush_emit_buffers(
+            self):
+        """flush_emit_buffers
+
+        Put every buffered log on its queue shard with one
+        ``offer_many`` call per shard. The caller must hold
+        the handler lock.
+        """
+        self.check_emit_pid()
+        if self.num_buffered == 0:
+            return
+        for shard, buffered in enumerate(self.emit_buffers):
+            if buffered:
+                self.emit_buffers[shard] = []
+                self.queues[shard].offer_many(
+                    buffered)
+        self.num_buffered = 0
+    # end of flush_emit_buffers
+
+    def run_emit_flusher(
+            self):
+        """run_emit_flusher
+
+        Thread in the logging process that puts buffered logs on
+        the queue once they waited ``emit_linger_ms`` so a quiet
+        logger does not hold them back
+        """
+        interval = self.emit_linger_ms / 1000.0
+        pid = os.getpid()
+        while not self.shutdown_event.wait(interval):
+            if pid != os.getpid():
+                return
+            self.acquire()
+            try:
+                if self.num_buffered > 0 and (
+                        time.time() - self.emit_buffer_time
+                        >= interval):
+                    self.flush_emit_buffers()
+            except Exception as e:
+                self.write_log(
+                    'failed putting buffered logs on the queue '
+                    'ex={}'.format(
+                        e))
+            finally:
+                self.release()
+        # end of while not shutting down
+    # end of run_emit_flusher
+
     def start_worker(
             self):
         """start_worker
 
-        Start the helper worker process to package queued messages
-        and send them to Splunk
+        Start the helper worker processes to package queued messages
+        and send them to Splunk and the thread supervising them
         """
         # Start a worker thread responsible for sending logs
         if not self.is_shutting_down(shutdown_event=self.shutdown_event) \
                 and self.sleep_interval > 0.1:
             self.processes = []
-            self.debug_log(
-                'start_worker - start multiprocessing.Process')
-            p = multiprocessing.Process(
-                target=self.perform_work,
-                args=(
-                    self.queue,
-                    self.shutdown_event,
-                    self.shutdown_ack,
-                    self.already_done))
-            p.daemon = True
-            p.start()
-            self.processes.append({
-                'process': p,
-                'shutdown_event': self.shutdown_event,
-                'shutdown_ack_event': self.shutdown_ack,
-                'already_done_event': self.already_done
-            })
+            for worker_index in range(self.num_workers):
+                self.processes.append({
+                    'process': None,
+                    'worker_index': worker_index,
+                    'queue': self.queues[worker_index],
+                    'shutdown_event': self.shutdown_event,
+                    'shutdown_ack_event': self.shutdown_ack,
+                    'already_done_event': multiprocessing.Event()
+                })
+                self.start_worker_process(
+                    worker=self.processes[-1])
+            self.supervisor = threading.Thread(
+                target=self.supervise_workers,
+                name='mpsplunkpub-supervisor')
+            self.supervisor.daemon = True
+            self.supervisor.start()
             self.debug_log(
                 'start_worker - done')
     # end of start_worker
 
+    def start_worker_process(
+            self,
+            worker):
+        """start_worker_process
+
+        Start the ``multiprocessing.Process`` for one worker
+
+        :param worker: worker dictionary from ``self.processes``
+        """
+        self.debug_log(
+            'start_worker - start multiprocessing.Process worker={}'.format(
+                worker['worker_index']))
+        worker['already_done_event'].clear()
+        p = multiprocessing.Process(
+            target=self.run_worker,
+            args=(
+                worker['worker_index'],
+                worker['queue'],
+                worker['shutdown_event'],
+                worker['shutdown_ack_event'],
+                worker['already_done_event']))
+        p.daemon = True
+        p.start()
+        worker['process'] = p
+    # end of start_worker_process
+
+    def supervise_workers(
+            self):
+        """supervise_workers
+
+        Parent thread that restarts worker processes that exited
+        before shutdown. Logs a crashed worker was holding in memory
+        are lost but the logs still in its queue shard are sent by
+        the new worker.
+        """
+        while not self.shutdown_event.wait(self.supervise_interval):
+            for worker in self.processes:
+                p = worker['process']
+                if p.is_alive() or self.is_shutting_down(
+                        shutdown_event=self.shutdown_event):
+                    continue
+                p.join()
+                self.write_log(
+                    'restarting worker={} exitcode={} restarts={}'.format(
+                        worker['worker_index'],
+                        p.exitcode,
+                        self.num_restarts + 1))
+                try:
+                    self.start_worker_process(
+                        worker=worker)
+                    # counted once the new process is in self.processes
+                    self.num_restarts += 1
+                except Exception as e:
+                    self.write_log(
+                        'failed restarting worker={} ex={}'.format(
+                            worker['worker_index'],
+                            e))
+            # end of for all workers
+        # end of while not shutting down
+    # end of supervise_workers
+
+    def run_worker(
+            self,
+            worker_index,
+            use_queue,
+            shutdown_event,
+            shutdown_ack_event,
+            already_done_event):
+        """run_worker
+
+        Worker process target that sets up the worker's own HTTP
+        session, channel and spool before running ``perform_work``
+
+        :param worker_index: position of the worker
+        :param use_queue: queue shard holding the worker's messages
+        :param shutdown_event: multiprocessing.Event - shutdown event
+        :param shutdown_ack_event: multiprocessing.Event -
+                                   acknowledge shutdown is in progress
+        :param already_done_event: multiprocessing.Event -
+                                   already shutting down
+        """
+        self.worker_index = worker_index
+        # the parent owns the other workers and the queue shards
+        self.in_worker = True
+        # pooled connections are never shared with the parent
+        self.session = self.build_session()
+        if self.num_workers > 1:
+            if self.channel_generated:
+                self.channel = str(uuid.uuid4())
+                self.build_urls()
+            if self.spool_dir:
+                self.spool_dir = os.path.join(
+                    self.spool_dir,
+                    'worker-{}'.format(
+                        worker_index))
+        self.perform_work(
+            use_queue,
+            shutdown_event,
+            shutdown_ack_event,
+            already_done_event)
+    # end of run_worker
+
     def write_log(
             self,
             log_message):
@@ -335,28 +1121,21 @@ class MPSplunkPublisher(logging.Handler):
         self.debug_log(
             'format_record - start')
 
-        if self.source is None:
-            source = record.pathname
-        else:
-            source = self.source
-
-        current_time = time.time()
-
-        params = {
-            'time': current_time,
-            'host': self.hostname,
-            'index': self.index,
-            'source': source,
-            'sourcetype': self.sourcetype,
-            'event': self.format(record),
-        }
-
-        self.debug_log(
-            'record dictionary created')
-
-        formatted_record = json.dumps(
-            params,
-            sort_keys=True)
+        if self.endpoint == HEC_ENDPOINT_RAW:
+            # the raw endpoint reads the metadata from the url
+            return '{}\n'.format(
+                self.format(record))
+
+        formatted_record = self.envelope.encode(
+            event=encode_event(
+                handler=self,
+                record=record,
+                event_format=self.event_format),
+            created=record.created,
+            source=record.pathname,
+            encoded=True,
+            fields=self.get_fields(
+                record))
 
         self.debug_log(
             'format_record - done')
@@ -375,7 +1154,7 @@ class MPSplunkPublisher(logging.Handler):
         Process handler function for processing messages
         found in the ``multiprocessing.Manager.queue``
 
-        Build the ``self.log_payload`` from the queued log messages
+        Build the ``self.batch`` from the queued log messages
         and POST it to the Splunk endpoint
 
         :param use_queue: multiprocessing.Queue - queue holding the messages
@@ -397,6 +1176,13 @@ class MPSplunkPublisher(logging.Handler):
         self.debug_log((
             'perform_work - ready'))
 
+        if not self.is_shutting_down(
+                shutdown_event=shutdown_event):
+            self.start_sender_pool()
+            self.start_ack_tracker()
+            self.start_retry_scheduler()
+            self.start_spool()
+
         try:
 
             not_done = not self.is_shutting_down(
@@ -405,6 +1191,8 @@ class MPSplunkPublisher(logging.Handler):
             while not_done:
 
                 try:
+                    self.plan_batch(
+                        use_queue=use_queue)
                     self.build_payload_from_queued_messages(
                         use_queue=use_queue,
                         shutdown_event=shutdown_event)
@@ -419,17 +1207,29 @@ class MPSplunkPublisher(logging.Handler):
                             'Exception shutting down with ex={}').format(
                                 e))
                         self.shutdown()
-                    already_done_event.set()
+                    self.finish_work(
+                        use_queue=use_queue,
+                        already_done_event=already_done_event)
                     return
                 # end of try to return if the queue
 
+                self.add_drop_report(
+                    use_queue=use_queue)
                 self.publish_to_splunk()
+                worker_stats = self.get_retry_stats()
+                if self.scheduler is not None:
+                    worker_stats.update(
+                        self.scheduler.stats())
+                self.publish_stats(
+                    worker_stats=worker_stats)
 
                 if self.is_shutting_down(
                         shutdown_event=shutdown_event):
                     self.debug_log(
                         'perform_work - done - shutdown detected')
-                    already_done_event.set()
+                    self.finish_work(
+                        use_queue=use_queue,
+                        already_done_event=already_done_event)
                     return
                 # check if done
 
@@ -448,13 +1248,223 @@ class MPSplunkPublisher(logging.Handler):
                         e))
         # end of try/ex
 
-        already_done_event.set()
+        self.finish_work(
+            use_queue=use_queue,
+            already_done_event=already_done_event)
 
         self.debug_log((
             'perform_work - done'))
 
     # end of perform_work
 
+    def finish_work(
+            self,
+            use_queue,
+            already_done_event):
+        """finish_work
+
+        Send the logs left in the worker's queue shard, wait for the
+        in-flight, retried and unacknowledged batches and then let
+        ``shutdown`` know this worker is done
+
+        :param use_queue: queue holding the messages
+        :param already_done_event: multiprocessing.Event -
+                                   already shutting down
+        """
+        try:
+            self.drain_queue(
+                use_queue=use_queue)
+        except Exception as e:
+            self.write_log(
+                'failed draining worker={} queue ex={}'.format(
+                    self.worker_index,
+                    e))
+        self.stop_sender_pool()
+        self.stop_ack_tracker()
+        self.stop_retry_scheduler()
+        self.stop_spool()
+        already_done_event.set()
+    # end of finish_work
+
+    def drain_queue(
+            self,
+            use_queue):
+        """drain_queue
+
+        Send every log left in the queue shard on shutdown. The
+        shard is read without blocking until it is empty so the logs
+        queued right before ``shutdown`` are not lost. Returns the
+        number of logs read from the queue.
+
+        :param use_queue: queue holding the messages
+        """
+        num_logs = 0
+        while True:
+            if self.pending:
+                priority = self.pending_priority
+                msgs = self.pending
+                self.pending = []
+            else:
+                priority, msgs = use_queue.get_many(
+                    max_items=self.batch.room(),
+                    timeout=0)
+                num_logs += len(msgs)
+            if not msgs and len(self.batch) == 0:
+                break
+            self.fill_batch(
+                priority=priority,
+                msgs=msgs)
+            if self.batch.is_full() or not msgs:
+                self.publish_to_splunk()
+        # end of draining the queue
+        self.debug_log(
+            'drain_queue - done worker={} read={}'.format(
+                self.worker_index,
+                num_logs))
+        return num_logs
+    # end of drain_queue
+
+    def start_sender_pool(
+            self):
+        """start_sender_pool
+
+        Start the sender threads inside the worker process
+        when ``max_inflight`` is above 1
+        """
+        if self.sender_pool is None and self.max_inflight > 1:
+            self.debug_log(
+                'starting sender pool max_inflight={}'.format(
+                    self.max_inflight))
+            self.sender_pool = SenderPool(
+                send_func=self.send_payload,
+                max_inflight=self.max_inflight,
+                name='mpsplunkpub-sender')
+    # end of start_sender_pool
+
+    def stop_sender_pool(
+            self):
+        """stop_sender_pool
+
+        Wait for in-flight batches and stop the sender threads
+        """
+        if self.sender_pool:
+            self.debug_log(
+                'stopping sender pool')
+            self.sender_pool.stop(
+                timeout=self.timeout)
+            self.sender_pool = None
+    # end of stop_sender_pool
+
+    def start_ack_tracker(
+            self):
+        """start_ack_tracker
+
+        Start polling for HEC indexer acknowledgments inside
+        the worker process when ``use_ack`` is set
+        """
+        if self.ack_tracker is None and self.use_ack:
+            self.debug_log(
+                'starting ack tracker channel={} window={}'.format(
+                    self.channel,
+                    self.ack_window))
+            self.ack_tracker = AckTracker(
+                poll_func=self.poll_acks,
+                resend_func=self.resend_payload,
+                max_pending=self.ack_window,
+                timeout=self.ack_timeout,
+                poll_interval=self.ack_poll_interval,
+                name='mpsplunkpub-ack-poller')
+            self.ack_tracker.start()
+    # end of start_ack_tracker
+
+    def stop_ack_tracker(
+            self):
+        """stop_ack_tracker
+
+        Stop polling for HEC indexer acknowledgments and spool
+        the batches HEC never acknowledged
+        """
+        if self.ack_tracker is not None:
+            self.debug_log(
+                'stopping ack tracker pending={}'.format(
+                    len(self.ack_tracker)))
+            self.keep_unsent(
+                payloads=self.ack_tracker.stop(
+                    timeout=self.timeout),
+                reason='not acknowledged by HEC')
+            self.ack_tracker = None
+    # end of stop_ack_tracker
+
+    def start_retry_scheduler(
+            self):
+        """start_retry_scheduler
+
+        Create the retry scheduler inside the worker process - its
+        thread starts with the first failed batch
+        """
+        if self.retry_scheduler is None and self.retry_count > 0:
+            self.retry_scheduler = RetryScheduler(
+                send_func=self.retry_payload,
+                max_pending=self.retry_max_pending,
+                name='mpsplunkpub-retry')
+    # end of start_retry_scheduler
+
+    def stop_retry_scheduler(
+            self):
+        """stop_retry_scheduler
+
+        Stop retrying and spool or dead-letter the batches
+        that were still waiting for a retry
+        """
+        if self.retry_scheduler is not None:
+            payloads = self.retry_scheduler.stop(
+                timeout=self.timeout)
+            self.retry_scheduler = None
+            self.debug_log(
+                'stopped retry scheduler pending={}'.format(
+                    len(payloads)))
+            self.keep_unsent(
+                payloads=payloads,
+                reason='waiting for a retry')
+    # end of stop_retry_scheduler
+
+    def start_spool(
+            self):
+        """start_spool
+
+        Open the disk spool and start replaying it inside the
+        worker process when ``spool_dir`` is set
+        """
+        if self.spool is None and self.spool_dir:
+            self.debug_log(
+                'starting spool dir={}'.format(
+                    self.spool_dir))
+            self.spool = DiskSpool(
+                spool_dir=self.spool_dir,
+                send_func=self.replay_payload,
+                max_bytes=self.spool_max_bytes,
+                segment_bytes=self.spool_segment_bytes,
+                replay_interval=self.spool_replay_interval,
+                name='mpsplunkpub-spool-replay')
+            self.spool.start()
+    # end of start_spool
+
+    def stop_spool(
+            self):
+        """stop_spool
+
+        Stop replaying and close the disk spool - anything left
+        is replayed by the next worker using the ``spool_dir``
+        """
+        if self.spool is not None:
+            self.debug_log(
+                'stopping spool bytes={}'.format(
+                    len(self.spool)))
+            self.spool.stop(
+                timeout=self.timeout)
+            self.spool = None
+    # end of stop_spool
+
     def publish_to_splunk(
             self,
             payload=None,
@@ -463,7 +1473,10 @@ class MPSplunkPublisher(logging.Handler):
             already_done_event=None):
         """publish_to_splunk
 
-        Publish the queued messages to Splunk
+        Publish the queued messages to Splunk. With ``max_inflight``
+        above 1 the batch is handed to the ``self.sender_pool`` so the
+        worker can keep building the next batch while this one is
+        in flight.
 
         :param payload: optional string log message to send to Splunk
         :param shutdown_event: multiprocessing.Event - shutdown event
@@ -478,60 +1491,26 @@ class MPSplunkPublisher(logging.Handler):
 
         use_payload = payload
         if not use_payload:
-            use_payload = self.log_payload
+            use_payload = self.batch.getvalue()
 
         if use_payload:
             self.debug_log(
                 'payload available for sending')
-
-            url = 'https://{}:{}/services/collector'.format(
-                self.host,
-                self.port)
-            self.debug_log(
-                'destination URL={}'.format(
-                    url))
-
-            try:
-                if self.debug:
-                    try:
-                        msg_dict = json.loads(use_payload)
-                        event_data = json.loads(msg_dict['event'])
-                        msg_dict['event'] = event_data
-                        self.debug_log((
-                            'sending payload: {}').format(
-                                ppj(msg_dict)))
-                    except Exception:
-                        self.debug_log((
-                            'sending data payload: {}').format(
-                                use_payload))
-
-                if self.num_sent > 100000:
-                    self.num_sent = 0
-                else:
-                    self.num_sent += 1
-                send_to_splunk.send_to_splunk(
-                    session=self.session,
-                    url=url,
-                    data=use_payload,
-                    headers={'Authorization': 'Splunk {}'.format(
-                        self.token)},
-                    verify=self.verify,
-                    timeout=self.timeout)
-                self.debug_log(
-                    'payload sent successfully')
-
-            except Exception as e:
-                try:
-                    self.write_log(
-                        'Exception in Splunk logging handler: {}'.format(
-                            e))
-                    self.write_log(traceback.format_exc())
-                except Exception:
-                    self.debug_log(
-                        'Exception encountered,'
-                        'but traceback could not be formatted')
-
-            self.log_payload = ''
+            if self.num_sent > 100000:
+                self.num_sent = 0
+            else:
+                self.num_sent += 1
+            if self.scheduler is not None:
+                self.scheduler.record_batch(
+                    num_records=len(self.batch),
+                    num_bytes=self.batch.num_bytes)
+            self.batch.reset()
+            if self.sender_pool:
+                self.sender_pool.submit(
+                    payload=use_payload)
+            else:
+                self.send_payload(
+                    payload=use_payload)
         # end of publish handling
 
         self.debug_log((
@@ -547,7 +1526,7 @@ class MPSplunkPublisher(logging.Handler):
             shutdown_event):
         """build_payload_from_queued_messages
 
-        Empty the queued messages by building a large ``self.log_payload``
+        Empty the queued messages by building a large ``self.batch``
 
         :param use_queue: queue holding the messages
         :param shutdown_event: shutdown event
@@ -561,18 +1540,37 @@ class MPSplunkPublisher(logging.Handler):
                     'build_payload shutting down')
                 return True
 
-            self.debug_log('reading from queue={}'.format(
-                str(use_queue)))
+            if self.debug:
+                self.debug_log('reading from queue={}'.format(
+                    str(use_queue)))
             try:
-                msg = use_queue.get(
-                    block=True,
-                    timeout=self.sleep_interval)
-                self.log_payload = self.log_payload + msg
-                if self.debug:
-                    self.debug_log('got queued message={}'.format(
-                        msg))
-                not_done = not self.queue_empty(
+                read_timeout = self.get_read_timeout(
                     use_queue=use_queue)
+                priority, msgs = self.read_queue(
+                    use_queue=use_queue,
+                    timeout=read_timeout)
+                if not msgs:
+                    # nothing arrived before the timeout so send
+                    # what is in the batch once it has lingered
+                    # or the idle queue's drop report is due and
+                    # otherwise keep waiting for messages
+                    if (len(self.batch) > 0
+                            and self.batch.linger_remaining() <= 0):
+                        return True
+                    if read_timeout is not None and len(self.batch) == 0:
+                        return True
+                    continue
+                self.fill_batch(
+                    priority=priority,
+                    msgs=msgs)
+                if self.debug:
+                    self.debug_log('got queued messages={}'.format(
+                        len(msgs)))
+                if self.batch.linger_ms > 0:
+                    not_done = self.batch.linger_remaining() > 0
+                else:
+                    # everything queued was read in one call
+                    not_done = False
             except Exception as e:
                 if self.is_shutting_down(
                         shutdown_event=shutdown_event):
@@ -598,11 +1596,10 @@ class MPSplunkPublisher(logging.Handler):
                     'build_payload - already shutting down')
                 return True
 
-            # If the payload is getting very long,
-            # stop reading and send immediately.
-            # Current limit is 50MB
+            # If the payload hit the max_batch_bytes or
+            # max_batch_events limit, stop reading and send immediately.
             if self.is_shutting_down(shutdown_event=shutdown_event) \
-                    or len(self.log_payload) >= 524288:
+                    or self.batch.is_full():
                 self.debug_log(
                     'payload maximum size exceeded, sending immediately')
                 return False
@@ -612,6 +1609,79 @@ class MPSplunkPublisher(logging.Handler):
         return True
     # end of build_payload_from_queued_messages
 
+    def get_stats(
+            self):
+        """get_stats
+
+        Return the batch limits, adaptive flush decisions, HEC
+        latency, circuit breaker state and queue depth as a
+        dictionary - the worker values are published by the
+        worker after every batch
+        """
+        stats = {
+            'adaptive_flush': self.adaptive_flush,
+            'linger_ms': self.linger_ms,
+            'batch_bytes': self.max_batch_bytes,
+            'depth': sum(
+                use_queue.qsize() for use_queue in self.queues)
+        }
+        if self.num_workers == 1:
+            stats.update(
+                self.read_stats(
+                    worker_index=0))
+        else:
+            stats['num_workers'] = self.num_workers
+            stats['worker_restarts'] = self.num_restarts
+            stats['workers'] = [
+                self.read_stats(
+                    worker_index=worker_index)
+                for worker_index in range(self.num_workers)
+            ]
+        return stats
+    # end of get_stats
+
+    def publish_stats(
+            self,
+            worker_stats):
+        """publish_stats
+
+        Write the worker's stats as json to its shared memory slot
+        for ``get_stats`` to read in the logging process. Stats that
+        do not fit in the slot are skipped.
+
+        :param worker_stats: dictionary of the worker's stats
+        """
+        encoded = json.dumps(
+            worker_stats).encode('utf-8')
+        if len(encoded) >= STATS_SLOT_BYTES:
+            self.debug_log(
+                'publish_stats - skipping stats bytes={}'.format(
+                    len(encoded)))
+            return
+        slot = self.stats[self.worker_index]
+        with slot.get_lock():
+            slot.value = encoded
+    # end of publish_stats
+
+    def read_stats(
+            self,
+            worker_index):
+        """read_stats
+
+        Return the stats a worker last published or an empty
+        dictionary before its first batch
+
+        :param worker_index: position of the worker
+        """
+        slot = self.stats[worker_index]
+        with slot.get_lock():
+            encoded = slot.value
+        if not encoded:
+            return {}
+        return json.loads(
+            encoded.decode('utf-8'))
+    # end of read_stats
+
     def queue_empty(
             self,
             use_queue):
@@ -625,18 +1695,55 @@ class MPSplunkPublisher(logging.Handler):
             return use_queue.qsize() == 0
     # end of queue_empty
 
+    def flush(
+            self):
+        """flush
+
+        Put the logs buffered in this process on the queue
+        """
+        self.acquire()
+        try:
+            self.flush_emit_buffers()
+        finally:
+            self.release()
+    # end of flush
+
     def force_flush(
             self):
         """force_flush
 
-        Flush the queue and publish everything to Splunk
+        Put the logs buffered in this process on the queues and then
+        send everything queued from the calling thread. The queues
+        are read without blocking so this returns once they are empty
+        and it starts no helper threads or signal handlers. Returns
+        the number of logs sent.
         """
         self.debug_log('force flush requested')
-        self.perform_work(
-            self.queue,
-            self.shutdown_event,
-            self.shutdown_ack,
-            self.already_done)
+        self.flush()
+        num_logs = 0
+        with self.force_flush_lock:
+            for use_queue in self.queues:
+                while True:
+                    priority, msgs = use_queue.get_many(
+                        max_items=self.batch.room(),
+                        timeout=0)
+                    if not msgs:
+                        break
+                    num_logs += len(msgs)
+                    for msg in msgs:
+                        self.batch.add(
+                            msg,
+                            priority=priority)
+                        if self.batch.is_full():
+                            self.publish_to_splunk()
+                # end of draining the queue
+            # end of for all queue shards
+            if len(self.batch) > 0:
+                self.publish_to_splunk()
+        self.debug_log(
+            'force flush - done sent={}'.format(
+                num_logs))
+        return num_logs
     # end of force_flush
 
     def is_shutting_down(
@@ -681,24 +1788,44 @@ class MPSplunkPublisher(logging.Handler):
             return
         else:
             self.debug_log('shutdown - start - setting instance shutdown')
+            # buffered logs go on the queue before the workers stop
+            self.flush()
             self.shutdown_now = True
             self.shutdown_event.set()
         # if/else already shutting down
 
-        self.debug_log(
-            'shutdown - trying to publish remaining msgs')
+        if self.in_worker:
+            # the parent drains the other workers and unlinks the rings
+            self.debug_log('shutdown - done in worker')
+            return
 
-        # Send the remaining items that might be sitting in queue.
-        self.perform_work(
-            self.queue,
-            self.shutdown_event,
-            self.shutdown_ack,
-            self.already_done)
+        for p in self.processes:
+            p['shutdown_event'].set()
+        for use_queue in self.queues:
+            # wake the worker if it is waiting for the first log
+            use_queue.wake()
 
-        self.debug_log('shutdown - joining')
+        self.debug_log(
+            'shutdown - waiting for workers to send remaining msgs')
 
+        # each worker drains its queue shard before it exits
         for p in self.processes:
-            p['shutdown_event'].set()
+            if p['process'] is None:
+                continue
+            p['process'].join(
+                self.shutdown_timeout)
+            if p['process'].is_alive():
+                self.write_log(
+                    'worker={} did not finish sending within '
+                    'shutdown_timeout={} msgs in its queue may not all '
+                    'have been sent'.format(
+                        p['worker_index'],
+                        self.shutdown_timeout))
+        # end of for all workers
+
+        for use_queue in self.queues:
+            if hasattr(use_queue, 'unlink'):
+                use_queue.unlink()
 
         self.debug_log('shutdown - done')
     # end of shutdown
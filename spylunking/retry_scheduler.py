@@ -0,0 +1,314 @@
+"""
+Non-blocking retries and a circuit breaker for the HEC publishers
+
+Retrying a failed POST inside the ``requests`` session stalls the worker
+that sent it, so one failing batch holds up every batch behind it while
+the queue grows. The ``RetryScheduler`` takes the failed batch instead
+and resends it from its own thread after a jittered exponential backoff,
+so the worker keeps sending the other batches.
+
+The ``CircuitBreaker`` opens after ``failure_threshold`` consecutive
+failed POSTs. While it is open the publishers do not POST at all and
+divert batches to the disk spool (or hold them in the retry scheduler).
+After ``reset_timeout`` seconds it lets a single probe batch through
+(half-open) and closes again once a POST succeeds.
+
+::
+
+    export SPLUNK_RETRY_MAX_BACKOFF="<longest retry backoff in seconds: 60.0>"
+    export SPLUNK_RETRY_MAX_PENDING="<max batches waiting for a retry: 100>"
+    export SPLUNK_BREAKER_THRESHOLD="<failed POSTs that open the breaker: 5>"
+    export SPLUNK_BREAKER_RESET="<seconds before probing HEC again: 30.0>"
+
+"""
+
+import heapq
+import random
+import threading
+import time
+
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half-open'
+
+
+def get_backoff(
+        attempt,
+        backoff=2.0,
+        max_backoff=60.0):
+    """get_backoff
+
+    Return a full-jitter exponential backoff in seconds
+    for a retry ``attempt`` starting at 1
+
+    :param attempt: retry number
+    :param backoff: base backoff in seconds
+    :param max_backoff: longest backoff in seconds
+    """
+    ceiling = min(
+        max_backoff,
+        backoff * (2 ** max(0, attempt - 1)))
+    return random.uniform(0, ceiling)
+# end of get_backoff
+
+
+class CircuitBreaker(object):
+    """
+    Stop POSTing to HEC after consecutive failures
+    and probe for recovery
+    """
+
+    def __init__(
+            self,
+            failure_threshold=5,
+            reset_timeout=30.0):
+        """__init__
+
+        :param failure_threshold: consecutive failures that open
+                                  the breaker - 0 disables it
+        :param reset_timeout: seconds to stay open before
+                              letting a probe through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.num_opened = 0
+    # end of __init__
+
+    def allow(
+            self):
+        """allow
+
+        Return True if a POST may be sent now. Once the breaker was
+        open for ``reset_timeout`` seconds only one probe is allowed
+        until it succeeds or fails.
+        """
+        with self.lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self.state == BREAKER_OPEN:
+                if time.time() - self.opened < self.reset_timeout:
+                    return False
+                self.state = BREAKER_HALF_OPEN
+                self.probing = False
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+    # end of allow
+
+    def is_closed(
+            self):
+        """is_closed
+
+        Return True if HEC is not known to be failing
+        """
+        with self.lock:
+            return self.state == BREAKER_CLOSED
+    # end of is_closed
+
+    def remaining(
+            self):
+        """remaining
+
+        Seconds until the open breaker lets a probe through
+        """
+        with self.lock:
+            if self.state != BREAKER_OPEN:
+                return 0.0
+            return max(
+                0.0,
+                self.reset_timeout - (time.time() - self.opened))
+    # end of remaining
+
+    def record_success(
+            self):
+        """record_success
+
+        Close the breaker after a POST reached HEC
+        """
+        with self.lock:
+            self.state = BREAKER_CLOSED
+            self.failures = 0
+            self.probing = False
+    # end of record_success
+
+    def record_failure(
+            self):
+        """record_failure
+
+        Count a failed POST and open the breaker after
+        ``failure_threshold`` in a row or a failed probe
+        """
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failure_threshold <= 0:
+                return
+            if (self.state == BREAKER_HALF_OPEN
+                    or self.failures >= self.failure_threshold):
+                if self.state != BREAKER_OPEN:
+                    self.num_opened += 1
+                self.state = BREAKER_OPEN
+                self.opened = time.time()
+    # end of record_failure
+
+    def stats(
+            self):
+        """stats
+
+        Return the breaker state and failure counts
+        """
+        with self.lock:
+            return {
+                'breaker_state': self.state,
+                'breaker_failures': self.failures,
+                'breaker_opened': self.num_opened
+            }
+    # end of stats
+
+# end of CircuitBreaker
+
+
+class RetryScheduler(object):
+    """
+    Resend failed batches from a background thread after a backoff
+    """
+
+    def __init__(
+            self,
+            send_func,
+            max_pending=100,
+            name='spylunking-retry'):
+        """__init__
+
+        :param send_func: function called with ``payload=<batch>`` and
+                          ``attempt=<retry number>`` when a retry is due
+                          - it must handle its own exceptions
+        :param max_pending: maximum number of batches waiting
+        :param name: retry thread name
+        """
+        self.send_func = send_func
+        self.max_pending = max_pending
+        self.name = name
+        self.pending = []
+        self.lock = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.next_seq = 0
+        self.num_retried = 0
+    # end of __init__
+
+    def schedule(
+            self,
+            payload,
+            attempt,
+            delay):
+        """schedule
+
+        Queue a batch to be sent again in ``delay`` seconds and
+        return False if too many batches are already waiting
+
+        :param payload: batch to resend
+        :param attempt: retry number passed to ``send_func``
+        :param delay: seconds to wait before resending
+        """
+        with self.lock:
+            if self.stopped or len(self.pending) >= self.max_pending:
+                return False
+            heapq.heappush(
+                self.pending,
+                (time.time() + delay, self.next_seq, payload, attempt))
+            self.next_seq += 1
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run,
+                    name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+            self.lock.notify_all()
+        return True
+    # end of schedule
+
+    def pop_due(
+            self):
+        """pop_due
+
+        Wait for the next retry to be due and return
+        it or None once the scheduler is stopped
+        """
+        with self.lock:
+            while not self.stopped:
+                timeout = None
+                if self.pending:
+                    timeout = self.pending[0][0] - time.time()
+                    if timeout <= 0:
+                        due_time, seq, payload, attempt = heapq.heappop(
+                            self.pending)
+                        return payload, attempt
+                self.lock.wait(timeout)
+            return None
+    # end of pop_due
+
+    def run(
+            self):
+        """run
+
+        Retry thread loop
+        """
+        while True:
+            item = self.pop_due()
+            if item is None:
+                return
+            payload, attempt = item
+            self.num_retried += 1
+            try:
+                self.send_func(
+                    payload=payload,
+                    attempt=attempt)
+            except Exception:
+                # the send_func handles logging so keep retrying
+                pass
+        # end of while retrying
+    # end of run
+
+    def stop(
+            self,
+            timeout=None):
+        """stop
+
+        Stop the retry thread and return the batches that
+        were still waiting so the caller can spool them
+
+        :param timeout: seconds to wait for the thread
+        """
+        with self.lock:
+            self.stopped = True
+            payloads = [
+                item[2]
+                for item in sorted(self.pending)
+            ]
+            self.pending = []
+            self.lock.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+        return payloads
+    # end of stop
+
+    def __len__(
+            self):
+        """__len__
+
+        Number of batches waiting for a retry
+        """
+        with self.lock:
+            return len(self.pending)
+    # end of __len__
+
+# end of RetryScheduler
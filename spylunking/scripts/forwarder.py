@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+Host-wide log forwarder daemon - spylunking-forwarder
+
+Run one forwarder per host and point every process's
+``ForwarderPublisher`` handler at its Unix domain socket. The
+forwarder does the batching, compression and retries to Splunk
+for all of them.
+
+::
+
+    export SPLUNK_ADDRESS="splunkenterprise:8088"
+    export SPLUNK_TOKEN="<splunk token>"
+    export SPLUNK_INDEX="<splunk index>"
+    export SPLUNK_FORWARDER_SOCKET="<unix socket path to listen on>"
+    export SPLUNK_FORWARDER_SOCKET_TYPE="<stream (default)|dgram>"
+    export SPLUNK_FORWARDER_SOCKET_MODE="<octal socket file mode: 660>"
+
+Start the Forwarder
+===================
+
+::
+
+    spylunking-forwarder -a splunkenterprise:8088 -t <token> \
+        -s /tmp/spylunking-forwarder.sock
+
+All of the ``SplunkPublisher`` tuning environment variables like
+``SPLUNK_COMPRESS``, ``SPLUNK_MAX_INFLIGHT`` and ``SPLUNK_SPOOL_DIR``
+apply to the forwarder.
+
+"""
+
+import signal
+import sys
+import argparse
+import threading
+from spylunking.log_forwarder import LogForwarder
+from spylunking.ppj import ppj
+from spylunking.consts import SPLUNK_ADDRESS
+from spylunking.consts import SPLUNK_TOKEN
+from spylunking.consts import SPLUNK_INDEX
+from spylunking.consts import SPLUNK_FORWARDER_SOCKET
+from spylunking.consts import SPLUNK_FORWARDER_SOCKET_TYPE
+from spylunking.consts import SPLUNK_FORWARDER_SOCKET_MODE
+from spylunking.consts import SPLUNK_DEBUG
+
+
+def run_main():
+    """run_main
+
+    Run the log forwarder until it gets a SIGINT or SIGTERM
+    """
+
+    parser = argparse.ArgumentParser(
+        description=(
+            'Forward logs from local processes to Splunk'))
+    parser.add_argument(
+        '-s',
+        help='unix socket path to listen on',
+        required=False,
+        dest='socket_path')
+    parser.add_argument(
+        '-y',
+        help='socket type: stream or dgram',
+        required=False,
+        dest='socket_type')
+    parser.add_argument(
+        '-m',
+        help='octal socket file mode like 660 or 600',
+        required=False,
+        dest='socket_mode')
+    parser.add_argument(
+        '-a',
+        help='splunk HEC address: <fqdn:port>',
+        required=False,
+        dest='address')
+    parser.add_argument(
+        '-t',
+        help='splunk HEC token',
+        required=False,
+        dest='token')
+    parser.add_argument(
+        '-i',
+        help='splunk index',
+        required=False,
+        dest='index_name')
+    parser.add_argument(
+        '-r',
+        help='(Optional) print stats every this many seconds',
+        required=False,
+        dest='stats_interval')
+    parser.add_argument(
+        '-d',
+        help='debug',
+        required=False,
+        dest='debug',
+        action='store_true')
+    args = parser.parse_args()
+
+    socket_path = SPLUNK_FORWARDER_SOCKET
+    socket_type = SPLUNK_FORWARDER_SOCKET_TYPE
+    socket_mode = SPLUNK_FORWARDER_SOCKET_MODE
+    address = SPLUNK_ADDRESS
+    token = SPLUNK_TOKEN
+    index_name = SPLUNK_INDEX
+    stats_interval = None
+    debug = SPLUNK_DEBUG
+
+    if args.socket_path:
+        socket_path = args.socket_path
+    if args.socket_type:
+        socket_type = args.socket_type
+    if args.socket_mode:
+        socket_mode = int(args.socket_mode, 8)
+    if args.address:
+        address = args.address
+    if args.token:
+        token = args.token
+    if args.index_name:
+        index_name = args.index_name
+    if args.stats_interval:
+        stats_interval = float(args.stats_interval)
+    if args.debug:
+        debug = True
+
+    if not token:
+        print(
+            'missing splunk token - please use: -t <token> or '
+            'export SPLUNK_TOKEN=<token>')
+        sys.exit(1)
+
+    try:
+        host = address.split(':')[0]
+        port = int(address.split(':')[1])
+    except Exception as e:
+        print((
+            'Failed to parse -a {} for the splunk HEC address '
+            '- please use: -a <fqdn:port> ex={}').format(
+                address,
+                e))
+        sys.exit(1)
+
+    forwarder = LogForwarder(
+        socket_path=socket_path,
+        socket_type=socket_type,
+        socket_mode=socket_mode,
+        host=host,
+        port=port,
+        token=token,
+        index=index_name,
+        debug=debug)
+
+    stop_event = threading.Event()
+
+    def handle_stop(
+            signum,
+            frame):
+        """handle_stop
+
+        :param signum: signal number
+        :param frame: stack frame
+        """
+        stop_event.set()
+    # end of handle_stop
+
+    signal.signal(
+        signal.SIGINT,
+        handle_stop)
+    signal.signal(
+        signal.SIGTERM,
+        handle_stop)
+
+    forwarder.start()
+    while not stop_event.wait(stats_interval or 1.0):
+        if stats_interval:
+            print(ppj(forwarder.get_stats()))
+    # end of while running
+
+    forwarder.stop(
+        timeout=10.0)
+    print(ppj(forwarder.get_stats()))
+# end of run_main
+
+
+if __name__ == '__main__':
+    run_main()
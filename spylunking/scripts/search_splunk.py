@@ -17,6 +17,7 @@ with a local or remote splunk server:
     export SPLUNK_USER="trex"
     export SPLUNK_TOKEN="<Optional pre-existing Splunk token>"
     export SPLUNK_INDEX="<splunk index>"
+    export SPLUNK_INDEXED_FIELDS="<comma-separated keys ex: name,dc,env>"
 
 Pull Logs with a Query on the Command Line
 ==========================================
@@ -44,6 +45,17 @@ Get First 10 ERROR logs
     sp -q 'index="antinex" AND levelname="ERROR" | head 10 | reverse' \
         -u trex -p 123321 -a splunkenterprise:8089
 
+Search Indexed Fields
+=====================
+
+Filters on the publishers' ``SPLUNK_INDEXED_FIELDS`` keys are rewritten
+to ``key::value`` and a ``stats count`` that only uses indexed fields
+runs as a ``tstats`` search:
+
+::
+
+    sp -x name,dc,env -q 'index="antinex" AND name=app | stats count by env'
+
 """
 
 import sys
@@ -53,6 +65,7 @@ import datetime
 from spylunking.log.setup_logging import \
     simple_logger
 import spylunking.search as sp
+from spylunking.hec_envelope import get_indexed_fields
 from spylunking.ev import ev
 from spylunking.ppj import ppj
 from spylunking.consts import SUCCESS
@@ -61,6 +74,7 @@ from spylunking.consts import SPLUNK_PASSWORD
 from spylunking.consts import SPLUNK_TOKEN
 from spylunking.consts import SPLUNK_API_ADDRESS
 from spylunking.consts import SPLUNK_INDEX
+from spylunking.consts import SPLUNK_INDEXED_FIELDS
 from spylunking.consts import SPLUNK_VERBOSE
 
 
@@ -373,6 +387,14 @@ def run_main():
         required=False,
         dest='verbose',
         action='store_true')
+    parser.add_argument(
+        '-x',
+        help=(
+            '(Optional) comma-separated indexed field keys '
+            'the publishers send - defaults to '
+            'SPLUNK_INDEXED_FIELDS'),
+        required=False,
+        dest='indexed_fields')
     args = parser.parse_args()
 
     user = SPLUNK_USER
@@ -390,6 +412,8 @@ def run_main():
     code_view = True
     json_view = False
     datafile = None
+    indexed_fields = get_indexed_fields(
+        SPLUNK_INDEXED_FIELDS)
 
     if args.user:
         user = args.user
@@ -416,6 +440,9 @@ def run_main():
     if args.json_view:
         json_view = True
         code_view = False
+    if args.indexed_fields:
+        indexed_fields = get_indexed_fields(
+            args.indexed_fields)
 
     default_search_query = 'index="{}" | head 10 | reverse'.format(
         index_name)
@@ -528,7 +555,21 @@ def run_main():
                 '%Y-%m-%dT%H:%M:%S.000-00:00')
 
     # Step 2: Create a search job
-    if not search_query.startswith('search'):
+    if indexed_fields:
+        tstats_query = sp.use_tstats(
+            query=search_query,
+            indexed_fields=indexed_fields)
+        if tstats_query:
+            search_query = tstats_query
+        else:
+            search_query = sp.use_indexed_fields(
+                query=search_query,
+                indexed_fields=indexed_fields)
+        if verbose:
+            log.info(
+                'indexed fields query={}'.format(
+                    search_query))
+    if not search_query.startswith(('search', '|')):
         search_query = 'search {}'.format(
             search_query)
 
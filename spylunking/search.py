@@ -1,7 +1,15 @@
 """
 Search wrapper for authenticating with Splunk and running a search query.
+
+Publishers with ``indexed_fields`` (``SPLUNK_INDEXED_FIELDS``) send
+drill-down keys like ``name``, ``dc`` and ``env`` as HEC indexed
+fields. ``use_indexed_fields`` rewrites ``key=value`` filters on those
+keys to ``key::value`` so Splunk matches them in the index instead of
+extracting them from every event, and ``use_tstats`` turns a
+``stats count`` over indexed fields into a ``tstats`` search.
 """
 
+import collections
 import re
 import requests
 import spylunking.get_session_key as get_session_key
@@ -18,6 +26,187 @@ from spylunking.log.setup_logging import \
 log = build_colorized_logger(
     name='spylunking.search')
 
+# fields every Splunk event has in the index
+DEFAULT_INDEXED_FIELDS = [
+    'index',
+    'host',
+    'source',
+    'sourcetype'
+]
+
+QUOTED_VALUE = r'"(?:[^"\\]|\\.)*"'
+FILTER_TERM = re.compile(
+    r'^(\w+)(::|=)({}|[^\s"]+)$'.format(
+        QUOTED_VALUE))
+STATS_COUNT = re.compile(
+    r'^stats\s+count(?:\s+by\s+([\w\s,]+?))?$')
+
+
+def split_query(
+        query):
+    """split_query
+
+    Return the base search of a query without a leading
+    ``search`` command and the rest of the pipeline after
+    the first ``|`` outside of quotes as a tuple
+
+    :param query: search query
+    """
+    in_quotes = False
+    escaped = False
+    pipe_at = None
+    for idx, char in enumerate(query):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            in_quotes = not in_quotes
+        elif char == '|' and not in_quotes:
+            pipe_at = idx
+            break
+    base = query
+    rest = ''
+    if pipe_at is not None:
+        base = query[:pipe_at]
+        rest = query[pipe_at + 1:].strip()
+    base = base.strip()
+    if base.lower().startswith('search '):
+        base = base[len('search '):].strip()
+    return base, rest
+# end of split_query
+
+
+def use_indexed_fields(
+        query,
+        indexed_fields):
+    """use_indexed_fields
+
+    Rewrite ``key=value`` filters on indexed fields in the base
+    search to ``key::value`` so Splunk matches them in the index.
+    Commands after the first ``|`` are left as they are.
+
+    :param query: search query
+    :param indexed_fields: list of indexed field keys
+    """
+    if not indexed_fields:
+        return query
+    base, rest = split_query(
+        query)
+    term = re.compile(
+        r'{}|(?<![\w.:!<>=])({})\s*=\s*({}|[^\s()|"]+)'.format(
+            QUOTED_VALUE,
+            '|'.join(
+                re.escape(key)
+                for key in indexed_fields),
+            QUOTED_VALUE))
+
+    def replace_term(
+            match):
+        """replace_term
+
+        :param match: quoted string or indexed field filter
+        """
+        if match.group(1) is None:
+            return match.group(0)
+        return '{}::{}'.format(
+            match.group(1),
+            match.group(2))
+    # end of replace_term
+
+    new_query = term.sub(
+        replace_term,
+        base)
+    if query.lstrip().lower().startswith('search '):
+        new_query = 'search {}'.format(
+            new_query)
+    if rest:
+        new_query = '{} | {}'.format(
+            new_query,
+            rest)
+    return new_query
+# end of use_indexed_fields
+
+
+def build_tstats_query(
+        filters,
+        by=None,
+        function='count'):
+    """build_tstats_query
+
+    Build a ``tstats`` search over indexed fields
+
+    :param filters: dictionary of indexed field filters
+                    like ``{'index': 'antinex', 'dc': 'dev'}``
+    :param by: optional list of indexed fields to group by
+    :param function: ``tstats`` aggregation
+    """
+    query = '| tstats {} where {}'.format(
+        function,
+        ' '.join(
+            '{}={}'.format(
+                key,
+                json.dumps(str(filters[key])))
+            for key in filters))
+    if by:
+        query = '{} by {}'.format(
+            query,
+            ', '.join(by))
+    return query
+# end of build_tstats_query
+
+
+def use_tstats(
+        query,
+        indexed_fields):
+    """use_tstats
+
+    Return a ``tstats`` search for a query that only filters on
+    indexed fields and ends with ``stats count`` (optionally by
+    indexed fields) or None if the query needs the events
+
+    :param query: search query
+    :param indexed_fields: list of indexed field keys
+    """
+    allowed = set(DEFAULT_INDEXED_FIELDS + list(indexed_fields or []))
+    base, rest = split_query(
+        query)
+    stats = STATS_COUNT.match(
+        rest)
+    if not base or not stats:
+        return None
+    by = []
+    if stats.group(1):
+        by = [
+            key.strip()
+            for key in stats.group(1).replace(',', ' ').split()
+        ]
+    if any(key not in allowed for key in by):
+        return None
+    filters = collections.OrderedDict()
+    for token in re.findall(
+            r'(?:[^\s"]|{})+'.format(
+                QUOTED_VALUE),
+            base):
+        if token.upper() == 'AND':
+            continue
+        term = FILTER_TERM.match(
+            token)
+        if not term or term.group(1) not in allowed:
+            return None
+        if term.group(1) in filters:
+            # a repeated key cannot be one tstats filter
+            return None
+        value = term.group(3)
+        if value.startswith('"'):
+            value = json.loads(value)
+        filters[term.group(1)] = value
+    # end of for all base search terms
+    return build_tstats_query(
+        filters=filters,
+        by=by)
+# end of use_tstats
+
 
 def search(
         user=None,
@@ -1,3 +1,23 @@
+"""
+Send formatted logs to the Splunk HEC REST API
+"""
+
+import json
+import zlib
+from spylunking.consts import IS_PY2
+
+if IS_PY2:
+    from urllib import urlencode  # noqa
+else:
+    from urllib.parse import urlencode  # noqa
+
+
+HEC_ENDPOINT_EVENT = 'event'
+HEC_ENDPOINT_RAW = 'raw'
+HEC_ENDPOINTS = [
+    HEC_ENDPOINT_EVENT,
+    HEC_ENDPOINT_RAW
+]
 
 
 def send_to_splunk(
@@ -32,3 +52,202 @@ def send_to_splunk(
     r.raise_for_status()  # Throws exception for 4xx/5xx status
     return r
 # end of send_to_splunk
+
+
+def is_retryable_error(
+        e):
+    """is_retryable_error
+
+    Return True if a failed POST should be sent again later: the
+    connection failed or timed out, HEC is busy (HTTP 503 and 429)
+    or it hit a server error. HEC rejecting the batch itself
+    (any other HTTP 4xx) is not retryable.
+
+    :param e: exception raised by ``send_to_splunk``
+    """
+    response = getattr(e, 'response', None)
+    if response is None:
+        return True
+    return bool(
+        response.status_code == 429
+        or response.status_code >= 500)
+# end of is_retryable_error
+
+
+def is_split_error(
+        e):
+    """is_split_error
+
+    Return True if HEC rejected the batch because of its content
+    (HTTP 400) or size (HTTP 413) so sending it again in smaller
+    parts can get the valid events indexed
+
+    :param e: exception raised by ``send_to_splunk``
+    """
+    response = getattr(e, 'response', None)
+    if response is None:
+        return False
+    return response.status_code in (400, 413)
+# end of is_split_error
+
+
+def get_invalid_event_number(
+        e):
+    """get_invalid_event_number
+
+    Return the index of the event HEC rejected from the
+    ``invalid-event-number`` in the error body or None like:
+    ``{"text": "Event field cannot be blank", "code": 13,
+    "invalid-event-number": 3}``
+
+    :param e: exception raised by ``send_to_splunk``
+    """
+    response = getattr(e, 'response', None)
+    if response is None:
+        return None
+    try:
+        return int(response.json()['invalid-event-number'])
+    except Exception:
+        return None
+# end of get_invalid_event_number
+
+
+def split_payload(
+        payload,
+        endpoint=HEC_ENDPOINT_EVENT):
+    """split_payload
+
+    Return the list of encoded events in a batch. Events for the
+    ``event`` endpoint are concatenated JSON objects and the
+    ``raw`` endpoint takes one event per line. Anything that does
+    not parse is kept as the last event.
+
+    :param payload: batch as ``str`` or ``bytes``
+    :param endpoint: HEC endpoint the batch was built for
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode('utf-8')
+    if endpoint == HEC_ENDPOINT_RAW:
+        return [
+            line.encode('utf-8')
+            for line in payload.splitlines(True)
+        ]
+    events = []
+    decoder = json.JSONDecoder()
+    offset = 0
+    while offset < len(payload):
+        if payload[offset].isspace():
+            offset += 1
+            continue
+        try:
+            end = decoder.raw_decode(payload, offset)[1]
+        except ValueError:
+            end = len(payload)
+        events.append(
+            payload[offset:end].encode('utf-8'))
+        offset = end
+    return events
+# end of split_payload
+
+
+def build_collector_url(
+        host,
+        port,
+        endpoint=HEC_ENDPOINT_EVENT,
+        channel=None,
+        hostname=None,
+        index=None,
+        source=None,
+        sourcetype=None):
+    """build_collector_url
+
+    Build the HEC URL for a publisher. The ``event`` endpoint reads
+    the metadata from each event's JSON envelope while the ``raw``
+    endpoint takes it once from the query string, so only the ``raw``
+    URL includes the ``channel`` and metadata arguments.
+
+    :param host: splunk host
+    :param port: splunk HEC port
+    :param endpoint: ``event`` for ``/services/collector`` or
+                     ``raw`` for ``/services/collector/raw``
+    :param channel: HEC channel
+    :param hostname: host metadata for raw events
+    :param index: index metadata for raw events
+    :param source: source metadata for raw events
+    :param sourcetype: sourcetype metadata for raw events
+    """
+    if endpoint == HEC_ENDPOINT_EVENT:
+        return 'https://{}:{}/services/collector'.format(
+            host,
+            port)
+    elif endpoint != HEC_ENDPOINT_RAW:
+        raise ValueError(
+            'unsupported HEC endpoint={} please use one of: {}'.format(
+                endpoint,
+                HEC_ENDPOINTS))
+
+    query_args = []
+    for k, v in [
+            ('channel', channel),
+            ('host', hostname),
+            ('index', index),
+            ('source', source),
+            ('sourcetype', sourcetype)]:
+        if v:
+            query_args.append((k, v))
+    url = 'https://{}:{}/services/collector/raw'.format(
+        host,
+        port)
+    if query_args:
+        url = '{}?{}'.format(
+            url,
+            urlencode(query_args))
+    return url
+# end of build_collector_url
+
+
+def build_ack_url(
+        host,
+        port,
+        channel):
+    """build_ack_url
+
+    Build the HEC indexer acknowledgment URL for a channel
+
+    :param host: splunk host
+    :param port: splunk HEC port
+    :param channel: HEC channel the batches were sent on
+    """
+    return 'https://{}:{}/services/collector/ack?{}'.format(
+        host,
+        port,
+        urlencode([('channel', channel)]))
+# end of build_ack_url
+
+
+def compress_payload(
+        data,
+        level=6,
+        min_bytes=1024):
+    """compress_payload
+
+    Gzip a HEC POST body if it is at least ``min_bytes`` long
+    and return a tuple of ``(body, compressed)`` where ``compressed``
+    is True if the caller needs to send a
+    ``Content-Encoding: gzip`` header
+
+    :param data: ``str`` or ``bytes`` POST body
+    :param level: gzip compression level from 1 (fastest) to 9 (smallest)
+    :param min_bytes: only compress bodies at least this long
+    """
+    if not data or len(data) < min_bytes:
+        return data, False
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    # wbits=16+MAX_WBITS writes a gzip header and trailer
+    compressor = zlib.compressobj(
+        level,
+        zlib.DEFLATED,
+        16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(), True
+# end of compress_payload
@@ -0,0 +1,189 @@
+"""
+Bounded pool of sender threads for the HEC publishers
+
+A publisher with one worker that builds a batch and then blocks on the
+HTTP POST can only ship ``batch_size / round_trip_time`` logs per
+second. The ``SenderPool`` lets the worker hand each finished batch to
+one of ``max_inflight`` threads that share the publisher's
+``requests.Session`` connection pool, so the worker can build the next
+batch while earlier ones are still in flight.
+
+Batches are dispatched in the order they were submitted and each one
+gets a sequence number, but with ``max_inflight`` above 1 the POSTs
+run concurrently and can finish out of order, so HEC may receive a
+later batch before an earlier one. Splunk orders events by their
+timestamps, not their arrival. Use ``max_inflight=1`` when batches
+must arrive in order. ``committed_seq`` is the highest sequence number
+where it and every earlier batch have finished sending - ``wait_idle``
+and a publisher ``flush`` wait on it.
+
+A ``send_func`` exception is logged and counted in ``num_errors`` and
+the sender thread keeps running.
+"""
+
+import threading
+import time
+from spylunking.rnow import rnow
+from spylunking.consts import IS_PY2
+
+if IS_PY2:
+    from Queue import Queue  # noqa
+else:
+    from queue import Queue  # noqa
+
+
+class SenderPool(object):
+    """
+    Send batches with up to ``max_inflight`` concurrent HTTP POSTs
+    """
+
+    def __init__(
+            self,
+            send_func,
+            max_inflight=2,
+            name='spylunking-sender'):
+        """__init__
+
+        :param send_func: function called with ``payload=<batch>``
+                          from a sender thread - it must handle its own
+                          exceptions
+        :param max_inflight: number of sender threads
+        :param name: thread name prefix
+        """
+        self.send_func = send_func
+        self.max_inflight = max_inflight
+        self.name = name
+        # bounded so a slow Splunk pushes back on the batch builder
+        self.batches = Queue(maxsize=max_inflight)
+        self.lock = threading.Condition()
+        self.next_seq = 0
+        self.committed_seq = -1
+        self.done_seqs = set()
+        self.num_errors = 0
+        self.threads = []
+        for idx in range(max_inflight):
+            t = threading.Thread(
+                target=self.run,
+                name='{}-{}'.format(
+                    name,
+                    idx))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+    # end of __init__
+
+    def submit(
+            self,
+            payload):
+        """submit
+
+        Queue a batch for sending and return its sequence number. This
+        blocks while all senders are busy and the hand-off queue is full.
+
+        :param payload: batch to send
+        """
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+        self.batches.put((seq, payload))
+        return seq
+    # end of submit
+
+    def run(
+            self):
+        """run
+
+        Sender thread loop
+        """
+        while True:
+            item = self.batches.get()
+            if item is None:
+                return
+            seq, payload = item
+            try:
+                self.send_func(
+                    payload=payload)
+            except Exception as e:
+                # keep the thread so the pool does not shrink
+                self.num_errors += 1
+                print('{} {} failed sending batch={} ex={}'.format(
+                    rnow(),
+                    self.name,
+                    seq,
+                    e))
+            finally:
+                self.mark_done(
+                    seq=seq)
+        # end of while sending batches
+    # end of run
+
+    def mark_done(
+            self,
+            seq):
+        """mark_done
+
+        Record a finished batch and advance ``committed_seq``
+        past every contiguous finished batch
+
+        :param seq: sequence number of the finished batch
+        """
+        with self.lock:
+            self.done_seqs.add(seq)
+            while (self.committed_seq + 1) in self.done_seqs:
+                self.committed_seq += 1
+                self.done_seqs.discard(self.committed_seq)
+            self.lock.notify_all()
+    # end of mark_done
+
+    def num_inflight(
+            self):
+        """num_inflight
+
+        Number of submitted batches that have not finished sending
+        """
+        with self.lock:
+            return self.next_seq - self.committed_seq - 1 - len(
+                self.done_seqs)
+    # end of num_inflight
+
+    def wait_idle(
+            self,
+            timeout=None):
+        """wait_idle
+
+        Wait until every submitted batch finished sending
+        and return True if the pool is idle
+
+        :param timeout: seconds to wait with None waiting forever
+        """
+        end_time = None
+        if timeout is not None:
+            end_time = time.time() + timeout
+        with self.lock:
+            while self.committed_seq + 1 < self.next_seq:
+                remaining = None
+                if end_time is not None:
+                    remaining = end_time - time.time()
+                    if remaining <= 0:
+                        break
+                self.lock.wait(remaining)
+            return self.committed_seq + 1 >= self.next_seq
+    # end of wait_idle
+
+    def stop(
+            self,
+            timeout=None):
+        """stop
+
+        Send everything already submitted and stop the sender threads
+
+        :param timeout: seconds to wait for each thread
+        """
+        for t in self.threads:
+            self.batches.put(None)
+        for t in self.threads:
+            t.join(timeout)
+        self.threads = []
+    # end of stop
+
+# end of SenderPool
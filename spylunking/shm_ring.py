@@ -0,0 +1,860 @@
+"""
+Shared-memory ring buffer queue for the ``MPSplunkPublisher``
+
+The ``manager`` queue backend pickles every record, sends it over a
+socket to the ``QueueManager`` server process and pickles it again on
+the way to the worker process. The ``ShmRingQueue`` instead writes each
+encoded record into a ``multiprocessing.shared_memory`` block as a
+4-byte length and a 1-byte log level followed by the record bytes. The
+worker process reads a whole batch of records straight out of the
+block.
+
+Producers and the consumer share one ``multiprocessing.Lock`` that only
+guards a few header updates and a ``memcpy``. A producer only sets the
+``not_empty`` event while the consumer is waiting for records, so a busy
+ring costs no wakeups, the same as the ``MemoryQueue``.
+
+The ring holds ``capacity`` bytes of frames and optionally ``maxsize``
+records. The ``overflow_policy`` values are the ones the ``MemoryQueue``
+supports. ``drop-below-level`` evicts the oldest record below the
+``overflow_level`` by moving the older frames in front of it up.
+
+``multiprocessing.shared_memory`` needs python 3.8 or newer and
+``SHM_SUPPORTED`` is False without it.
+
+::
+
+    export SPLUNK_MP_QUEUE_BACKEND="<shm (default)|manager>"
+    export SPLUNK_SHM_RING_BYTES="<ring bytes without a max bytes: 16777216>"
+
+"""
+
+import logging
+import multiprocessing
+import struct
+import time
+from spylunking.consts import IS_PY2
+from spylunking.memory_queue import OVERFLOW_POLICIES
+from spylunking.memory_queue import OVERFLOW_DROP_NEWEST
+from spylunking.memory_queue import OVERFLOW_DROP_OLDEST
+from spylunking.memory_queue import OVERFLOW_DROP_BELOW_LEVEL
+from spylunking.memory_queue import OVERFLOW_BLOCK
+from spylunking.memory_queue import get_level
+
+if IS_PY2:
+    from Queue import Empty  # noqa
+    from Queue import Full  # noqa
+else:
+    from queue import Empty  # noqa
+    from queue import Full  # noqa
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+SHM_SUPPORTED = shared_memory is not None
+
+# record bytes and log level
+FRAME_HEADER = struct.Struct('<IB')
+
+# ring header slots - one unsigned 64-bit integer each
+HEAD = 0
+TAIL = 1
+COUNT = 2
+DROPPED = 3
+DROPPED_BYTES = 4
+WAITING = 5
+WAKE_ITEMS = 6
+WOKEN = 7
+BELOW_LEVEL = 8
+HEADER_SLOTS = 9
+HEADER_BYTES = HEADER_SLOTS * 8
+
+
+def attach_shared_memory(
+        name):
+    """attach_shared_memory
+
+    Attach to an existing shared memory block without letting
+    this process's resource tracker unlink it on exit
+
+    :param name: shared memory block name
+    """
+    try:
+        return shared_memory.SharedMemory(
+            name=name,
+            track=False)
+    except TypeError:
+        # python < 3.13 tracks every attached block
+        shm = shared_memory.SharedMemory(
+            name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(
+                shm._name,
+                'shared_memory')
+        except Exception:
+            pass
+        return shm
+# end of attach_shared_memory
+
+
+class ShmEvent(object):
+    """
+    A ``multiprocessing.Event`` replacement built on one bounded
+    semaphore. ``multiprocessing.Event.set`` waits for every waiter to
+    wake up, so a worker killed while waiting blocks every later
+    ``set`` forever. Setting this event never waits on the waiters.
+    """
+
+    def __init__(
+            self):
+        """__init__"""
+        self.flag = multiprocessing.BoundedSemaphore(1)
+        self.flag.acquire()
+    # end of __init__
+
+    def set(
+            self):
+        """set"""
+        try:
+            self.flag.release()
+        except ValueError:
+            # already set
+            pass
+    # end of set
+
+    def clear(
+            self):
+        """clear"""
+        self.flag.acquire(False)
+    # end of clear
+
+    def wait(
+            self,
+            timeout=None):
+        """wait
+
+        Wait up to ``timeout`` seconds for the event to be set and
+        return True if it was set without clearing it
+
+        :param timeout: seconds to wait with None waiting forever
+        """
+        if not self.flag.acquire(True, timeout):
+            return False
+        self.set()
+        return True
+    # end of wait
+
+# end of ShmEvent
+
+
+class ShmRingQueue(object):
+    """
+    A multi-process FIFO of ``bytes`` records in a shared memory
+    ring buffer for one consumer and any number of producers
+    """
+
+    def __init__(
+            self,
+            capacity=16777216,
+            maxsize=0,
+            overflow_policy=OVERFLOW_DROP_NEWEST,
+            overflow_level=logging.WARNING,
+            block_timeout=1.0):
+        """__init__
+
+        :param capacity: bytes of record frames the ring holds
+        :param maxsize: maximum number of queued records with
+                        0 is only limited by ``capacity``
+        :param overflow_policy: what ``offer`` does when the ring
+                                is full - one of ``OVERFLOW_POLICIES``
+        :param overflow_level: lowest level ``drop-below-level`` keeps
+        :param block_timeout: seconds ``block`` waits for room
+        """
+        if not SHM_SUPPORTED:
+            raise ImportError(
+                'the shm queue backend needs multiprocessing.shared_memory '
+                'from python 3.8 or newer')
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                'unsupported overflow policy={} please use one of: '
+                '{}'.format(
+                    overflow_policy,
+                    OVERFLOW_POLICIES))
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self.overflow_level = get_level(overflow_level)
+        self.block_timeout = block_timeout
+        self.lock = multiprocessing.Lock()
+        self.not_empty = ShmEvent()
+        self.not_full = ShmEvent()
+        self.shm = shared_memory.SharedMemory(
+            create=True,
+            size=HEADER_BYTES + self.capacity)
+        self.name = self.shm.name
+        self.owner = True
+        self.attach_views()
+        for slot in range(HEADER_SLOTS):
+            self.header[slot] = 0
+        self.header[WAKE_ITEMS] = 1
+    # end of __init__
+
+    def attach_views(
+            self):
+        """attach_views
+
+        Build the header and data views over the shared memory
+        """
+        self.header = self.shm.buf[:HEADER_BYTES].cast('Q')
+        self.data = self.shm.buf[HEADER_BYTES:HEADER_BYTES + self.capacity]
+    # end of attach_views
+
+    def __getstate__(
+            self):
+        """__getstate__
+
+        Pickle the ring by its shared memory name for a spawned
+        worker process
+        """
+        state = dict(self.__dict__)
+        for key in ['shm', 'header', 'data']:
+            state.pop(key, None)
+        state['owner'] = False
+        return state
+    # end of __getstate__
+
+    def __setstate__(
+            self,
+            state):
+        """__setstate__
+
+        Attach to the ring in a spawned worker process
+
+        :param state: pickled state
+        """
+        self.__dict__.update(state)
+        self.shm = attach_shared_memory(
+            name=self.name)
+        self.attach_views()
+    # end of __setstate__
+
+    def write_bytes(
+            self,
+            pos,
+            data):
+        """write_bytes
+
+        Copy ``data`` into the ring at ``pos`` and wrap around
+        the end - the caller must hold ``self.lock``
+
+        :param pos: ring position
+        :param data: bytes to copy
+        """
+        offset = pos % self.capacity
+        size = len(data)
+        if offset + size <= self.capacity:
+            self.data[offset:offset + size] = data
+            return
+        first = self.capacity - offset
+        data = memoryview(data)
+        self.data[offset:] = data[:first]
+        self.data[:size - first] = data[first:]
+    # end of write_bytes
+
+    def read_bytes(
+            self,
+            pos,
+            size):
+        """read_bytes
+
+        Copy ``size`` bytes out of the ring at ``pos`` - the
+        caller must hold ``self.lock``
+
+        :param pos: ring position
+        :param size: number of bytes
+        """
+        offset = pos % self.capacity
+        if offset + size <= self.capacity:
+            return self.data[offset:offset + size].tobytes()
+        first = self.capacity - offset
+        return (
+            self.data[offset:].tobytes()
+            + self.data[:size - first].tobytes())
+    # end of read_bytes
+
+    def put_locked(
+            self,
+            item,
+            levelno=logging.NOTSET):
+        """put_locked
+
+        Append a frame and return False if it does not fit - the
+        caller must hold ``self.lock``
+
+        :param item: record as ``bytes``
+        :param levelno: logging level number of the record
+        """
+        header = self.header
+        levelno = min(max(levelno, 0), 255)
+        frame_bytes = FRAME_HEADER.size + len(item)
+        if self.maxsize > 0 and header[COUNT] >= self.maxsize:
+            return False
+        head = header[HEAD]
+        if head - header[TAIL] + frame_bytes > self.capacity:
+            return False
+        self.write_bytes(
+            head,
+            FRAME_HEADER.pack(
+                len(item),
+                levelno))
+        self.write_bytes(
+            head + FRAME_HEADER.size,
+            item)
+        header[HEAD] = head + frame_bytes
+        header[COUNT] += 1
+        if levelno < self.overflow_level:
+            header[BELOW_LEVEL] += 1
+        return True
+    # end of put_locked
+
+    def pop_locked(
+            self):
+        """pop_locked
+
+        Remove and return the oldest record or None - the
+        caller must hold ``self.lock``
+        """
+        header = self.header
+        if header[COUNT] == 0:
+            return None
+        tail = header[TAIL]
+        size, levelno = FRAME_HEADER.unpack(
+            self.read_bytes(
+                tail,
+                FRAME_HEADER.size))
+        item = self.read_bytes(
+            tail + FRAME_HEADER.size,
+            size)
+        header[TAIL] = tail + FRAME_HEADER.size + size
+        header[COUNT] -= 1
+        if levelno < self.overflow_level:
+            header[BELOW_LEVEL] -= 1
+        return item
+    # end of pop_locked
+
+    def evict_below_level_locked(
+            self):
+        """evict_below_level_locked
+
+        Remove and return the oldest record below the
+        ``overflow_level`` or None - the caller must hold
+        ``self.lock``. The older frames in front of it move
+        up so the ring stays in order.
+        """
+        header = self.header
+        if header[BELOW_LEVEL] == 0:
+            return None
+        tail = header[TAIL]
+        pos = tail
+        for _ in range(header[COUNT]):
+            size, levelno = FRAME_HEADER.unpack(
+                self.read_bytes(
+                    pos,
+                    FRAME_HEADER.size))
+            frame_bytes = FRAME_HEADER.size + size
+            if levelno < self.overflow_level:
+                item = self.read_bytes(
+                    pos + FRAME_HEADER.size,
+                    size)
+                if pos > tail:
+                    self.write_bytes(
+                        tail + frame_bytes,
+                        self.read_bytes(
+                            tail,
+                            pos - tail))
+                header[TAIL] = tail + frame_bytes
+                header[COUNT] -= 1
+                header[BELOW_LEVEL] -= 1
+                return item
+            pos += frame_bytes
+        # end of for all frames
+        return None
+    # end of evict_below_level_locked
+
+    def notify(
+            self):
+        """notify
+
+        Wake the consumer if it waits for the records now queued
+        """
+        header = self.header
+        if header[WAITING] and header[COUNT] >= header[WAKE_ITEMS]:
+            self.not_empty.set()
+    # end of notify
+
+    def encode(
+            self,
+            item):
+        """encode
+
+        Return the record as ``bytes``
+
+        :param item: record as ``str`` or ``bytes``
+        """
+        if not isinstance(item, bytes):
+            return item.encode('utf-8')
+        return item
+    # end of encode
+
+    def put_nowait(
+            self,
+            item):
+        """put_nowait
+
+        Add a record without blocking or raise ``queue.Full``
+
+        :param item: record as ``str`` or ``bytes``
+        """
+        item = self.encode(
+            item)
+        with self.lock:
+            added = self.put_locked(
+                item)
+        if not added:
+            self.wake_full()
+            raise Full()
+        self.notify()
+    # end of put_nowait
+
+    def put(
+            self,
+            item,
+            block=True,
+            timeout=None):
+        """put
+
+        Add a record, waiting up to ``timeout`` seconds for
+        room when ``block`` is True
+
+        :param item: record as ``str`` or ``bytes``
+        :param block: wait for room
+        :param timeout: seconds to wait with None waiting forever
+        """
+        if not block:
+            self.put_nowait(
+                item)
+            return
+        end_time = None
+        if timeout is not None:
+            end_time = time.time() + timeout
+        while True:
+            # clear before trying again so a get that races
+            # with the attempt still leaves the event set
+            self.not_full.clear()
+            try:
+                self.put_nowait(
+                    item)
+                return
+            except Full:
+                pass
+            remaining = None
+            if end_time is not None:
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    raise Full()
+            self.not_full.wait(
+                remaining)
+        # end of waiting for room
+    # end of put
+
+    def offer(
+            self,
+            item,
+            levelno=logging.NOTSET):
+        """offer
+
+        Add a record and apply the ``overflow_policy`` if the ring is
+        full. Returns False if the record was not queued - the caller
+        decides whether to drop it with ``record_drop``. Older records
+        evicted to make room are counted as dropped here.
+
+        :param item: record as ``str`` or ``bytes``
+        :param levelno: logging level number of the record
+        """
+        item = self.encode(
+            item)
+        with self.lock:
+            added = self.offer_locked(
+                item,
+                levelno)
+        if added:
+            self.notify()
+            return True
+        self.wake_full()
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            try:
+                self.put(
+                    item,
+                    block=True,
+                    timeout=self.block_timeout)
+                return True
+            except Full:
+                return False
+        return False
+    # end of offer
+
+    def offer_locked(
+            self,
+            item,
+            levelno):
+        """offer_locked
+
+        Append a frame and evict older records to make room when the
+        ``overflow_policy`` allows it. Returns False if the record does
+        not fit - the caller must hold ``self.lock``
+
+        :param item: record as ``bytes``
+        :param levelno: logging level number of the record
+        """
+        added = self.put_locked(
+            item,
+            levelno)
+        evict = bool(
+            self.overflow_policy == OVERFLOW_DROP_OLDEST
+            or (self.overflow_policy == OVERFLOW_DROP_BELOW_LEVEL
+                and levelno >= self.overflow_level))
+        if not added and evict and (
+                FRAME_HEADER.size + len(item) <= self.capacity):
+            header = self.header
+            while not added:
+                dropped = None
+                if self.overflow_policy == OVERFLOW_DROP_BELOW_LEVEL:
+                    # records below the level go before any at the level
+                    dropped = self.evict_below_level_locked()
+                if dropped is None:
+                    dropped = self.pop_locked()
+                if dropped is None:
+                    break
+                header[DROPPED] += 1
+                header[DROPPED_BYTES] += len(dropped)
+                added = self.put_locked(
+                    item,
+                    levelno)
+            # end of evicting records
+        return added
+    # end of offer_locked
+
+    def offer_many(
+            self,
+            items):
+        """offer_many
+
+        ``offer`` a list of records under one lock acquisition and
+        one consumer wakeup. Records that were not queued are counted
+        as dropped - ``block`` waits for room for each of them first.
+
+        Returns the number of queued records
+
+        :param items: list of ``(item, levelno)`` tuples
+        """
+        items = [
+            (self.encode(item), levelno)
+            for item, levelno in items
+        ]
+        num_queued = 0
+        blocked = []
+        header = self.header
+        with self.lock:
+            for item, levelno in items:
+                if self.offer_locked(
+                        item,
+                        levelno):
+                    num_queued += 1
+                elif self.overflow_policy == OVERFLOW_BLOCK:
+                    blocked.append(item)
+                else:
+                    header[DROPPED] += 1
+                    header[DROPPED_BYTES] += len(item)
+            # end of for all records
+        if num_queued:
+            self.notify()
+        if num_queued < len(items):
+            self.wake_full()
+        for item in blocked:
+            try:
+                self.put(
+                    item,
+                    block=True,
+                    timeout=self.block_timeout)
+                num_queued += 1
+            except Full:
+                self.record_drop(
+                    item)
+        return num_queued
+    # end of offer_many
+
+    def record_drop(
+            self,
+            item):
+        """record_drop
+
+        Count a dropped record for the next ``pop_dropped``
+
+        :param item: dropped record
+        """
+        with self.lock:
+            self.header[DROPPED] += 1
+            self.header[DROPPED_BYTES] += len(item)
+    # end of record_drop
+
+    def pop_dropped(
+            self):
+        """pop_dropped
+
+        Return the number of dropped records and their bytes since
+        the last call as a tuple and reset both counters
+        """
+        with self.lock:
+            dropped = (
+                self.header[DROPPED],
+                self.header[DROPPED_BYTES])
+            self.header[DROPPED] = 0
+            self.header[DROPPED_BYTES] = 0
+        return dropped
+    # end of pop_dropped
+
+    def has_dropped(
+            self):
+        """has_dropped
+
+        Return True if records were dropped since
+        the last ``pop_dropped``
+        """
+        return self.header[DROPPED] > 0
+    # end of has_dropped
+
+    def wake_full(
+            self):
+        """wake_full
+
+        Wake a waiting consumer because the ring is full
+        """
+        if self.header[WAITING]:
+            self.not_empty.set()
+    # end of wake_full
+
+    def wake(
+            self):
+        """wake
+
+        Wake the consumer without a record - used on shutdown
+        """
+        self.header[WOKEN] = 1
+        self.not_empty.set()
+    # end of wake
+
+    def wait_for_items(
+            self,
+            min_items=1,
+            timeout=None):
+        """wait_for_items
+
+        Wait until the ring holds ``min_items`` records or is full and
+        return True, or return False after ``timeout`` seconds or
+        a ``wake``
+
+        :param min_items: number of records to wait for
+        :param timeout: seconds to wait with None waiting forever
+        """
+        header = self.header
+        if self.maxsize > 0:
+            min_items = min(min_items, self.maxsize)
+        if header[COUNT] >= min_items:
+            return True
+        end_time = None
+        if timeout is not None:
+            end_time = time.time() + timeout
+        header[WAKE_ITEMS] = max(1, min_items)
+        try:
+            while True:
+                # flag and clear before checking again so a put that
+                # races with the check still leaves the event set
+                header[WAITING] = 1
+                self.not_empty.clear()
+                if header[COUNT] >= min_items or self.full():
+                    return True
+                if header[WOKEN]:
+                    header[WOKEN] = 0
+                    return False
+                remaining = None
+                if end_time is not None:
+                    remaining = end_time - time.time()
+                    if remaining <= 0:
+                        return False
+                self.not_empty.wait(
+                    remaining)
+            # end of waiting for records
+        finally:
+            header[WAITING] = 0
+    # end of wait_for_items
+
+    def get_many(
+            self,
+            max_items=0,
+            timeout=None,
+            min_items=1):
+        """get_many
+
+        Wait up to ``timeout`` seconds for ``min_items`` records and
+        then remove and return a tuple of False (the ring has no
+        priority lane) and a list of up to ``max_items`` records
+
+        :param max_items: most records to return with 0 returning all
+        :param timeout: seconds to wait with None waiting forever
+        :param min_items: number of records to wait for
+        """
+        self.wait_for_items(
+            min_items=min_items,
+            timeout=timeout)
+        items = []
+        with self.lock:
+            while max_items <= 0 or len(items) < max_items:
+                item = self.pop_locked()
+                if item is None:
+                    break
+                items.append(item)
+        if items:
+            self.not_full.set()
+        return False, items
+    # end of get_many
+
+    def get_nowait(
+            self):
+        """get_nowait
+
+        Remove and return the oldest record or raise ``queue.Empty``
+        """
+        with self.lock:
+            item = self.pop_locked()
+        if item is None:
+            raise Empty()
+        self.not_full.set()
+        return item
+    # end of get_nowait
+
+    def get(
+            self,
+            block=True,
+            timeout=None):
+        """get
+
+        Remove and return the oldest record, waiting up to
+        ``timeout`` seconds for one when ``block`` is True
+
+        :param block: wait for a record
+        :param timeout: seconds to wait with None waiting forever
+        """
+        if block:
+            self.wait_for_items(
+                min_items=1,
+                timeout=timeout)
+        return self.get_nowait()
+    # end of get
+
+    def get_priority(
+            self,
+            block=True,
+            timeout=None):
+        """get_priority
+
+        ``get`` for consumers that also read a ``LaneQueue``
+
+        :param block: wait for a record
+        :param timeout: seconds to wait with None waiting forever
+        """
+        return False, self.get(
+            block=block,
+            timeout=timeout)
+    # end of get_priority
+
+    def qsize(
+            self):
+        """qsize"""
+        return int(self.header[COUNT])
+    # end of qsize
+
+    def empty(
+            self):
+        """empty"""
+        return self.header[COUNT] == 0
+    # end of empty
+
+    def full(
+            self):
+        """full"""
+        header = self.header
+        if self.maxsize > 0 and header[COUNT] >= self.maxsize:
+            return True
+        return header[HEAD] - header[TAIL] >= self.capacity
+    # end of full
+
+    def unlink(
+            self):
+        """unlink
+
+        Remove the shared memory block once every process is
+        done with it - only the process that created it unlinks
+        """
+        if not self.owner:
+            return
+        self.owner = False
+        try:
+            self.shm.unlink()
+        except Exception:
+            pass
+    # end of unlink
+
+    def close(
+            self):
+        """close
+
+        Release this process's mapping of the ring
+        """
+        shm = getattr(self, 'shm', None)
+        if shm is None:
+            return
+        self.shm = None
+        # the views must go before the mapping can be closed
+        for key in ['header', 'data']:
+            view = self.__dict__.pop(key, None)
+            if view is not None:
+                view.release()
+        shm.close()
+    # end of close
+
+    def __del__(
+            self):
+        """__del__"""
+        try:
+            self.close()
+        except Exception:
+            pass
+    # end of __del__
+
+    def __str__(
+            self):
+        """__str__"""
+        return (
+            'ShmRingQueue(name={} size={} maxsize={} bytes={} '
+            'capacity={})').format(
+                self.name,
+                self.qsize(),
+                self.maxsize,
+                self.header[HEAD] - self.header[TAIL],
+                self.capacity)
+    # end of __str__
+
+# end of ShmRingQueue
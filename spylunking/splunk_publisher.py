@@ -21,27 +21,80 @@ Available environment variables:
     export SPLUNK_VERIFY="<verify certs on HTTP POST>"
     export SPLUNK_TIMEOUT="<timeout in seconds>"
     export SPLUNK_QUEUE_SIZE="<num msgs allowed in queue - 0=infinite>"
+    export SPLUNK_QUEUE_BACKEND="<memory (default) in-process|manager>"
+    export SPLUNK_MAX_BATCH_BYTES="<max encoded bytes per POST: 524288>"
+    export SPLUNK_MAX_BATCH_EVENTS="<max logs per POST - 0=infinite>"
+    export SPLUNK_LINGER_MS="<wait in ms for more logs per batch - 0=off>"
+    export SPLUNK_COMPRESS="<gzip POST bodies - 1 enable|0 off>"
+    export SPLUNK_COMPRESS_MIN_BYTES="<only gzip POST bodies this size: 1024>"
+    export SPLUNK_COMPRESS_LEVEL="<gzip level 1 fastest - 9 smallest: 6>"
+    export SPLUNK_ENDPOINT="<event (default) envelope|raw line events>"
+    export SPLUNK_CHANNEL="<HEC channel uuid - defaults to a new uuid>"
+    export SPLUNK_MAX_INFLIGHT="<concurrent POSTs per publisher: 1>"
+    export SPLUNK_USE_ACK="<wait for HEC indexer acks - 1 enable|0 off>"
+    export SPLUNK_ACK_WINDOW="<max unacknowledged batches in memory: 100>"
+    export SPLUNK_ACK_TIMEOUT="<resend unacknowledged batches after: 60.0>"
+    export SPLUNK_ACK_POLL_INTERVAL="<seconds between ack polls: 1.0>"
+    export SPLUNK_SPOOL_DIR="<spool failed batches to disk - empty disables>"
+    export SPLUNK_SPOOL_MAX_BYTES="<max spooled bytes on disk: 268435456>"
+    export SPLUNK_SPOOL_SEGMENT_BYTES="<bytes per spool segment: 8388608>"
+    export SPLUNK_SPOOL_REPLAY_INTERVAL="<seconds between replays: 5.0>"
+    export SPLUNK_QUEUE_MAX_BYTES="<bytes allowed in queue - 0=infinite>"
+    export SPLUNK_OVERFLOW_POLICY="<drop-newest (default)|drop-oldest|
+                                    drop-below-level|block>"
+    export SPLUNK_OVERFLOW_LEVEL="<lowest drop-below-level level: WARNING>"
+    export SPLUNK_OVERFLOW_BLOCK_TIMEOUT="<seconds block waits for room: 1.0>"
+    export SPLUNK_DROP_REPORT_INTERVAL="<seconds between dropped reports: 60.0>"
+    export SPLUNK_PRIORITY_LANES="<split logs into priority lanes - 1|0>"
+    export SPLUNK_PRIORITY_LEVEL="<lowest priority lane level: ERROR>"
+    export SPLUNK_PRIORITY_QUEUE_SIZE="<num msgs in the priority lane: 10000>"
+    export SPLUNK_PRIORITY_QUEUE_MAX_BYTES="<bytes in the priority lane: 0>"
+    export SPLUNK_PRIORITY_WEIGHT="<priority logs drained per other log: 4>"
+    export SPLUNK_ADAPTIVE_FLUSH="<plan batches from depth and latency - 1|0>"
+    export SPLUNK_TARGET_LATENCY_MS="<slowest healthy HEC POST: 250>"
+    export SPLUNK_MAX_LINGER_MS="<longest adaptive linger: 1000>"
+    export SPLUNK_MIN_BATCH_BYTES="<smallest adaptive batch limit: 16384>"
     export SPLUNK_SLEEP_INTERVAL="<sleep in seconds per batch>"
     export SPLUNK_RETRY_COUNT="<attempts per log to retry publishing>"
     export SPLUNK_RETRY_BACKOFF="<cooldown in seconds per failed POST>"
+    export SPLUNK_RETRY_MAX_BACKOFF="<longest retry backoff in seconds: 60.0>"
+    export SPLUNK_RETRY_MAX_PENDING="<max batches waiting for a retry: 100>"
+    export SPLUNK_BREAKER_THRESHOLD="<failed POSTs that open the breaker: 5>"
+    export SPLUNK_BREAKER_RESET="<seconds before probing HEC again: 30.0>"
+    export SPLUNK_DEAD_LETTER_FILE="<append rejected events here - empty drops>"
+    export SPLUNK_SORT_KEYS="<sort the HEC envelope keys - 1 (default)|0>"
+    export SPLUNK_EVENT_FORMAT="<string (default) JSON in a string|object>"
+    export SPLUNK_INDEXED_FIELDS="<comma-separated keys ex: name,dc,env>"
+    export SPLUNK_JSON_ENCODER="<auto (default)|orjson|ujson|rapidjson|json>"
     export SPLUNK_DEBUG="<1 enable debug|0 off>"
 
 """
 
-import sys
 import atexit
+import os
 import traceback
 import multiprocessing
 import threading
-import json
 import logging
 import socket
 import time
+import uuid
 import requests
-import spylunking.send_to_splunk as send_to_splunk
-from threading import Timer
+from spylunking.send_to_splunk import HEC_ENDPOINT_RAW
 from spylunking.rnow import rnow
-from spylunking.ppj import ppj
+from spylunking.hec_sender import HecSender
+from spylunking.batch_builder import BatchBuilder
+from spylunking.hec_envelope import EVENT_FORMATS
+from spylunking.hec_envelope import encode_event
+from spylunking.hec_envelope import get_indexed_fields
+from spylunking.json_encoder import get_json_encoder
+from spylunking.sender_pool import SenderPool
+from spylunking.ack_tracker import AckTracker
+from spylunking.disk_spool import DiskSpool
+from spylunking.dead_letter import build_dead_letter
+from spylunking.flush_scheduler import FlushScheduler
+from spylunking.retry_scheduler import CircuitBreaker
+from spylunking.retry_scheduler import RetryScheduler
 from spylunking.consts import SPLUNK_HOST
 from spylunking.consts import SPLUNK_PORT
 from spylunking.consts import SPLUNK_TOKEN
@@ -54,20 +107,61 @@ from spylunking.consts import SPLUNK_SLEEP_INTERVAL
 from spylunking.consts import SPLUNK_RETRY_COUNT
 from spylunking.consts import SPLUNK_RETRY_BACKOFF
 from spylunking.consts import SPLUNK_QUEUE_SIZE
+from spylunking.consts import SPLUNK_QUEUE_BACKEND
+from spylunking.consts import SPLUNK_MAX_BATCH_BYTES
+from spylunking.consts import SPLUNK_MAX_BATCH_EVENTS
+from spylunking.consts import SPLUNK_LINGER_MS
+from spylunking.consts import SPLUNK_COMPRESS
+from spylunking.consts import SPLUNK_COMPRESS_MIN_BYTES
+from spylunking.consts import SPLUNK_COMPRESS_LEVEL
+from spylunking.consts import SPLUNK_ENDPOINT
+from spylunking.consts import SPLUNK_CHANNEL
+from spylunking.consts import SPLUNK_MAX_INFLIGHT
+from spylunking.consts import SPLUNK_USE_ACK
+from spylunking.consts import SPLUNK_ACK_WINDOW
+from spylunking.consts import SPLUNK_ACK_TIMEOUT
+from spylunking.consts import SPLUNK_ACK_POLL_INTERVAL
+from spylunking.consts import SPLUNK_SPOOL_DIR
+from spylunking.consts import SPLUNK_SPOOL_MAX_BYTES
+from spylunking.consts import SPLUNK_SPOOL_SEGMENT_BYTES
+from spylunking.consts import SPLUNK_SPOOL_REPLAY_INTERVAL
+from spylunking.consts import SPLUNK_QUEUE_MAX_BYTES
+from spylunking.consts import SPLUNK_OVERFLOW_POLICY
+from spylunking.consts import SPLUNK_OVERFLOW_LEVEL
+from spylunking.consts import SPLUNK_OVERFLOW_BLOCK_TIMEOUT
+from spylunking.consts import SPLUNK_DROP_REPORT_INTERVAL
+from spylunking.consts import SPLUNK_PRIORITY_LANES
+from spylunking.consts import SPLUNK_PRIORITY_LEVEL
+from spylunking.consts import SPLUNK_PRIORITY_QUEUE_SIZE
+from spylunking.consts import SPLUNK_PRIORITY_QUEUE_MAX_BYTES
+from spylunking.consts import SPLUNK_PRIORITY_WEIGHT
+from spylunking.consts import SPLUNK_ADAPTIVE_FLUSH
+from spylunking.consts import SPLUNK_TARGET_LATENCY_MS
+from spylunking.consts import SPLUNK_MAX_LINGER_MS
+from spylunking.consts import SPLUNK_MIN_BATCH_BYTES
+from spylunking.consts import SPLUNK_RETRY_MAX_BACKOFF
+from spylunking.consts import SPLUNK_RETRY_MAX_PENDING
+from spylunking.consts import SPLUNK_BREAKER_THRESHOLD
+from spylunking.consts import SPLUNK_BREAKER_RESET
+from spylunking.consts import SPLUNK_DEAD_LETTER_FILE
+from spylunking.consts import SPLUNK_SORT_KEYS
+from spylunking.consts import SPLUNK_EVENT_FORMAT
+from spylunking.consts import SPLUNK_INDEXED_FIELDS
 from spylunking.consts import SPLUNK_DEBUG
-from requests.packages.urllib3.util.retry import Retry
+from spylunking.memory_queue import QUEUE_BACKEND_MEMORY
+from spylunking.memory_queue import build_queue
+from spylunking.memory_queue import in_manager_server
+from spylunking.memory_queue import get_level
 from requests.adapters import HTTPAdapter
 
-
-is_py2 = sys.version[0] == '2'
-if is_py2:
-    from Queue import Queue  # noqa
-else:
-    from queue import Queue  # noqa
-
 # For keeping track of running class instances
 instances = []
 
+# worker thread states
+WORKER_RUNNING = 'running'
+WORKER_DRAINING = 'draining'
+WORKER_STOPPED = 'stopped'
+
 
 # Called when application exit imminent (main thread ended / got kill signal)
 @atexit.register
@@ -155,7 +249,37 @@ def force_flush():
 # end of force_flush
 
 
-class SplunkPublisher(logging.Handler):
+def reinit_after_fork():
+    """reinit_after_fork
+
+    Reset the locks every publisher uses to restart itself in a
+    forked child process like a Celery prefork worker. The restart
+    waits for the child's first log so this never starts a manager,
+    thread or session in children that do not log (like a
+    ``multiprocessing`` manager server).
+    """
+    for instance in instances:
+        try:
+            instance.after_fork_in_child()
+        except Exception as e:
+            if SPLUNK_DEBUG:
+                print(
+                    '{} - after fork instance={} '
+                    '- hit ex={}'.format(
+                        rnow(),
+                        instance,
+                        e))
+        # end of try/ex
+# end of reinit_after_fork
+
+
+# os.register_at_fork is only available on python 3.7+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(
+        after_in_child=reinit_after_fork)
+
+
+class SplunkPublisher(HecSender, logging.Handler):
     """
     A logging handler to send logs to a Splunk Enterprise instance
     running the Splunk HTTP Event Collector.
@@ -182,7 +306,48 @@ class SplunkPublisher(logging.Handler):
             debug=False,
             retry_count=20,
             retry_backoff=2.0,
-            run_once=False):
+            run_once=False,
+            queue_backend=None,
+            max_batch_bytes=None,
+            max_batch_events=None,
+            linger_ms=None,
+            compress=None,
+            compress_min_bytes=None,
+            compress_level=None,
+            endpoint=None,
+            channel=None,
+            max_inflight=None,
+            use_ack=None,
+            ack_window=None,
+            ack_timeout=None,
+            ack_poll_interval=None,
+            spool_dir=None,
+            spool_max_bytes=None,
+            spool_segment_bytes=None,
+            spool_replay_interval=None,
+            queue_max_bytes=None,
+            overflow_policy=None,
+            overflow_level=None,
+            overflow_block_timeout=None,
+            drop_report_interval=None,
+            priority_lanes=None,
+            priority_level=None,
+            priority_queue_size=None,
+            priority_queue_max_bytes=None,
+            priority_weight=None,
+            adaptive_flush=None,
+            target_latency_ms=None,
+            max_linger_ms=None,
+            min_batch_bytes=None,
+            retry_max_backoff=None,
+            retry_max_pending=None,
+            breaker_threshold=None,
+            breaker_reset=None,
+            dead_letter=None,
+            sort_keys=None,
+            event_format=None,
+            indexed_fields=None,
+            json_encoder=None):
         """__init__
 
         Initialize the SplunkPublisher
@@ -201,9 +366,102 @@ class SplunkPublisher(logging.Handler):
         :param queue_size: Queue this number of logs before dropping
                            new logs with 0 is an infinite number of messages
         :param debug: debug the publisher
-        :param retry_count: number of publish retries per log record
-        :param retry_backoff: cooldown timer in seconds
+        :param retry_count: number of retries per failed batch
+        :param retry_backoff: base of the jittered exponential
+                              backoff between retries in seconds
         :param run_once: test flag for running this just one time
+        :param queue_backend: ``memory`` for an in-process queue
+                              (default) or ``manager`` to opt into a
+                              ``multiprocessing.Manager().Queue``
+        :param max_batch_bytes: send a batch once it holds this many
+                                encoded bytes
+        :param max_batch_events: send a batch once it holds this many
+                                 logs with 0 is an infinite number of logs
+        :param linger_ms: milliseconds to wait for more logs after the
+                          first log in a batch with 0 sending as soon
+                          as the queue is empty
+        :param compress: gzip POST bodies from the worker
+        :param compress_min_bytes: only gzip POST bodies that are
+                                   at least this many bytes
+        :param compress_level: gzip level from 1 (fastest)
+                               to 9 (smallest)
+        :param endpoint: ``event`` to POST JSON envelopes to
+                         ``/services/collector`` or ``raw`` to POST
+                         newline-delimited formatted logs to
+                         ``/services/collector/raw``
+        :param channel: HEC channel uuid sent in the
+                        ``X-Splunk-Request-Channel`` header
+                        - defaults to a new uuid per publisher
+        :param max_inflight: number of concurrent HTTP POSTs sharing
+                             the ``requests.Session`` connection pool
+                             with 1 sending from the worker - above
+                             1 batches can reach HEC out of order
+        :param use_ack: track HEC indexer acknowledgments for each batch
+                        on the ``channel`` (the HEC token must have
+                        indexer acknowledgment enabled)
+        :param ack_window: maximum number of unacknowledged batches
+                           to hold in memory before sending blocks
+        :param ack_timeout: seconds to wait for an acknowledgment
+                            before resending a batch
+        :param ack_poll_interval: seconds between bulk ack polls
+        :param spool_dir: directory to spool batches to while Splunk
+                          is unreachable with None or an empty string
+                          turning the spool off
+        :param spool_max_bytes: maximum bytes held in the spool
+        :param spool_segment_bytes: bytes per spool segment file
+        :param spool_replay_interval: seconds between attempts to
+                                      replay the spool to Splunk
+        :param queue_max_bytes: queue this many bytes of logs before
+                                applying the ``overflow_policy`` with
+                                0 is an infinite number of bytes
+        :param overflow_policy: ``drop-newest`` (default), ``drop-oldest``,
+                                ``drop-below-level`` or ``block`` when
+                                the queue is full
+        :param overflow_level: ``drop-below-level`` drops new logs below
+                               this level and makes room for the rest
+        :param overflow_block_timeout: seconds ``block`` waits for room
+                                       before dropping the log
+        :param drop_report_interval: seconds between the events
+                                     counting dropped logs
+        :param priority_lanes: queue logs at or above the
+                               ``priority_level`` in their own lane that
+                               is drained first and sent without waiting
+        :param priority_level: lowest level for the priority lane
+        :param priority_queue_size: queue this number of priority logs
+                                    with 0 is an infinite number
+        :param priority_queue_max_bytes: queue this many bytes of
+                                         priority logs with 0 is an
+                                         infinite number of bytes
+        :param priority_weight: priority logs drained for each
+                                log from the other lane
+        :param adaptive_flush: plan each batch's byte limit and linger
+                               from the queue depth and HEC latency
+                               with a ``FlushScheduler``
+        :param target_latency_ms: HEC POSTs slower than this make the
+                                  adaptive scheduler back off
+        :param max_linger_ms: longest adaptive linger
+        :param min_batch_bytes: smallest adaptive batch byte limit
+        :param retry_max_backoff: longest backoff between retries
+        :param retry_max_pending: maximum batches waiting for a retry
+        :param breaker_threshold: consecutive failed POSTs that stop
+                                  sending until HEC recovers - 0
+                                  disables the circuit breaker
+        :param breaker_reset: seconds before an open circuit breaker
+                              lets a probe batch through
+        :param dead_letter: file path or callable taking ``event`` and
+                            ``reason`` for the events HEC rejects
+        :param sort_keys: sort the HEC envelope keys - the
+                          constant keys are encoded once either way
+        :param event_format: ``string`` sends each formatted log as
+                             a JSON string and ``object`` sends the
+                             dictionary from a formatter's
+                             ``format_event`` as a nested JSON object
+        :param indexed_fields: list or comma-separated string of
+                               drill-down keys like ``name,dc,env``
+                               to send as HEC indexed ``fields``
+        :param json_encoder: ``auto``, ``orjson``, ``ujson``,
+                             ``rapidjson`` or ``json`` encoder
+                             for the HEC events
         """
 
         global instances
@@ -250,17 +508,145 @@ class SplunkPublisher(logging.Handler):
         self.queue_size = queue_size
         if self.queue_size is None:
             self.queue_size = SPLUNK_QUEUE_SIZE
-
-        self.log_payload = ''
-
-        self.timer = None
-        self.tid = None
-        self.manager = multiprocessing.Manager()
-        self.queue = self.manager.Queue(maxsize=self.queue_size)
-        self.session = requests.Session()
-        self.shutdown_event = multiprocessing.Event()
-        self.shutdown_ack = multiprocessing.Event()
-        self.already_done = multiprocessing.Event()
+        self.queue_backend = queue_backend
+        if self.queue_backend is None:
+            self.queue_backend = SPLUNK_QUEUE_BACKEND
+        self.max_batch_bytes = max_batch_bytes
+        if self.max_batch_bytes is None:
+            self.max_batch_bytes = SPLUNK_MAX_BATCH_BYTES
+        self.max_batch_events = max_batch_events
+        if self.max_batch_events is None:
+            self.max_batch_events = SPLUNK_MAX_BATCH_EVENTS
+        self.linger_ms = linger_ms
+        if self.linger_ms is None:
+            self.linger_ms = SPLUNK_LINGER_MS
+        self.compress = compress
+        if self.compress is None:
+            self.compress = SPLUNK_COMPRESS
+        self.compress_min_bytes = compress_min_bytes
+        if self.compress_min_bytes is None:
+            self.compress_min_bytes = SPLUNK_COMPRESS_MIN_BYTES
+        self.compress_level = compress_level
+        if self.compress_level is None:
+            self.compress_level = SPLUNK_COMPRESS_LEVEL
+        self.endpoint = endpoint
+        if self.endpoint is None:
+            self.endpoint = SPLUNK_ENDPOINT
+        self.channel = channel
+        if self.channel is None:
+            self.channel = SPLUNK_CHANNEL
+        # a generated channel is replaced in forked child processes
+        self.channel_generated = not self.channel
+        if self.channel_generated:
+            self.channel = str(uuid.uuid4())
+        self.max_inflight = max_inflight
+        if self.max_inflight is None:
+            self.max_inflight = SPLUNK_MAX_INFLIGHT
+        self.use_ack = use_ack
+        if self.use_ack is None:
+            self.use_ack = SPLUNK_USE_ACK
+        self.ack_window = ack_window
+        if self.ack_window is None:
+            self.ack_window = SPLUNK_ACK_WINDOW
+        self.ack_timeout = ack_timeout
+        if self.ack_timeout is None:
+            self.ack_timeout = SPLUNK_ACK_TIMEOUT
+        self.ack_poll_interval = ack_poll_interval
+        if self.ack_poll_interval is None:
+            self.ack_poll_interval = SPLUNK_ACK_POLL_INTERVAL
+        self.spool_dir = spool_dir
+        if self.spool_dir is None:
+            self.spool_dir = SPLUNK_SPOOL_DIR
+        # forked child processes spool below the parent's directory
+        self.base_spool_dir = self.spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        if self.spool_max_bytes is None:
+            self.spool_max_bytes = SPLUNK_SPOOL_MAX_BYTES
+        self.spool_segment_bytes = spool_segment_bytes
+        if self.spool_segment_bytes is None:
+            self.spool_segment_bytes = SPLUNK_SPOOL_SEGMENT_BYTES
+        self.spool_replay_interval = spool_replay_interval
+        if self.spool_replay_interval is None:
+            self.spool_replay_interval = SPLUNK_SPOOL_REPLAY_INTERVAL
+        self.queue_max_bytes = queue_max_bytes
+        if self.queue_max_bytes is None:
+            self.queue_max_bytes = SPLUNK_QUEUE_MAX_BYTES
+        self.overflow_policy = overflow_policy
+        if self.overflow_policy is None:
+            self.overflow_policy = SPLUNK_OVERFLOW_POLICY
+        self.overflow_level = overflow_level
+        if self.overflow_level is None:
+            self.overflow_level = SPLUNK_OVERFLOW_LEVEL
+        self.overflow_block_timeout = overflow_block_timeout
+        if self.overflow_block_timeout is None:
+            self.overflow_block_timeout = SPLUNK_OVERFLOW_BLOCK_TIMEOUT
+        self.drop_report_interval = drop_report_interval
+        if self.drop_report_interval is None:
+            self.drop_report_interval = SPLUNK_DROP_REPORT_INTERVAL
+        self.last_drop_report = time.time()
+        self.priority_lanes = priority_lanes
+        if self.priority_lanes is None:
+            self.priority_lanes = SPLUNK_PRIORITY_LANES
+        self.priority_level = priority_level
+        if self.priority_level is None:
+            self.priority_level = SPLUNK_PRIORITY_LEVEL
+        self.priority_queue_size = priority_queue_size
+        if self.priority_queue_size is None:
+            self.priority_queue_size = SPLUNK_PRIORITY_QUEUE_SIZE
+        self.priority_queue_max_bytes = priority_queue_max_bytes
+        if self.priority_queue_max_bytes is None:
+            self.priority_queue_max_bytes = SPLUNK_PRIORITY_QUEUE_MAX_BYTES
+        self.priority_weight = priority_weight
+        if self.priority_weight is None:
+            self.priority_weight = SPLUNK_PRIORITY_WEIGHT
+        self.adaptive_flush = adaptive_flush
+        if self.adaptive_flush is None:
+            self.adaptive_flush = SPLUNK_ADAPTIVE_FLUSH
+        self.target_latency_ms = target_latency_ms
+        if self.target_latency_ms is None:
+            self.target_latency_ms = SPLUNK_TARGET_LATENCY_MS
+        self.max_linger_ms = max_linger_ms
+        if self.max_linger_ms is None:
+            self.max_linger_ms = SPLUNK_MAX_LINGER_MS
+        self.min_batch_bytes = min_batch_bytes
+        if self.min_batch_bytes is None:
+            self.min_batch_bytes = SPLUNK_MIN_BATCH_BYTES
+        self.retry_max_backoff = retry_max_backoff
+        if self.retry_max_backoff is None:
+            self.retry_max_backoff = SPLUNK_RETRY_MAX_BACKOFF
+        self.retry_max_pending = retry_max_pending
+        if self.retry_max_pending is None:
+            self.retry_max_pending = SPLUNK_RETRY_MAX_PENDING
+        self.breaker_threshold = breaker_threshold
+        if self.breaker_threshold is None:
+            self.breaker_threshold = SPLUNK_BREAKER_THRESHOLD
+        self.breaker_reset = breaker_reset
+        if self.breaker_reset is None:
+            self.breaker_reset = SPLUNK_BREAKER_RESET
+        self.dead_letter = dead_letter
+        if self.dead_letter is None:
+            self.dead_letter = SPLUNK_DEAD_LETTER_FILE
+        self.dead_letter = build_dead_letter(
+            dead_letter=self.dead_letter)
+        self.sort_keys = sort_keys
+        if self.sort_keys is None:
+            self.sort_keys = SPLUNK_SORT_KEYS
+        self.event_format = event_format
+        if self.event_format is None:
+            self.event_format = SPLUNK_EVENT_FORMAT
+        if self.event_format not in EVENT_FORMATS:
+            raise ValueError(
+                'unsupported event_format={} please use one of: {}'.format(
+                    self.event_format,
+                    EVENT_FORMATS))
+        self.indexed_fields = indexed_fields
+        if self.indexed_fields is None:
+            self.indexed_fields = SPLUNK_INDEXED_FIELDS
+        self.indexed_fields = get_indexed_fields(
+            self.indexed_fields)
+        self.json_encoder = get_json_encoder(
+            json_encoder)
+        self.priority_levelno = get_level(self.priority_level)
         self.testing = False
         self.shutdown_now = False
         self.run_once = run_once
@@ -277,6 +663,9 @@ class SplunkPublisher(logging.Handler):
         else:
             self.hostname = hostname
 
+        self.build_urls()
+        self.build_envelope()
+
         self.debug_log('preparing to override loggers')
 
         # prevent infinite recursion by silencing requests and urllib3 loggers
@@ -290,23 +679,198 @@ class SplunkPublisher(logging.Handler):
         if not self.verify:
             requests.packages.urllib3.disable_warnings()
 
-        # Set up automatic retry with back-off
-        self.debug_log('preparing to create a Requests session')
-        retry = Retry(
-            total=self.retry_count,
-            backoff_factor=self.retry_backoff,
-            method_whitelist=False,  # Retry for any HTTP verb
-            status_forcelist=[500, 502, 503, 504])
-        self.session.mount('https://', HTTPAdapter(max_retries=retry))
-
-        self.start_worker_thread(
-            sleep_interval=self.sleep_interval)
+        # guards restarting in a forked child process
+        self.fork_lock = threading.Lock()
+        self.start_runtime()
 
         self.debug_log((
             'READY init - sleep_interval={}').format(
                 self.sleep_interval))
     # end of __init__
 
+    def start_runtime(
+            self,
+            start_threads=True):
+        """start_runtime
+
+        Create the per-process state: the queue, batch,
+        ``requests.Session``, helper threads and the worker
+        thread. This runs in ``__init__`` and again on the first
+        log in a forked child process.
+
+        :param start_threads: False sends each log from ``emit``
+                              with an in-process queue and no
+                              helper threads
+        """
+        self.runtime_pid = os.getpid()
+        if not start_threads:
+            self.sleep_interval = 0
+        self.num_dead_letters = 0
+        self.breaker = CircuitBreaker(
+            failure_threshold=self.breaker_threshold,
+            reset_timeout=self.breaker_reset)
+        self.flush_event = threading.Event()
+
+        self.batch = BatchBuilder(
+            max_bytes=self.max_batch_bytes,
+            max_events=self.max_batch_events,
+            linger_ms=self.linger_ms)
+        # logs read from the queue that did not fit in the last batch
+        self.pending = []
+        self.pending_priority = False
+        self.scheduler = None
+        if self.adaptive_flush:
+            self.scheduler = FlushScheduler(
+                min_batch_bytes=self.min_batch_bytes,
+                max_batch_bytes=self.max_batch_bytes,
+                min_linger_ms=self.linger_ms,
+                max_linger_ms=max(self.linger_ms, self.max_linger_ms),
+                target_latency_ms=self.target_latency_ms)
+
+        self.worker = None
+        self.tid = None
+        # guards the worker state and the flush sequence numbers
+        self.state_lock = threading.Condition()
+        self.state = WORKER_RUNNING
+        self.flush_requested = 0
+        self.flush_done = 0
+        queue_backend = self.queue_backend
+        if not start_threads:
+            queue_backend = QUEUE_BACKEND_MEMORY
+        self.queue, self.manager = build_queue(
+            backend=queue_backend,
+            queue_size=self.queue_size,
+            max_bytes=self.queue_max_bytes,
+            overflow_policy=self.overflow_policy,
+            overflow_level=self.overflow_level,
+            block_timeout=self.overflow_block_timeout,
+            priority_lanes=self.priority_lanes,
+            priority_level=self.priority_level,
+            priority_queue_size=self.priority_queue_size,
+            priority_max_bytes=self.priority_queue_max_bytes,
+            priority_weight=self.priority_weight)
+        self.shutdown_event = multiprocessing.Event()
+        self.shutdown_ack = multiprocessing.Event()
+        self.already_done = multiprocessing.Event()
+
+        # retries are handled by the self.retry_scheduler
+        self.debug_log('preparing to create a Requests session')
+        self.session = requests.Session()
+        self.session.mount(
+            'https://',
+            HTTPAdapter(
+                max_retries=0,
+                pool_maxsize=max(10, self.max_inflight)))
+
+        self.sender_pool = None
+        if self.max_inflight > 1 and self.sleep_interval > 0:
+            self.sender_pool = SenderPool(
+                send_func=self.send_payload,
+                max_inflight=self.max_inflight,
+                name='splunkpub-sender')
+
+        self.ack_tracker = None
+        if self.use_ack and start_threads:
+            self.ack_tracker = AckTracker(
+                poll_func=self.poll_acks,
+                resend_func=self.resend_payload,
+                max_pending=self.ack_window,
+                timeout=self.ack_timeout,
+                poll_interval=self.ack_poll_interval,
+                name='splunkpub-ack-poller')
+            self.ack_tracker.start()
+
+        self.retry_scheduler = None
+        if self.retry_count > 0 and start_threads:
+            self.retry_scheduler = RetryScheduler(
+                send_func=self.retry_payload,
+                max_pending=self.retry_max_pending,
+                name='splunkpub-retry')
+
+        self.spool = None
+        # records that did not fit in the queue wait here for the
+        # worker to spool them in batches
+        self.overflow = []
+        self.overflow_bytes = 0
+        self.overflow_lock = threading.Lock()
+        if self.spool_dir and start_threads:
+            self.spool = DiskSpool(
+                spool_dir=self.spool_dir,
+                send_func=self.replay_payload,
+                max_bytes=self.spool_max_bytes,
+                segment_bytes=self.spool_segment_bytes,
+                replay_interval=self.spool_replay_interval,
+                name='splunkpub-spool-replay')
+            # replay what exited forked children left behind
+            self.spool.adopt_orphans(
+                base_dir=self.base_spool_dir)
+            self.spool.start()
+
+        self.start_worker_thread(
+            sleep_interval=self.sleep_interval)
+    # end of start_runtime
+
+    def after_fork_in_child(
+            self):
+        """after_fork_in_child
+
+        Runs in a forked child process from ``os.register_at_fork``.
+        A lock held by another parent thread during the fork stays
+        held in the child so only the restart lock is replaced -
+        ``check_pid`` restarts the publisher on the child's first log.
+        """
+        self.fork_lock = threading.Lock()
+    # end of after_fork_in_child
+
+    def check_pid(
+            self):
+        """check_pid
+
+        Restart the publisher if this is the first log
+        in a forked child process
+        """
+        if self.runtime_pid == os.getpid():
+            return
+        with self.fork_lock:
+            if self.runtime_pid != os.getpid():
+                self.restart_in_child()
+    # end of check_pid
+
+    def restart_in_child(
+            self):
+        """restart_in_child
+
+        Give a forked child process its own queue, session and
+        worker thread so it batches its logs without any IPC. The
+        child drops its copy of the parent's queued logs, the
+        sockets, locks and manager proxies it inherited and the
+        thread objects that did not survive the fork - the parent
+        keeps sending its own logs. A generated HEC channel and the
+        spool directory are made unique to the child. Only a
+        ``QueueManager`` server process sends each log from ``emit``
+        without a manager or threads so it never starts another
+        manager.
+        """
+        if self.shutdown_now:
+            self.runtime_pid = os.getpid()
+            return
+        if self.channel_generated:
+            self.channel = str(uuid.uuid4())
+            self.build_urls()
+        if self.base_spool_dir:
+            self.spool_dir = os.path.join(
+                self.base_spool_dir,
+                'pid-{}'.format(
+                    os.getpid()))
+        # the manager process belongs to the parent
+        self.manager = None
+        self.start_runtime(
+            start_threads=not in_manager_server())
+        self.debug_log(
+            'restarted after fork pid={}'.format(
+                os.getpid()))
+    # end of restart_in_child
+
     def emit(
             self,
             record):
@@ -321,6 +885,7 @@ class SplunkPublisher(logging.Handler):
 
         self.debug_log('emit')
 
+        levelno = record.levelno
         try:
             record = self.format_record(
                 record)
@@ -331,12 +896,43 @@ class SplunkPublisher(logging.Handler):
                 traceback.format_exc())
             return
 
+        self.enqueue(
+            record=record,
+            levelno=levelno)
+    # end of emit
+
+    def enqueue(
+            self,
+            record,
+            levelno=logging.INFO):
+        """enqueue
+
+        Queue a formatted record for the worker thread or send it
+        right away if the publisher has no worker. The
+        ``LogForwarder`` daemon calls this with the pre-encoded
+        events it receives from ``ForwarderPublisher`` handlers.
+
+        :param record: formatted record as a ``str`` or ``bytes``
+        :param levelno: logging level number of the record
+        """
+        self.check_pid()
         if self.sleep_interval > 0:
             try:
                 self.debug_log('put in queue')
+                if self.priority_lanes and levelno >= self.priority_levelno:
+                    # wake the worker if it is sleeping between batches
+                    self.flush_event.set()
                 # Put log message into queue; worker thread will pick up
-                self.queue.put_nowait(
-                    record)
+                if not self.queue.offer(
+                        record,
+                        levelno):
+                    if self.add_overflow(
+                            record=record):
+                        self.debug_log(
+                            'log queue full - spooling to disk')
+                    else:
+                        self.queue.record_drop(
+                            record)
             except Exception:
                 self.write_log(
                     'log queue full - log data will be dropped.')
@@ -344,28 +940,95 @@ class SplunkPublisher(logging.Handler):
             # Flush log immediately; is blocking call
             self.publish_to_splunk(
                 payload=record)
-    # end of emit
+    # end of enqueue
+
+    def add_overflow(
+            self,
+            record):
+        """add_overflow
+
+        Hold a record that did not fit in the queue for the worker
+        to spool and return False if there is no spool or the
+        records waiting to be spooled already fill a spool segment
+
+        :param record: formatted record as a ``str`` or ``bytes``
+        """
+        if self.spool is None:
+            return False
+        with self.overflow_lock:
+            if (self.overflow
+                    and self.overflow_bytes + len(record)
+                    > self.spool_segment_bytes):
+                return False
+            self.overflow.append(record)
+            self.overflow_bytes += len(record)
+        return True
+    # end of add_overflow
+
+    def spool_overflow(
+            self):
+        """spool_overflow
+
+        Spool the records that did not fit in the queue as batches
+        with one fsync so callers never wait on the disk. Records the
+        spool cannot take are counted as dropped. Returns the number
+        of spooled records.
+        """
+        with self.overflow_lock:
+            records = self.overflow
+            if not records:
+                return 0
+            self.overflow = []
+            self.overflow_bytes = 0
+        batches = []
+        for record in records:
+            if not batches or batches[-1].is_full():
+                batches.append(BatchBuilder(
+                    max_bytes=self.max_batch_bytes,
+                    max_events=self.max_batch_events))
+            batches[-1].add(
+                record)
+        # end of for all overflow records
+        num_spooled = self.spool.append_many(
+            payloads=[
+                batch.getvalue()
+                for batch in batches
+            ])
+        for batch in batches[num_spooled:]:
+            for chunk in batch.chunks:
+                self.queue.record_drop(
+                    chunk)
+        num_records = sum(
+            len(batch)
+            for batch in batches[:num_spooled])
+        self.debug_log(
+            'spooled overflow records={} batches={}'.format(
+                num_records,
+                num_spooled))
+        return num_records
+    # end of spool_overflow
 
     def start_worker_thread(
             self,
             sleep_interval=1.0):
         """start_worker_thread
 
-        Start the helper worker thread to publish queued messages
-        to Splunk
+        Start the long-lived helper worker thread that publishes
+        queued messages to Splunk until ``shutdown``
 
-        :param sleep_interval: sleep in seconds before reading from
-                               the queue again
+        :param sleep_interval: kept for compatibility - the worker
+                               blocks on the queue until the first
+                               message arrives
         """
         # Start a worker thread responsible for sending logs
         if self.sleep_interval > 0:
             self.debug_log(
                 'starting worker thread')
-            self.timer = Timer(
-                sleep_interval,
-                self.perform_work)
-            self.timer.daemon = True  # Auto-kill thread if main process exits
-            self.timer.start()
+            self.worker = threading.Thread(
+                target=self.perform_work,
+                name='splunkpub-worker')
+            self.worker.daemon = True  # Auto-kill thread if main process exits
+            self.worker.start()
     # end of start_worker_thread
 
     def write_log(
@@ -414,25 +1077,21 @@ class SplunkPublisher(logging.Handler):
         """
         self.debug_log('format_record - start')
 
-        if self.source is None:
-            source = record.pathname
-        else:
-            source = self.source
-
-        current_time = time.time()
-
-        params = {
-            'time': current_time,
-            'host': self.hostname,
-            'index': self.index,
-            'source': source,
-            'sourcetype': self.sourcetype,
-            'event': self.format(record),
-        }
-
-        self.debug_log('record dictionary created')
-
-        formatted_record = json.dumps(params, sort_keys=True)
+        if self.endpoint == HEC_ENDPOINT_RAW:
+            # the raw endpoint reads the metadata from the url
+            return '{}\n'.format(
+                self.format(record))
+
+        formatted_record = self.envelope.encode(
+            event=encode_event(
+                handler=self,
+                record=record,
+                event_format=self.event_format),
+            created=record.created,
+            source=record.pathname,
+            encoded=True,
+            fields=self.get_fields(
+                record))
 
         self.debug_log('format_record - done')
 
@@ -446,7 +1105,7 @@ class SplunkPublisher(logging.Handler):
             triggered_by_shutdown=False):
         """build_payload_from_queued_messages
 
-        Empty the queued messages by building a large ``self.log_payload``
+        Empty the queued messages by building a large ``self.batch``
 
         :param use_queue: queue holding the messages
         :param shutdown_event: shutdown event
@@ -470,16 +1129,39 @@ class SplunkPublisher(logging.Handler):
                     self.tid,
                     str(use_queue)))
             try:
-                msg = use_queue.get(
-                    block=True,
-                    timeout=self.sleep_interval)
-                self.log_payload = self.log_payload + msg
-                if self.debug:
-                    self.debug_log('{} got={}'.format(
-                        self,
-                        ppj(msg)))
-                not_done = not self.queue_empty(
+                # a shutdown or flush reads until the queue is empty
+                draining = triggered_by_shutdown or self.flush_pending()
+                read_timeout = self.get_read_timeout(
                     use_queue=use_queue)
+                if draining:
+                    read_timeout = 0
+                priority, msgs = self.read_queue(
+                    use_queue=use_queue,
+                    timeout=read_timeout)
+                if msgs:
+                    self.fill_batch(
+                        priority=priority,
+                        msgs=msgs)
+                    if self.debug:
+                        self.debug_log('{} got={}'.format(
+                            self,
+                            len(msgs)))
+                    if draining:
+                        not_done = True
+                    elif self.batch.linger_ms > 0:
+                        not_done = self.batch.linger_remaining() > 0
+                    else:
+                        # everything queued was read in one call
+                        not_done = False
+                elif draining or (
+                        len(self.batch) > 0
+                        and self.batch.linger_remaining() <= 0):
+                    # nothing arrived before the timeout so send
+                    # what is in the batch once it has lingered
+                    not_done = False
+                elif read_timeout is not None and len(self.batch) == 0:
+                    # an idle queue's drop report is due
+                    not_done = False
             except Exception as e:
                 if self.is_shutting_down(
                         shutdown_event=shutdown_event):
@@ -502,12 +1184,11 @@ class SplunkPublisher(logging.Handler):
                     'build_payload - already shutting down')
                 return True
 
-            # If the payload is getting very long,
-            # stop reading and send immediately.
-            # Current limit is 50MB
+            # If the payload hit the max_batch_bytes or
+            # max_batch_events limit, stop reading and send immediately.
             if (not triggered_by_shutdown and self.is_shutting_down(
                     shutdown_event=shutdown_event)
-                    or len(self.log_payload) >= 524288):
+                    or self.batch.is_full()):
                 self.debug_log(
                     'payload maximum size exceeded, sending immediately')
                 return False
@@ -521,11 +1202,12 @@ class SplunkPublisher(logging.Handler):
             self):
         """perform_work
 
-        Process handler function for processing messages
-        found in the ``multiprocessing.Manager.queue``
+        Worker thread loop for processing messages
+        found in the ``self.queue``
 
-        Build the ``self.log_payload`` from the queued log messages
-        and POST it to the Splunk endpoint
+        Build the ``self.batch`` from the queued log messages and
+        POST it to the Splunk endpoint until ``shutdown`` and then
+        publish the remaining messages with ``drain``
 
         """
 
@@ -534,29 +1216,22 @@ class SplunkPublisher(logging.Handler):
 
         self.tid = threading.current_thread().ident
 
-        if self.sleep_interval > 0:
-            # Stop the timer. Happens automatically if this is called
-            # via the timer, does not if invoked by force_flush()
-            if self.timer:
-                self.timer.cancel()
-            else:
-                self.debug_log((
-                    'perform_work - done - timer was destroyed'))
-                return
-
         self.debug_log((
             'perform_work - ready tid={}').format(
                 self.tid))
 
         try:
 
-            not_done = not self.is_shutting_down(
-                shutdown_event=self.shutdown_event)
-
-            while not_done:
+            while not self.is_shutting_down(
+                    shutdown_event=self.shutdown_event):
 
+                # a flush requested before this batch is done
+                # once the queue was drained
+                flush_seq = self.flush_requested
                 try:
-                    self.build_payload_from_queued_messages(
+                    self.plan_batch(
+                        use_queue=self.queue)
+                    queue_drained = self.build_payload_from_queued_messages(
                         use_queue=self.queue,
                         shutdown_event=self.shutdown_event)
                 except Exception as e:
@@ -569,63 +1244,107 @@ class SplunkPublisher(logging.Handler):
                             'perform_work - done - '
                             'Exception shutting down with ex={}').format(
                                 e))
-                        self.shutdown()
-                    self.already_done.set()
-                    return
+                    break
                 # end of try to return if the queue
 
+                self.add_drop_report(
+                    use_queue=self.queue)
                 self.publish_to_splunk()
-                timer_interval = self.sleep_interval
+                self.spool_overflow()
+                if queue_drained:
+                    self.finish_flush(
+                        flush_seq=flush_seq)
 
-                if not_done:
-                    if self.is_shutting_down(
-                            shutdown_event=self.shutdown_event):
-                        self.debug_log(
-                            'perform_work - done - shutdown detected')
-                        self.already_done.set()
-                        return
-                    # check if done
-                    else:
-                        if self.num_sent > 0:
-                            # run again if queue was not cleared
-                            timer_interval = 0.5
-                            self.debug_log(
-                                'queue not empty - run again')
-                        else:
-                            self.debug_log(
-                                'sleep={}s'.format(
-                                    timer_interval))
-                        time.sleep(timer_interval)
-                # end of checking if this should run again or is shutting down
+                if self.is_shutting_down(
+                        shutdown_event=self.shutdown_event):
+                    self.debug_log(
+                        'perform_work - done - shutdown detected')
+                    break
 
+                timer_interval = self.sleep_interval
+                if not queue_drained:
+                    # the batch hit a limit so send the next one
+                    timer_interval = 0
+                    self.debug_log(
+                        'batch limit reached - run again')
+                elif self.flush_pending():
+                    timer_interval = 0
+                    self.debug_log(
+                        'flush requested - run again')
+                elif self.scheduler is not None:
+                    # the scheduler's linger replaces the sleep
+                    timer_interval = 0
+                    self.debug_log(
+                        'adaptive flush - run again')
+                elif self.num_sent > 0:
+                    # run again if queue was not cleared
+                    timer_interval = 0.5
+                    self.debug_log(
+                        'queue not empty - run again')
+                else:
+                    self.debug_log(
+                        'sleep={}s'.format(
+                            timer_interval))
+                # a priority log, flush or shutdown ends the sleep early
+                self.flush_event.wait(timer_interval)
+                self.flush_event.clear()
             # end of while not done
 
         except Exception as e:
-            if self.is_shutting_down(
-                    shutdown_event=self.shutdown_event):
-                self.debug_log((
-                    'perform_work - shutdown sent={}').format(
-                        self.num_sent))
-            else:
-                self.debug_log((
-                    'perform_work - ex={}').format(
-                        e))
+            self.debug_log((
+                'perform_work - ex={}').format(
+                    e))
         # end of try/ex
 
-        self.already_done.set()
+        self.drain()
 
         self.debug_log((
             'EXIT - perform_work - done - tid={}').format(
                 self.tid))
     # end of perform_work
 
+    def drain(
+            self):
+        """drain
+
+        Publish the messages left in the ``self.queue`` and
+        move the worker to the stopped state
+        """
+        with self.state_lock:
+            self.state = WORKER_DRAINING
+        self.debug_log(
+            'drain - publishing remaining logs')
+        drained = False
+        try:
+            while not drained:
+                drained = self.build_payload_from_queued_messages(
+                    use_queue=self.queue,
+                    shutdown_event=self.shutdown_event,
+                    triggered_by_shutdown=True)
+                self.publish_to_splunk()
+            self.spool_overflow()
+        except Exception as e:
+            self.write_log((
+                'shutdown - failed to publish the remaining '
+                'messages in queue with ex={}').format(
+                    e))
+        with self.state_lock:
+            self.state = WORKER_STOPPED
+            if drained:
+                self.flush_done = self.flush_requested
+            self.state_lock.notify_all()
+        self.already_done.set()
+    # end of drain
+
     def publish_to_splunk(
             self,
             payload=None):
         """publish_to_splunk
 
-        Build the ``self.log_payload`` from the queued log messages
-        and POST it to the Splunk endpoint
+        Send the ``self.batch`` built from the queued log messages
+        to the Splunk endpoint. With ``max_inflight`` above 1 the batch
+        is handed to the ``self.sender_pool`` so the worker can keep
+        building the next batch while this one is in flight.
 
         :param payload: string message to send to Splunk
         """
@@ -633,55 +1352,26 @@ class SplunkPublisher(logging.Handler):
 
         use_payload = payload
         if not use_payload:
-            use_payload = self.log_payload
+            use_payload = self.batch.getvalue()
 
         self.num_sent = 0
 
         if use_payload:
-            url = 'https://{}:{}/services/collector'.format(
-                self.host,
-                self.port)
-            self.debug_log('splunk url={}'.format(
-                url))
-
-            try:
-                if self.debug:
-                    try:
-                        msg_dict = json.loads(use_payload)
-                        event_data = json.loads(msg_dict['event'])
-                        msg_dict['event'] = event_data
-                        self.debug_log((
-                            'sending payload: {}').format(
-                                ppj(msg_dict)))
-                    except Exception:
-                        self.debug_log((
-                            'sending data payload: {}').format(
-                                use_payload))
-                if self.num_sent > 100000:
-                    self.num_sent = 1
-                else:
-                    self.num_sent += 1
-                send_to_splunk.send_to_splunk(
-                    session=self.session,
-                    url=url,
-                    data=use_payload,
-                    headers={'Authorization': 'Splunk {}'.format(
-                        self.token)},
-                    verify=self.verify,
-                    timeout=self.timeout)
-                self.debug_log('payload sent success')
-            except Exception as e:
-                try:
-                    self.write_log(
-                        'Exception in Splunk logging handler: {}'.format(
-                            e))
-                    self.write_log(traceback.format_exc())
-                except Exception:
-                    self.debug_log(
-                        'Exception encountered,'
-                        'but traceback could not be formatted')
-
-            self.log_payload = ''
+            if self.num_sent > 100000:
+                self.num_sent = 1
+            else:
+                self.num_sent += 1
+            if self.scheduler is not None:
+                self.scheduler.record_batch(
+                    num_records=len(self.batch),
+                    num_bytes=self.batch.num_bytes)
+            self.batch.reset()
+            if self.sender_pool:
+                self.sender_pool.submit(
+                    payload=use_payload)
+            else:
+                self.send_payload(
+                    payload=use_payload)
         else:
             self.debug_log(
                 'no logs to send')
@@ -693,6 +1383,29 @@ class SplunkPublisher(logging.Handler):
                 self.shutdown_now))
     # end of publish_to_splunk
 
+    def get_stats(
+            self):
+        """get_stats
+
+        Return the batch limits, adaptive flush decisions, HEC
+        latency, circuit breaker state, queue depth and worker
+        state as a dictionary
+        """
+        stats = {
+            'adaptive_flush': self.adaptive_flush,
+            'linger_ms': self.batch.linger_ms,
+            'batch_bytes': self.batch.max_bytes,
+            'depth': self.queue.qsize(),
+            'state': self.state
+        }
+        stats.update(
+            self.get_retry_stats())
+        if self.scheduler is not None:
+            stats.update(
+                self.scheduler.stats())
+        return stats
+    # end of get_stats
+
     def queue_empty(
             self,
             use_queue):
@@ -706,13 +1419,91 @@ class SplunkPublisher(logging.Handler):
             return use_queue.qsize() == 0
     # end of queue_empty
 
+    def flush_pending(
+            self):
+        """flush_pending
+
+        Return True if a ``flush`` is waiting on the worker
+        """
+        return self.flush_requested > self.flush_done
+    # end of flush_pending
+
+    def finish_flush(
+            self,
+            flush_seq):
+        """finish_flush
+
+        Release the ``flush`` callers up to ``flush_seq`` after
+        the worker drained the queue
+
+        :param flush_seq: last flush request handled
+        """
+        with self.state_lock:
+            if flush_seq > self.flush_done:
+                self.flush_done = flush_seq
+                self.state_lock.notify_all()
+    # end of finish_flush
+
+    def flush(
+            self,
+            timeout=None):
+        """flush
+
+        Hand a flush to the worker thread and wait until every log
+        queued before this call was sent. Returns True if they were
+        sent within ``timeout`` seconds. Safe to call from any thread
+        and from ``logging.shutdown``.
+
+        :param timeout: seconds to wait with None waiting forever
+        """
+        if self.runtime_pid != os.getpid():
+            # a forked child that never logged has nothing to flush
+            return True
+        end_time = None
+        if timeout is not None:
+            end_time = time.time() + timeout
+        if self.worker is None:
+            # without a worker emit already published the logs
+            done = True
+        elif self.worker is threading.current_thread():
+            # the worker cannot wait on itself
+            return False
+        elif self.state == WORKER_STOPPED:
+            done = self.queue_empty(
+                use_queue=self.queue)
+        else:
+            with self.state_lock:
+                self.flush_requested += 1
+                flush_seq = self.flush_requested
+            self.flush_event.set()
+            self.queue.wake()
+            with self.state_lock:
+                while (self.flush_done < flush_seq
+                        and self.state != WORKER_STOPPED):
+                    remaining = None
+                    if end_time is not None:
+                        remaining = end_time - time.time()
+                        if remaining <= 0:
+                            break
+                    self.state_lock.wait(remaining)
+                done = self.flush_done >= flush_seq
+        if done and self.sender_pool:
+            remaining = None
+            if end_time is not None:
+                remaining = max(0, end_time - time.time())
+            done = self.sender_pool.wait_idle(
+                timeout=remaining)
+        return done
+    # end of flush
+
     def force_flush(
             self):
         """force_flush
+
         Flush the queue and publish everything to Splunk
         """
         self.debug_log('force flush - start')
-        self.publish_to_splunk()
+        self.flush()
         self.debug_log('force flush - done')
     # end of force_flush
 
@@ -744,50 +1535,77 @@ class SplunkPublisher(logging.Handler):
 
     def shutdown(
             self):
-        """shutdown"""
+        """shutdown
+
+        Stop the worker thread once it published the queued logs
+        and then stop the sender pool, ack tracker and spool. Only
+        the first call shuts down.
+        """
         self.debug_log('shutdown - start')
 
-        # Only initiate shutdown once
-        if not self.shutdown_now:
-            self.debug_log('shutdown - still shutting down')
-            # Cancels the scheduled Timer, allows exit immediately
-            if self.timer:
-                self.timer.cancel()
-                self.timer = None
+        if self.runtime_pid != os.getpid():
+            # a forked child that never logged owns no worker or threads
+            self.shutdown_now = True
+            self.debug_log('shutdown - done - never started in this pid')
             return
-        else:
+
+        with self.state_lock:
+            if self.shutdown_now:
+                self.debug_log('shutdown - already shutting down')
+                return
             self.debug_log('shutdown - start - setting instance shutdown')
             self.shutdown_now = True
-            self.shutdown_event.set()
-        # if/else already shutting down
-
-        # Cancels the scheduled Timer, allows exit immediately
-        self.timer.cancel()
-        self.timer = None
-
-        self.debug_log(
-            'shutdown - publishing remaining logs')
-
-        if self.sleep_interval > 0:
-            try:
-                self.build_payload_from_queued_messages(
-                    use_queue=self.queue,
-                    shutdown_event=self.shutdown_event,
-                    triggered_by_shutdown=True)
-            except Exception as e:
-                self.write_log((
-                    'shutdown - failed to build a payload for remaining '
-                    'messages in queue Exception shutting down '
-                    'with ex={}').format(
-                    e))
+            if self.state == WORKER_RUNNING:
+                self.state = WORKER_DRAINING
+            if self.worker is None:
+                self.state = WORKER_STOPPED
+            self.state_lock.notify_all()
+        # end of only shutting down once
+
+        self.shutdown_event.set()
+        # wake the worker if it is sleeping or waiting for the first log
+        self.flush_event.set()
+        self.queue.wake()
+
+        if (self.worker is not None
+                and self.worker is not threading.current_thread()):
+            self.debug_log(
+                'shutdown - waiting for the worker to publish remaining logs')
+            self.worker.join()
 
+        if self.sender_pool:
             self.debug_log(
-                'publishing remaining logs')
+                'shutdown - waiting for in-flight batches')
+            self.sender_pool.stop(
+                timeout=self.timeout)
 
-            # Send the remaining items in the queue
-            self.publish_to_splunk()
-        # end of try to publish remaining messages in the queue
-        # during shutdown
+        if self.ack_tracker is not None:
+            self.debug_log(
+                'shutdown - stopping ack tracker pending={}'.format(
+                    len(self.ack_tracker)))
+            self.keep_unsent(
+                payloads=self.ack_tracker.stop(
+                    timeout=self.timeout),
+                reason='not acknowledged by HEC')
+
+        if self.retry_scheduler is not None:
+            payloads = self.retry_scheduler.stop(
+                timeout=self.timeout)
+            self.debug_log(
+                'shutdown - stopped retry scheduler pending={}'.format(
+                    len(payloads)))
+            self.keep_unsent(
+                payloads=payloads,
+                reason='waiting for a retry')
+
+        if self.spool is not None:
+            # records that overflowed after the worker stopped
+            self.spool_overflow()
+            self.debug_log(
+                'shutdown - stopping spool bytes={}'.format(
+                    len(self.spool)))
+            self.spool.stop(
+                timeout=self.timeout)
 
         self.debug_log('shutdown - done')
     # end of shutdown
@@ -0,0 +1,100 @@
+"""
+Cached log timestamps
+
+Formatting a log's time with ``strftime`` for every log is measurable
+CPU at high log rates. A ``TimestampCache`` formats a log's
+``record.created`` by rendering everything down to the second once per
+second and only formatting the microseconds for each log. The output
+matches ``datetime.datetime.fromtimestamp(created).strftime(fmt)``
+(or ``utcfromtimestamp`` with ``utc=True``).
+"""
+
+import datetime
+import re
+
+
+ISO_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# %f outside of an escaped %%
+MICROSECONDS = re.compile(
+    r'(?<!%)((?:%%)*)%f')
+
+
+class TimestampCache(object):
+    """
+    Format log times with a cached second-resolution prefix
+    """
+
+    def __init__(
+            self,
+            fmt=ISO_TIMESTAMP_FORMAT,
+            utc=False):
+        """__init__
+
+        :param fmt: ``strftime`` format
+        :param utc: format in UTC instead of local time
+        """
+        self.fmt = fmt
+        self.utc = utc
+        # strftime formats between each %f
+        self.parts = []
+        start = 0
+        for match in MICROSECONDS.finditer(self.fmt):
+            # keep the escaped %% before the %f with the prefix
+            self.parts.append(
+                self.fmt[start:match.end(1)])
+            start = match.end()
+        self.parts.append(
+            self.fmt[start:])
+        # (second, formatted parts) swapped as one value for threads
+        self.cached = (None, None)
+    # end of __init__
+
+    def format_second(
+            self,
+            second):
+        """format_second
+
+        Return the formatted parts between each ``%f`` for a second
+
+        :param second: whole seconds since the epoch
+        """
+        if self.utc:
+            when = datetime.datetime.utcfromtimestamp(
+                second)
+        else:
+            when = datetime.datetime.fromtimestamp(
+                second)
+        return [
+            when.strftime(part)
+            for part in self.parts
+        ]
+    # end of format_second
+
+    def format(
+            self,
+            created):
+        """format
+
+        Return the formatted time for a log
+
+        :param created: log time in seconds since
+                        the epoch like ``record.created``
+        """
+        second = int(created)
+        # round like datetime.fromtimestamp - python 2 rounds to a float
+        microsecond = int(round((created - second) * 1e6))
+        if microsecond >= 1000000:
+            second += 1
+            microsecond -= 1000000
+        cached_second, parts = self.cached
+        if cached_second != second:
+            parts = self.format_second(
+                second)
+            self.cached = (second, parts)
+        if len(parts) == 1:
+            return parts[0]
+        return '{:06d}'.format(microsecond).join(parts)
+    # end of format
+
+# end of TimestampCache
@@ -0,0 +1,210 @@
+import os
+import json
+import logging
+import shutil
+import socket
+import stat
+import tempfile
+import time
+import unittest
+from spylunking.forwarder_publisher import ForwarderPublisher
+from spylunking.forwarder_publisher import build_frame
+from spylunking.forwarder_publisher import parse_frame
+from spylunking.log_forwarder import LogForwarder
+from spylunking.log.setup_logging import SplunkFormatter
+from spylunking.consts import SPLUNK_INDEX
+from spylunking.consts import SPLUNK_HOSTNAME
+
+
+class RecordingPublisher(object):
+    """
+    Stand-in for the forwarder's ``SplunkPublisher``
+    """
+
+    def __init__(
+            self):
+        """__init__"""
+        self.events = []
+    # end of __init__
+
+    def enqueue(
+            self,
+            record,
+            levelno=logging.INFO):
+        """enqueue
+
+        :param record: HEC event
+        :param levelno: logging level number
+        """
+        self.events.append((levelno, record))
+    # end of enqueue
+
+    def get_stats(
+            self):
+        """get_stats"""
+        return {}
+    # end of get_stats
+
+    def flush(
+            self,
+            timeout=None):
+        """flush
+
+        :param timeout: seconds to wait
+        """
+        return True
+    # end of flush
+
+    def shutdown(
+            self):
+        """shutdown"""
+        return
+    # end of shutdown
+
+# end of RecordingPublisher
+
+
+class TestForwarderPublisher(unittest.TestCase):
+    """TestForwarderPublisher"""
+
+    def setUp(self):
+        """setUp"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(
+            self.tmp_dir,
+            'forwarder.sock')
+    # end of setUp
+
+    def tearDown(self):
+        """tearDown"""
+        shutil.rmtree(
+            self.tmp_dir,
+            ignore_errors=True)
+    # end of tearDown
+
+    def test_frames(self):
+        """test_frames"""
+        frame = b''.join(build_frame(
+            event='{"event": "hello"}',
+            levelno=logging.ERROR))
+        self.assertEqual(
+            frame,
+            b'40 {"event": "hello"}\n')
+        self.assertEqual(
+            parse_frame(frame),
+            (logging.ERROR, b'{"event": "hello"}'))
+        # frames from other tools have no level number
+        self.assertEqual(
+            parse_frame(b'{"event": "hello"}\n'),
+            (logging.INFO, b'{"event": "hello"}'))
+    # end of test_frames
+
+    def test_forward_stream_and_dgram(self):
+        """test_forward_stream_and_dgram"""
+        for socket_type in ['stream', 'dgram']:
+            publisher = RecordingPublisher()
+            forwarder = LogForwarder(
+                socket_path=self.socket_path,
+                socket_type=socket_type,
+                poll_interval=0.05,
+                publisher=publisher)
+            forwarder.start()
+            handler = ForwarderPublisher(
+                socket_path=self.socket_path,
+                socket_type=socket_type,
+                index=SPLUNK_INDEX,
+                hostname=SPLUNK_HOSTNAME)
+            handler.formatter = SplunkFormatter()
+            log = logging.getLogger(
+                'test-forwarder-{}'.format(
+                    socket_type))
+            log.propagate = False
+            log.setLevel(logging.INFO)
+            log.addHandler(handler)
+            log.info('first')
+            log.error('second')
+
+            end_time = time.time() + 5.0
+            while len(publisher.events) < 2 and time.time() < end_time:
+                time.sleep(0.01)
+            log.removeHandler(handler)
+            handler.close()
+            forwarder.stop(
+                timeout=5.0)
+
+            self.assertEqual(
+                [levelno for levelno, event in publisher.events],
+                [logging.INFO, logging.ERROR])
+            event = json.loads(
+                publisher.events[1][1].decode('utf-8'))
+            self.assertEqual(
+                event['index'],
+                SPLUNK_INDEX)
+            self.assertEqual(
+                json.loads(event['event'])['message'],
+                'second')
+            self.assertEqual(
+                handler.get_stats()['dropped'],
+                0)
+            self.assertFalse(
+                os.path.exists(self.socket_path))
+        # end of for all socket types
+    # end of test_forward_stream_and_dgram
+
+    def test_stream_frame_limits(self):
+        """test_stream_frame_limits"""
+        publisher = RecordingPublisher()
+        forwarder = LogForwarder(
+            socket_path=self.socket_path,
+            socket_type='stream',
+            max_event_bytes=32,
+            poll_interval=0.05,
+            publisher=publisher)
+        forwarder.start()
+        self.assertEqual(
+            stat.S_IMODE(os.stat(self.socket_path).st_mode),
+            0o660)
+        client = socket.socket(
+            socket.AF_UNIX,
+            socket.SOCK_STREAM)
+        client.connect(
+            self.socket_path)
+        # an oversized frame and the partial frame at the close
+        # are dropped without losing the frames around them
+        client.sendall(
+            b'20 first\n'
+            + b'20 ' + b'x' * 64 + b'\n'
+            + b'40 second\n'
+            + b'40 partial')
+        client.close()
+
+        end_time = time.time() + 5.0
+        while (forwarder.get_stats()['dropped_frames'] < 2
+                and time.time() < end_time):
+            time.sleep(0.01)
+        forwarder.stop(
+            timeout=5.0)
+        self.assertEqual(
+            publisher.events,
+            [
+                (logging.INFO, b'first'),
+                (logging.ERROR, b'second')
+            ])
+        self.assertEqual(
+            forwarder.get_stats()['dropped_frames'],
+            2)
+    # end of test_stream_frame_limits
+
+    def test_daemon_down_drops(self):
+        """test_daemon_down_drops"""
+        handler = ForwarderPublisher(
+            socket_path=self.socket_path)
+        self.assertFalse(
+            handler.send_event(
+                event='{"event": "lost"}'))
+        self.assertEqual(
+            handler.get_stats()['dropped'],
+            1)
+    # end of test_daemon_down_drops
+
+# end of TestForwarderPublisher
@@ -2,8 +2,17 @@
 Testing Logger Methods
 """
 import os
+import datetime
+import json
+import logging
+import uuid
 import mock
 from spylunking.log.setup_logging import build_colorized_logger
+from spylunking.log.setup_logging import SplunkFormatter
+from spylunking.json_encoder import JSON_ENCODERS
+from spylunking.json_encoder import JsonEncoder
+from spylunking.json_encoder import json_default
+from spylunking.timestamp_cache import TimestampCache
 from tests.base_test import BaseTestCase
 from tests.mock_utils import mock_get_token
 from tests.mock_utils import mock_post_request
@@ -60,4 +69,119 @@ class TestLogger(BaseTestCase):
         self.assertIsNotNone(log)
     # end of test_build_colorized_logger_without_splunk
 
+    def test_json_encoders(
+            self):
+        """test_json_encoders"""
+        record = logging.LogRecord(
+            name='test-json-encoders',
+            level=logging.ERROR,
+            pathname=__file__,
+            lineno=1,
+            msg='encoded \u00e9',
+            args=None,
+            exc_info=None)
+        record.deployed = datetime.datetime(2018, 1, 2, 3, 4, 5, 6)
+        record.error = ValueError('bad value')
+        record.request_id = uuid.UUID(int=1)
+        record.big = 2 ** 70
+        encoded = {}
+        for name in JSON_ENCODERS:
+            formatter = SplunkFormatter(
+                json_encoder=name)
+            log_record = json.loads(
+                formatter.format(record))
+            log_record.pop('timestamp')
+            log_record.pop('asctime')
+            encoded[JsonEncoder(name).name] = log_record
+        # end of for all installed encoders
+        expected = encoded['json']
+        self.assertEqual(
+            expected['deployed'],
+            '2018-01-02T03:04:05.000006')
+        self.assertEqual(
+            expected['error'],
+            'ValueError: bad value')
+        self.assertEqual(
+            expected['request_id'],
+            str(uuid.UUID(int=1)))
+        self.assertEqual(
+            expected['big'],
+            2 ** 70)
+        for name in encoded:
+            self.assertEqual(
+                encoded[name],
+                expected,
+                name)
+        # a json.JSONEncoder class keeps the python-json-logger encoding
+        self.assertIsNone(
+            SplunkFormatter(
+                json_encoder=json.JSONEncoder).encoder)
+        with self.assertRaises(ValueError):
+            JsonEncoder(
+                name='not-an-encoder')
+        # pythons without dataclasses or enum fall back to str
+        with mock.patch('spylunking.json_encoder.dataclasses', None), \
+                mock.patch('spylunking.json_encoder.enum', None):
+            self.assertEqual(
+                json_default(record.error),
+                'ValueError: bad value')
+            self.assertEqual(
+                json_default(record),
+                str(record))
+    # end of test_json_encoders
+
+    def test_timestamps_from_created(
+            self):
+        """test_timestamps_from_created"""
+        record = logging.LogRecord(
+            name='test-timestamps',
+            level=logging.INFO,
+            pathname=__file__,
+            lineno=1,
+            msg='timestamps',
+            args=None,
+            exc_info=None)
+        # rounds up into the next second like datetime does
+        record.created = 1514862245.9999996
+        utc_created = datetime.datetime.utcfromtimestamp(
+            record.created)
+        local_created = datetime.datetime.fromtimestamp(
+            record.created)
+        for datefmt in [None, '%d/%m/%Y %H:%M:%S.%f %%f']:
+            formatter = SplunkFormatter(
+                datefmt=datefmt)
+            # the second pass uses the cached second
+            for _ in range(2):
+                log_record = json.loads(
+                    formatter.format(record))
+                self.assertEqual(
+                    log_record['timestamp'],
+                    utc_created.strftime('%Y-%m-%dT%H:%M:%S.%fZ'))
+                self.assertEqual(
+                    log_record['timestamp'],
+                    '2018-01-02T03:04:06.000000Z')
+                self.assertEqual(
+                    log_record['asctime'],
+                    local_created.strftime(
+                        datefmt or '%Y:%m:%d %H:%M:%S.%f'))
+            # end of for cached and uncached seconds
+        # end of for all date formats
+        log_record = {}
+        formatter.add_fields(
+            log_record,
+            record,
+            {})
+        self.assertEqual(
+            log_record['timestamp'],
+            '2018-01-02T03:04:06.000000Z')
+        # python 2 round returns a float
+        with mock.patch(
+                'spylunking.timestamp_cache.round',
+                create=True,
+                side_effect=lambda value: float(int(value + 0.5))):
+            self.assertEqual(
+                TimestampCache(utc=True).format(1514862245.25),
+                '2018-01-02T03:04:05.250000Z')
+    # end of test_timestamps_from_created
+
 # end of TestLogger
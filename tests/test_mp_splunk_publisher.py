@@ -1,11 +1,17 @@
 import os
 import logging
+import multiprocessing
+import threading
+import time
 import unittest
 import mock
 import json
 import uuid
 from tests.mock_utils import MockRequest
 from spylunking.mp_splunk_publisher import MPSplunkPublisher
+from spylunking.shm_ring import SHM_SUPPORTED
+from spylunking.shm_ring import ShmRingQueue
+from spylunking.shm_ring import ShmEvent
 from spylunking.consts import SPLUNK_HOST
 from spylunking.consts import SPLUNK_PORT
 from spylunking.consts import SPLUNK_HOSTNAME
@@ -56,6 +62,23 @@ def mock_mp_post_request(
 # end of mock_mp_post_request
 
 
+def read_ring(
+        ring,
+        conn):
+    """read_ring
+
+    Send every queued record in a ``ShmRingQueue``
+    back from a child process
+
+    :param ring: ``ShmRingQueue`` to read
+    :param conn: ``multiprocessing.Pipe`` connection
+    """
+    conn.send(
+        ring.get_many(
+            timeout=0)[1])
+# end of read_ring
+
+
 class TestMPSplunkPublisher(unittest.TestCase):
     """TestMPSplunkPublisher"""
 
@@ -160,4 +183,361 @@ class TestMPSplunkPublisher(unittest.TestCase):
             found_data['sourcetype'])
     # end of test_mp_publish_to_splunk
 
+    def test_force_flush(
+            self):
+        """test_force_flush"""
+        sent = []
+
+        def record_post(
+                session=None,
+                url=None,
+                data=None,
+                headers=None,
+                verify=None,
+                timeout=None):
+            """record_post"""
+            sent.append(data)
+            return MockRequest()
+        # end of record_post
+
+        patcher = mock.patch(
+            'spylunking.send_to_splunk.send_to_splunk',
+            new=record_post)
+        patcher.start()
+        self.addCleanup(
+            patcher.stop)
+        for idx in range(3):
+            self.splunk.queue.offer(
+                '{{"event": "queued {}"}}'.format(idx),
+                logging.INFO)
+        results = []
+        # force_flush must not block or install signal
+        # handlers when called from another thread
+        flusher = threading.Thread(
+            target=lambda: results.append(
+                self.splunk.force_flush()))
+        flusher.start()
+        flusher.join(5)
+        self.assertFalse(
+            flusher.is_alive())
+        self.assertEqual(
+            results,
+            [3])
+        self.assertTrue(
+            self.splunk.queue.empty())
+        self.assertEqual(
+            len(sent),
+            1)
+        self.assertIn(
+            b'queued 2',
+            sent[0])
+        self.assertEqual(
+            self.splunk.force_flush(),
+            0)
+    # end of test_force_flush
+
+    @unittest.skipUnless(
+        SHM_SUPPORTED,
+        'needs multiprocessing.shared_memory')
+    def test_shm_ring_queue(
+            self):
+        """test_shm_ring_queue"""
+        ring = ShmRingQueue(
+            capacity=64)
+        self.addCleanup(
+            ring.unlink)
+        # records wrap around the end of the ring
+        for idx in range(20):
+            record = 'record-{}-{}'.format(
+                idx,
+                'x' * (idx % 7))
+            self.assertTrue(
+                ring.offer(record))
+            self.assertEqual(
+                ring.get_many(
+                    max_items=10,
+                    timeout=0)[1],
+                [record.encode('utf-8')])
+        self.assertTrue(
+            ring.empty())
+
+        # drop-newest leaves the ring as it is
+        while ring.offer('0123456789'):
+            pass
+        num_queued = ring.qsize()
+        self.assertFalse(
+            ring.offer('new-record'))
+        ring.record_drop('new-record')
+        self.assertEqual(
+            ring.pop_dropped(),
+            (1, 10))
+
+        # drop-oldest evicts from the tail to make room
+        ring.overflow_policy = 'drop-oldest'
+        self.assertTrue(
+            ring.offer('newest'))
+        self.assertEqual(
+            ring.pop_dropped()[0],
+            1)
+        priority, records = ring.get_many()
+        self.assertEqual(
+            len(records),
+            num_queued)
+        self.assertEqual(
+            records[-1],
+            b'newest')
+
+        # another process reads the records in order
+        for idx in range(3):
+            ring.put_nowait(
+                'from-parent-{}'.format(idx))
+        parent_conn, child_conn = multiprocessing.Pipe()
+        reader = multiprocessing.Process(
+            target=read_ring,
+            args=(
+                ring,
+                child_conn))
+        reader.start()
+        records = parent_conn.recv()
+        reader.join(5)
+        self.assertEqual(
+            records,
+            [
+                b'from-parent-0',
+                b'from-parent-1',
+                b'from-parent-2'
+            ])
+        self.assertTrue(
+            ring.empty())
+
+        # a list of records is queued with one lock and wakeup
+        self.assertEqual(
+            ring.offer_many([
+                ('many-0', logging.INFO),
+                ('many-1', logging.ERROR)
+            ]),
+            2)
+        self.assertEqual(
+            ring.get_many()[1],
+            [b'many-0', b'many-1'])
+
+        # drop-below-level evicts records below the level first
+        ring = ShmRingQueue(
+            capacity=44,
+            maxsize=3,
+            overflow_policy='drop-below-level')
+        self.addCleanup(
+            ring.unlink)
+        for idx in range(2):
+            ring.put_nowait('pad-record')
+            ring.get_many()
+        for item, levelno in [
+                ('error-0', logging.ERROR),
+                ('info-1', logging.INFO),
+                ('warning-2', logging.WARNING),
+                ('info-3', logging.INFO),
+                ('warning-4', logging.WARNING),
+                ('warning-5', logging.WARNING)]:
+            if not ring.offer(
+                    item,
+                    levelno):
+                ring.record_drop(
+                    item)
+        self.assertEqual(
+            ring.pop_dropped()[0],
+            3)
+        self.assertEqual(
+            ring.get_many()[1],
+            [b'warning-2', b'warning-4', b'warning-5'])
+    # end of test_shm_ring_queue
+
+    @unittest.skipUnless(
+        SHM_SUPPORTED,
+        'needs multiprocessing.shared_memory')
+    def test_shm_event(
+            self):
+        """test_shm_event"""
+        event = ShmEvent()
+        self.assertFalse(
+            event.wait(0))
+        # a waiter killed while waiting must not block set
+        waiter = multiprocessing.Process(
+            target=event.wait)
+        waiter.start()
+        time.sleep(0.1)
+        waiter.terminate()
+        waiter.join(5)
+        setter = threading.Thread(
+            target=event.set)
+        setter.start()
+        setter.join(5)
+        self.assertFalse(
+            setter.is_alive())
+        self.assertTrue(
+            event.wait(0))
+        self.assertTrue(
+            event.wait(0))
+        event.set()
+        event.clear()
+        self.assertFalse(
+            event.wait(0))
+    # end of test_shm_event
+
+    def test_sharded_workers(
+            self):
+        """test_sharded_workers"""
+        splunk = MPSplunkPublisher(
+            token=SPLUNK_TOKEN,
+            sleep_interval=1.0,
+            num_workers=2,
+            shard_by='logger',
+            supervise_interval=0.1)
+        self.addCleanup(
+            splunk.shutdown)
+        self.assertEqual(
+            len(splunk.processes),
+            2)
+        self.assertIsNot(
+            splunk.queues[0],
+            splunk.queues[1])
+        # every log from a logger goes to the same shard
+        shards = [
+            splunk.get_shard('logger-{}'.format(idx))
+            for idx in range(10)
+        ]
+        self.assertEqual(
+            shards,
+            [
+                splunk.get_shard('logger-{}'.format(idx))
+                for idx in range(10)
+            ])
+        self.assertEqual(
+            len(set(id(shard) for shard in shards)),
+            2)
+        splunk.shard_by = 'round-robin'
+        self.assertEqual(
+            [id(splunk.get_shard('same')) for idx in range(4)],
+            [id(shard) for shard in splunk.queues] * 2)
+
+        # a crashed worker is restarted on the same shard
+        crashed = splunk.processes[1]['process']
+        crashed.terminate()
+        crashed.join(5)
+        end_time = time.time() + 5.0
+        while splunk.num_restarts == 0 and time.time() < end_time:
+            time.sleep(0.05)
+        self.assertEqual(
+            splunk.get_stats()['worker_restarts'],
+            1)
+        self.assertIsNot(
+            splunk.processes[1]['process'],
+            crashed)
+        self.assertTrue(
+            splunk.processes[1]['process'].is_alive())
+    # end of test_sharded_workers
+
+    def test_emit_batches(
+            self):
+        """test_emit_batches"""
+        splunk = MPSplunkPublisher(
+            token=SPLUNK_TOKEN,
+            sleep_interval=1.0,
+            emit_batch_size=3,
+            emit_linger_ms=60000)
+        self.addCleanup(
+            splunk.shutdown)
+        splunk.setFormatter(
+            logging.Formatter('%(message)s'))
+        offered = []
+        splunk.queue.offer_many = offered.append
+
+        def make_record(msg, level=logging.INFO):
+            return logging.LogRecord(
+                'test-emit-batches', level, __file__, 0, msg, None, None)
+
+        splunk.handle(make_record('first'))
+        splunk.handle(make_record('second'))
+        self.assertEqual(
+            (offered, splunk.num_buffered),
+            ([], 2))
+        splunk.handle(make_record('third'))
+        self.assertEqual(
+            [len(items) for items in offered],
+            [3])
+        # an error is put on the queue with the logs before it
+        splunk.handle(make_record('fourth'))
+        splunk.handle(make_record('fifth', logging.ERROR))
+        self.assertEqual(
+            [levelno for item, levelno in offered[-1]],
+            [logging.INFO, logging.ERROR])
+        splunk.handle(make_record('sixth'))
+        splunk.flush()
+        self.assertEqual(
+            (len(offered), splunk.num_buffered),
+            (3, 0))
+    # end of test_emit_batches
+
+    def test_shutdown_sends_burst(
+            self):
+        """test_shutdown_sends_burst"""
+        num_logs = 2000
+        backends = ['manager']
+        if SHM_SUPPORTED:
+            backends.append('shm')
+        for backend in backends:
+            with self.subTest(backend=backend):
+                num_sent = multiprocessing.Value('i', 0)
+
+                def record_post(
+                        session=None,
+                        url=None,
+                        data=None,
+                        headers=None,
+                        verify=None,
+                        timeout=None):
+                    """record_post"""
+                    with num_sent.get_lock():
+                        num_sent.value += data.count(b'burst-')
+                    return MockRequest()
+                # end of record_post
+
+                # the forked workers inherit the patch
+                with mock.patch(
+                        'spylunking.send_to_splunk.send_to_splunk',
+                        new=record_post):
+                    splunk = MPSplunkPublisher(
+                        token=SPLUNK_TOKEN,
+                        sleep_interval=1.0,
+                        num_workers=2,
+                        queue_backend=backend,
+                        queue_size=num_logs,
+                        retry_count=0)
+                    log = logging.getLogger(
+                        'test-shutdown-{}'.format(backend))
+                    log.propagate = False
+                    log.setLevel(logging.INFO)
+                    log.addHandler(splunk)
+                    for idx in range(num_logs):
+                        log.info('burst-{}'.format(idx))
+                    splunk.shutdown()
+                    log.removeHandler(splunk)
+                self.assertEqual(
+                    num_sent.value,
+                    num_logs)
+                for worker in splunk.processes:
+                    self.assertFalse(
+                        worker['process'].is_alive())
+                # only the manager backend starts a QueueManager
+                self.assertEqual(
+                    splunk.manager is None,
+                    backend == 'shm')
+                # the workers publish their stats without a manager
+                self.assertEqual(
+                    [
+                        worker_stats['breaker_state']
+                        for worker_stats in splunk.get_stats()['workers']
+                    ],
+                    ['closed', 'closed'])
+    # end of test_shutdown_sends_burst
+
 # end of TestMPSplunkPublisher
@@ -1,11 +1,32 @@
+import datetime
+import multiprocessing
 import os
+import shutil
+import subprocess
+import threading
+import time
+import tempfile
 import logging
 import unittest
 import mock
 import json
+import requests
 import uuid
+import zlib
 from tests.mock_utils import MockRequest
 from spylunking.splunk_publisher import SplunkPublisher
+from spylunking.log.setup_logging import SplunkFormatter
+from spylunking.memory_queue import MemoryQueue
+from spylunking.memory_queue import build_queue
+from spylunking.ack_tracker import AckTracker
+from spylunking.disk_spool import DiskSpool
+from spylunking.flush_scheduler import FlushScheduler
+from spylunking.retry_scheduler import CircuitBreaker
+from spylunking.retry_scheduler import RetryScheduler
+from spylunking.sender_pool import SenderPool
+from spylunking.send_to_splunk import split_payload
+from spylunking.hec_envelope import get_indexed_fields
+import spylunking.search as sp
 from spylunking.consts import SPLUNK_HOST
 from spylunking.consts import SPLUNK_PORT
 from spylunking.consts import SPLUNK_HOSTNAME
@@ -56,6 +77,64 @@ def mock_post_request(
 # end of mock_post_request
 
 
+def mock_gzip_post_request(
+        self=None,
+        session=None,
+        url=None,
+        data=None,
+        headers=None,
+        verify=None,
+        timeout=None):
+    """mock_gzip_post_request
+
+    Mock spylunking.send_to_splunk and store the
+    decompressed POST body
+
+    :param self: class obj
+    :param session: requests.Session
+    :param data: gzip-compressed data
+    :param headers: auth headers
+    :param verify: verifiy
+    :param timeout: timeout
+    """
+    req = MockRequest()
+    req.vals = {
+        'url': url,
+        'data': zlib.decompress(
+            data,
+            16 + zlib.MAX_WBITS).decode('utf-8'),
+        'headers': headers,
+        'verify': verify,
+        'timeout': timeout
+    }
+    os.environ['TEST_POST'] = json.dumps(
+        req.vals)
+    return req
+# end of mock_gzip_post_request
+
+
+def log_in_child(
+        splunk,
+        conn):
+    """log_in_child
+
+    Log from a ``multiprocessing.Process`` child and report
+    whether the publisher restarted its worker thread
+
+    :param splunk: publisher inherited from the parent
+    :param conn: pipe to the parent
+    """
+    splunk.enqueue(
+        'child log')
+    conn.send((
+        splunk.runtime_pid == os.getpid(),
+        splunk.sleep_interval,
+        splunk.worker is not None and splunk.worker.is_alive()))
+    # skip sending the log - the parent owns the test
+    os._exit(0)
+# end of log_in_child
+
+
 class TestSplunkPublisher(unittest.TestCase):
     """TestSplunkPublisher"""
 
@@ -120,6 +199,8 @@ class TestSplunkPublisher(unittest.TestCase):
         self.assertEqual(self.splunk.retry_count, SPLUNK_RETRY_COUNT)
         self.assertEqual(self.splunk.retry_backoff, SPLUNK_RETRY_BACKOFF)
         self.assertIsNotNone(self.splunk.debug)
+        self.assertIsInstance(self.splunk.queue, MemoryQueue)
+        self.assertIsNone(self.splunk.manager)
 
         self.assertFalse(logging.getLogger('requests').propagate)
     # end of test_init
@@ -180,4 +261,1227 @@ class TestSplunkPublisher(unittest.TestCase):
             found_data['sourcetype'])
     # end of test_publish_to_splunk
 
+    @mock.patch(
+        ('spylunking.send_to_splunk.send_to_splunk'),
+        new=mock_gzip_post_request)
+    def test_publish_to_splunk_with_gzip(
+            self):
+        """test_publish_to_splunk_with_gzip
+        """
+        self.splunk.compress = True
+        self.splunk.compress_min_bytes = 0
+        log = logging.getLogger('test_gzip')
+        log.addHandler(self.splunk)
+
+        log_msg = ('testing gzip message={}').format(
+            str(uuid.uuid4()))
+        log.warning(log_msg)
+
+        requested_vals = json.loads(
+            os.getenv(
+                'TEST_POST',
+                None))
+        self.assertEqual(
+            requested_vals['headers']['Content-Encoding'],
+            'gzip')
+        found_data = json.loads(
+            requested_vals['data'])
+        self.assertEqual(
+            log_msg,
+            found_data['event'])
+    # end of test_publish_to_splunk_with_gzip
+
+    @mock.patch(
+        ('spylunking.send_to_splunk.send_to_splunk'),
+        new=mock_post_request)
+    def test_publish_to_splunk_raw_endpoint(
+            self):
+        """test_publish_to_splunk_raw_endpoint
+        """
+        splunk = SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index='rawindex',
+            hostname=SPLUNK_HOSTNAME,
+            sourcetype=SPLUNK_SOURCETYPE,
+            sleep_interval=0,
+            endpoint='raw',
+            channel='testchannel')
+        log = logging.getLogger('test_raw')
+        log.addHandler(splunk)
+
+        log_msg = ('testing raw message={}').format(
+            str(uuid.uuid4()))
+        log.warning(log_msg)
+
+        requested_vals = json.loads(
+            os.getenv(
+                'TEST_POST',
+                None))
+        self.assertTrue(
+            requested_vals['url'].startswith(
+                '{}/raw?channel=testchannel'.format(
+                    SPLUNK_COLLECTOR_URL)))
+        self.assertIn(
+            'index=rawindex',
+            requested_vals['url'])
+        self.assertEqual(
+            requested_vals['headers']['X-Splunk-Request-Channel'],
+            'testchannel')
+        self.assertEqual(
+            requested_vals['data'],
+            '{}\n'.format(
+                log_msg))
+    # end of test_publish_to_splunk_raw_endpoint
+
+    def test_build_payload_from_queued_messages(
+            self):
+        """test_build_payload_from_queued_messages
+        """
+        for idx in range(3):
+            self.splunk.queue.put_nowait(
+                json.dumps({'event': 'msg={}'.format(idx)}))
+        self.splunk.build_payload_from_queued_messages(
+            use_queue=self.splunk.queue,
+            shutdown_event=self.splunk.shutdown_event,
+            triggered_by_shutdown=True)
+        self.assertEqual(
+            len(self.splunk.batch),
+            3)
+        payload = self.splunk.batch.getvalue()
+        self.assertIsInstance(
+            payload,
+            bytes)
+        self.assertEqual(
+            self.splunk.batch.num_bytes,
+            len(payload))
+        self.assertEqual(
+            payload.count(b'"event"'),
+            3)
+    # end of test_build_payload_from_queued_messages
+
+    def build_limited_publisher(
+            self,
+            **kwargs):
+        """build_limited_publisher
+
+        Return a publisher without a worker for the batch limit tests
+
+        :param kwargs: batch limits
+        """
+        return SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index=SPLUNK_INDEX,
+            hostname=SPLUNK_HOSTNAME,
+            sleep_interval=0,
+            **kwargs)
+    # end of build_limited_publisher
+
+    def test_batch_closes_at_max_events(
+            self):
+        """test_batch_closes_at_max_events
+        """
+        splunk = self.build_limited_publisher(
+            max_batch_events=2)
+        for idx in range(5):
+            splunk.queue.put_nowait(
+                'msg={}'.format(idx))
+        sizes = []
+        done = False
+        while not done:
+            done = splunk.build_payload_from_queued_messages(
+                use_queue=splunk.queue,
+                shutdown_event=splunk.shutdown_event)
+            sizes.append(
+                len(splunk.batch))
+            splunk.batch.reset()
+        # end of while batches are full
+        self.assertEqual(
+            sizes,
+            [2, 2, 1])
+    # end of test_batch_closes_at_max_events
+
+    def test_batch_lingers_then_ships(
+            self):
+        """test_batch_lingers_then_ships
+        """
+        splunk = self.build_limited_publisher(
+            linger_ms=200)
+        splunk.queue.put_nowait(
+            'first')
+        later = threading.Timer(
+            0.05,
+            splunk.queue.put_nowait,
+            args=('second',))
+        later.start()
+        self.addCleanup(
+            later.cancel)
+        start = time.time()
+        self.assertTrue(
+            splunk.build_payload_from_queued_messages(
+                use_queue=splunk.queue,
+                shutdown_event=splunk.shutdown_event))
+        elapsed = time.time() - start
+        # the log that arrived while lingering rides in the batch
+        self.assertEqual(
+            splunk.batch.getvalue(),
+            b'firstsecond')
+        self.assertGreaterEqual(
+            elapsed,
+            0.19)
+        self.assertLess(
+            elapsed,
+            2.0)
+    # end of test_batch_lingers_then_ships
+
+    def test_batch_counts_encoded_bytes(
+            self):
+        """test_batch_counts_encoded_bytes
+        """
+        record = u'\u00e9' * 10
+        encoded = record.encode('utf-8')
+        self.assertEqual(
+            len(encoded),
+            20)
+        splunk = self.build_limited_publisher(
+            max_batch_bytes=2 * len(encoded))
+        for idx in range(4):
+            splunk.queue.put_nowait(
+                record)
+        # 4 records fit if characters were counted instead of bytes
+        self.assertFalse(
+            splunk.build_payload_from_queued_messages(
+                use_queue=splunk.queue,
+                shutdown_event=splunk.shutdown_event))
+        self.assertEqual(
+            len(splunk.batch),
+            2)
+        self.assertEqual(
+            splunk.batch.num_bytes,
+            40)
+        self.assertEqual(
+            splunk.batch.getvalue(),
+            encoded * 2)
+    # end of test_batch_counts_encoded_bytes
+
+    def test_drop_report_from_idle_queue(
+            self):
+        """test_drop_report_from_idle_queue
+        """
+        splunk = self.build_limited_publisher(
+            drop_report_interval=0.2)
+        splunk.last_drop_report = time.time()
+        splunk.queue.record_drop(
+            'lost log')
+        # an idle queue only waits until the report is due
+        start = time.time()
+        self.assertTrue(
+            splunk.build_payload_from_queued_messages(
+                use_queue=splunk.queue,
+                shutdown_event=splunk.shutdown_event))
+        elapsed = time.time() - start
+        self.assertGreaterEqual(
+            elapsed,
+            0.15)
+        self.assertLess(
+            elapsed,
+            2.0)
+        splunk.add_drop_report(
+            use_queue=splunk.queue)
+        self.assertIn(
+            b'1 log records dropped (8 bytes)',
+            splunk.batch.getvalue())
+        self.assertFalse(
+            splunk.queue.has_dropped())
+    # end of test_drop_report_from_idle_queue
+
+    def test_ack_tracker_window_and_resend(
+            self):
+        """test_ack_tracker_window_and_resend
+        """
+        polled = []
+        resent = []
+        tracker = AckTracker(
+            poll_func=lambda ack_ids: polled.append(ack_ids) or {
+                '0': True,
+                '1': False
+            },
+            resend_func=lambda payload: resent.append(payload),
+            max_pending=2,
+            timeout=0.0)
+        tracker.add(
+            ack_id=0,
+            payload=b'batch0')
+        tracker.add(
+            ack_id=1,
+            payload=b'batch1')
+        self.assertFalse(
+            tracker.wait_for_room(
+                timeout=0.01))
+        tracker.poll()
+        self.assertEqual(
+            polled,
+            [[0, 1]])
+        self.assertEqual(
+            tracker.num_acked,
+            1)
+        self.assertEqual(
+            resent,
+            [b'batch1'])
+        self.assertEqual(
+            len(tracker),
+            0)
+        self.assertTrue(
+            tracker.wait_for_room(
+                timeout=0.01))
+        # unacknowledged batches are handed back on stop
+        tracker.add(
+            ack_id=2,
+            payload=b'batch2')
+        self.assertEqual(
+            tracker.stop(),
+            [b'batch2'])
+        self.assertEqual(
+            len(tracker),
+            0)
+
+        # and the publisher spools them at shutdown
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(
+            shutil.rmtree,
+            spool_dir)
+        splunk = SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index=SPLUNK_INDEX,
+            hostname=SPLUNK_HOSTNAME,
+            sleep_interval=30,
+            use_ack=True,
+            spool_dir=spool_dir)
+        splunk.ack_tracker.add(
+            ack_id=3,
+            payload=b'batch3')
+        splunk.shutdown()
+        sent = []
+        spool = DiskSpool(
+            spool_dir=spool_dir,
+            send_func=lambda payload: sent.append(payload) or True)
+        self.assertTrue(
+            spool.replay())
+        self.assertEqual(
+            sent,
+            [b'batch3'])
+
+        # batches a full spool cannot take are counted as dropped
+        splunk = SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index=SPLUNK_INDEX,
+            hostname=SPLUNK_HOSTNAME,
+            sleep_interval=30,
+            spool_dir=spool_dir,
+            spool_max_bytes=16)
+        self.addCleanup(
+            splunk.shutdown)
+        self.assertEqual(
+            splunk.keep_unsent(
+                payloads=[b'batch4', b'batch5', b'batch6'],
+                reason='waiting for a retry'),
+            (1, 0, 2))
+    # end of test_ack_tracker_window_and_resend
+
+    def test_disk_spool_replay(
+            self):
+        """test_disk_spool_replay
+        """
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(
+            shutil.rmtree,
+            spool_dir)
+        sent = []
+        spool = DiskSpool(
+            spool_dir=spool_dir,
+            send_func=lambda payload: len(sent) < 2 and (
+                sent.append(payload) or True),
+            max_bytes=64,
+            segment_bytes=20)
+        for idx in range(2):
+            self.assertTrue(
+                spool.append(
+                    payload='batch={}'.format(idx)))
+        self.assertFalse(
+            spool.append(
+                payload='x' * 64))
+        # a list of batches is spooled until the spool is full
+        self.assertEqual(
+            spool.append_many(
+                payloads=['batch=2', 'batch=3', 'x' * 64]),
+            2)
+        spool.stop()
+
+        # a new process replays the leftover segments in order
+        # and keeps what it could not send
+        spool = DiskSpool(
+            spool_dir=spool_dir,
+            send_func=spool.send_func)
+        self.assertFalse(
+            spool.replay())
+        self.assertEqual(
+            sent,
+            [b'batch=0', b'batch=1'])
+        del sent[:]
+        self.assertTrue(
+            spool.replay())
+        self.assertEqual(
+            sent,
+            [b'batch=2', b'batch=3'])
+        self.assertEqual(
+            len(spool),
+            0)
+        self.assertEqual(
+            os.listdir(spool_dir),
+            [])
+
+        # spools of exited forked children are adopted and replayed
+        # while a running child keeps its own
+        exited = subprocess.Popen(
+            ['true'])
+        exited.wait()
+        for pid in [exited.pid, os.getppid()]:
+            child_spool = DiskSpool(
+                spool_dir=os.path.join(
+                    spool_dir,
+                    'pid-{}'.format(pid)),
+                send_func=spool.send_func)
+            child_spool.append(
+                payload='child={}'.format(pid))
+            child_spool.stop()
+        del sent[:]
+        spool = DiskSpool(
+            spool_dir=spool_dir,
+            send_func=lambda payload: sent.append(payload) or True)
+        self.assertEqual(
+            spool.adopt_orphans(
+                base_dir=spool_dir),
+            1)
+        self.assertTrue(
+            spool.replay())
+        self.assertEqual(
+            sent,
+            ['child={}'.format(exited.pid).encode('utf-8')])
+        self.assertEqual(
+            sorted(os.listdir(spool_dir)),
+            ['pid-{}'.format(os.getppid())])
+
+        # records that did not fit in the queue are spooled
+        # in batches by the worker instead of the caller
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(
+            shutil.rmtree,
+            spool_dir)
+        splunk = SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index=SPLUNK_INDEX,
+            hostname=SPLUNK_HOSTNAME,
+            sleep_interval=30,
+            spool_dir=spool_dir,
+            spool_segment_bytes=10)
+        for idx in range(3):
+            self.assertEqual(
+                splunk.add_overflow(
+                    record='log-{}'.format(idx)),
+                idx < 2)
+        self.assertEqual(
+            splunk.spool_overflow(),
+            2)
+        splunk.shutdown()
+        del sent[:]
+        spool = DiskSpool(
+            spool_dir=spool_dir,
+            send_func=lambda payload: sent.append(payload) or True)
+        self.assertTrue(
+            spool.replay())
+        self.assertEqual(
+            sent,
+            [b'log-0log-1'])
+    # end of test_disk_spool_replay
+
+    def test_memory_queue_overflow_policies(
+            self):
+        """test_memory_queue_overflow_policies
+        """
+        expected = {
+            'drop-newest': ['log-0', 'log-1'],
+            'drop-oldest': ['log-2', 'log-3'],
+            'drop-below-level': ['log-1', 'log-2']
+        }
+        for policy in expected:
+            queue = MemoryQueue(
+                max_bytes=10,
+                overflow_policy=policy)
+            for idx, levelno in enumerate([
+                    logging.INFO,
+                    logging.INFO,
+                    logging.ERROR,
+                    logging.INFO]):
+                item = 'log-{}'.format(idx)
+                if not queue.offer(
+                        item,
+                        levelno):
+                    queue.record_drop(
+                        item)
+            self.assertEqual(
+                queue.get_many(
+                    timeout=0),
+                (False, expected[policy]))
+            self.assertEqual(
+                queue.pop_dropped(),
+                (2, 10))
+            self.assertEqual(
+                queue.pop_dropped(),
+                (0, 0))
+        # records below the level are evicted before older ones at it
+        queue = MemoryQueue(
+            maxsize=2,
+            overflow_policy='drop-below-level')
+        for item, levelno in [
+                ('error-0', logging.ERROR),
+                ('info-1', logging.INFO),
+                ('warning-2', logging.WARNING),
+                ('info-3', logging.INFO),
+                ('warning-4', logging.WARNING)]:
+            if not queue.offer(
+                    item,
+                    levelno):
+                queue.record_drop(
+                    item)
+        self.assertEqual(
+            queue.num_below_level,
+            0)
+        self.assertEqual(
+            queue.get_many(
+                timeout=0),
+            (False, ['warning-2', 'warning-4']))
+        self.assertEqual(
+            queue.pop_dropped()[0],
+            3)
+    # end of test_memory_queue_overflow_policies
+
+    def test_priority_lanes(
+            self):
+        """test_priority_lanes
+        """
+        queue, manager = build_queue(
+            queue_size=2,
+            priority_lanes=True,
+            priority_level='ERROR',
+            priority_weight=2)
+        self.assertIsNone(
+            manager)
+        for idx in range(3):
+            queue.offer(
+                'info-{}'.format(idx),
+                logging.INFO)
+        for idx in range(3):
+            queue.offer(
+                'error-{}'.format(idx),
+                logging.ERROR)
+        self.assertEqual(
+            [
+                queue.get_priority(
+                    block=False)
+                for idx in range(5)
+            ],
+            [
+                (True, 'error-0'),
+                (True, 'error-1'),
+                (False, 'info-0'),
+                (True, 'error-2'),
+                (False, 'info-1')
+            ])
+        self.assertTrue(
+            queue.empty())
+
+        # a priority log ends the linger of its batch
+        self.splunk.batch.linger_ms = 60000
+        self.splunk.batch.add('info')
+        self.assertGreater(
+            self.splunk.batch.linger_remaining(),
+            0)
+        self.splunk.batch.add(
+            'error',
+            priority=True)
+        self.assertEqual(
+            self.splunk.batch.linger_remaining(),
+            0.0)
+    # end of test_priority_lanes
+
+    def test_flush_scheduler_aimd(
+            self):
+        """test_flush_scheduler_aimd
+        """
+        scheduler = FlushScheduler(
+            min_batch_bytes=1000,
+            max_batch_bytes=100000,
+            max_linger_ms=100,
+            linger_step_ms=5,
+            target_latency_ms=250)
+        batch = self.splunk.batch
+        scheduler.record_batch(
+            num_records=10,
+            num_bytes=1000)
+
+        # a backlog grows the batch and skips the linger
+        scheduler.plan(
+            batch=batch,
+            depth=500)
+        self.assertEqual(
+            batch.max_bytes,
+            50000)
+        self.assertEqual(
+            batch.linger_ms,
+            0)
+
+        # slow posts double the linger and the batch floor
+        scheduler.record_send(
+            latency=1.0)
+        scheduler.record_send(
+            latency=1.0)
+        scheduler.plan(
+            batch=batch,
+            depth=0)
+        self.assertEqual(
+            batch.linger_ms,
+            10)
+        self.assertEqual(
+            batch.max_bytes,
+            4000)
+
+        # fast posts take the linger back down step by step
+        for idx in range(20):
+            scheduler.record_send(
+                latency=0.01)
+        scheduler.plan(
+            batch=batch,
+            depth=0)
+        self.assertEqual(
+            batch.linger_ms,
+            0)
+        self.assertEqual(
+            batch.max_bytes,
+            1000)
+        stats = scheduler.stats()
+        self.assertEqual(
+            stats['num_slow'],
+            2)
+        self.assertEqual(
+            stats['num_fast'],
+            20)
+        self.assertEqual(
+            self.splunk.get_stats()['adaptive_flush'],
+            False)
+    # end of test_flush_scheduler_aimd
+
+    def test_memory_queue_wakeup_and_get_many(
+            self):
+        """test_memory_queue_wakeup_and_get_many
+        """
+        queue = MemoryQueue()
+        # puts without a waiting consumer do not signal
+        queue.put_nowait('a')
+        self.assertFalse(
+            queue.not_empty.is_set())
+        self.assertEqual(
+            queue.get_many(
+                timeout=0.01,
+                min_items=2),
+            (False, ['a']))
+        self.assertEqual(
+            queue.get_many(
+                timeout=0.01),
+            (False, []))
+
+        # a waiting consumer is only woken at its threshold
+        queue.waiting = True
+        queue.wake_items = 3
+        queue.put_nowait('b')
+        queue.put_nowait('c')
+        self.assertFalse(
+            queue.not_empty.is_set())
+        queue.put_nowait('d')
+        self.assertTrue(
+            queue.not_empty.is_set())
+        queue.waiting = False
+        self.assertEqual(
+            queue.get_many(
+                max_items=2),
+            (False, ['b', 'c']))
+
+        # wake ends a wait with no timeout
+        queue.get_many()
+        queue.wake()
+        self.assertEqual(
+            queue.get_many(),
+            (False, []))
+
+        # the publisher drains the queue in one read
+        for idx in range(5):
+            self.splunk.queue.put_nowait(
+                'msg-{}'.format(idx))
+        self.splunk.build_payload_from_queued_messages(
+            use_queue=self.splunk.queue,
+            shutdown_event=self.splunk.shutdown_event,
+            triggered_by_shutdown=True)
+        self.assertEqual(
+            len(self.splunk.batch),
+            5)
+        self.assertTrue(
+            self.splunk.queue.empty())
+    # end of test_memory_queue_wakeup_and_get_many
+
+    def test_worker_flush_and_shutdown(
+            self):
+        """test_worker_flush_and_shutdown
+        """
+        sent = []
+
+        def mock_send(session, url, data, headers, verify, timeout):
+            sent.append(data)
+            return MockRequest()
+
+        patcher = mock.patch(
+            'spylunking.send_to_splunk.send_to_splunk',
+            new=mock_send)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        splunk = SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index=SPLUNK_INDEX,
+            hostname=SPLUNK_HOSTNAME,
+            sleep_interval=30,
+            linger_ms=60000)
+        self.assertEqual(
+            splunk.worker.name,
+            'splunkpub-worker')
+        self.assertEqual(
+            splunk.get_stats()['state'],
+            'running')
+        log = logging.getLogger('test_worker_flush')
+        log.addHandler(splunk)
+        log.warning('flushed')
+        # the flush ends the linger and waits for the POST
+        self.assertTrue(
+            splunk.flush(
+                timeout=5))
+        self.assertIn(
+            b'flushed',
+            sent[-1])
+        log.warning('drained')
+        log.removeHandler(splunk)
+        splunk.shutdown()
+        self.assertEqual(
+            splunk.state,
+            'stopped')
+        self.assertFalse(
+            splunk.worker.is_alive())
+        self.assertIn(
+            b'drained',
+            sent[-1])
+        self.assertTrue(
+            splunk.flush(
+                timeout=1))
+    # end of test_worker_flush_and_shutdown
+
+    def test_circuit_breaker_and_retry_scheduler(
+            self):
+        """test_circuit_breaker_and_retry_scheduler
+        """
+        breaker = CircuitBreaker(
+            failure_threshold=2,
+            reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(
+            breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(
+            breaker.allow())
+        time.sleep(0.06)
+        # half-open lets one probe through
+        self.assertTrue(
+            breaker.allow())
+        self.assertFalse(
+            breaker.allow())
+        breaker.record_success()
+        self.assertTrue(
+            breaker.is_closed())
+        self.assertEqual(
+            breaker.stats()['breaker_opened'],
+            1)
+
+        retried = []
+        done = threading.Event()
+
+        def send_func(payload, attempt):
+            retried.append((payload, attempt))
+            if len(retried) == 2:
+                done.set()
+
+        retry = RetryScheduler(
+            send_func=send_func,
+            max_pending=2)
+        self.assertTrue(
+            retry.schedule(
+                payload='later',
+                attempt=2,
+                delay=0.05))
+        self.assertTrue(
+            retry.schedule(
+                payload='sooner',
+                attempt=1,
+                delay=0.0))
+        self.assertFalse(
+            retry.schedule(
+                payload='full',
+                attempt=1,
+                delay=0.0))
+        self.assertTrue(
+            done.wait(5))
+        self.assertEqual(
+            retried,
+            [('sooner', 1), ('later', 2)])
+        retry.schedule(
+            payload='left',
+            attempt=1,
+            delay=60)
+        self.assertEqual(
+            retry.stop(),
+            ['left'])
+
+        # an open breaker keeps the publisher from POSTing
+        for idx in range(self.splunk.breaker_threshold):
+            self.splunk.breaker.record_failure()
+        with mock.patch(
+                'spylunking.send_to_splunk.send_to_splunk') as send:
+            self.assertFalse(
+                self.splunk.send_payload(
+                    payload='{"event": "held"}'))
+            self.assertFalse(
+                send.called)
+        self.assertEqual(
+            self.splunk.get_stats()['breaker_state'],
+            'open')
+        self.assertEqual(
+            self.splunk.get_stats()['retry_pending'],
+            1)
+        self.splunk.retry_scheduler.stop()
+    # end of test_circuit_breaker_and_retry_scheduler
+
+    def test_sender_pool(
+            self):
+        """test_sender_pool
+        """
+        release = threading.Event()
+        started = []
+        sent = []
+
+        def send_func(
+                payload):
+            """send_func
+
+            :param payload: batch
+            """
+            started.append(payload)
+            release.wait(5)
+            if payload == b'bad':
+                raise ValueError('bad batch')
+            sent.append(payload)
+        # end of send_func
+
+        pool = SenderPool(
+            send_func=send_func,
+            max_inflight=2)
+        # both batches are in flight at the same time
+        self.assertEqual(
+            [
+                pool.submit(
+                    payload=payload)
+                for payload in [b'batch0', b'batch1']
+            ],
+            [0, 1])
+        end_time = time.time() + 5.0
+        while len(started) < 2 and time.time() < end_time:
+            time.sleep(0.01)
+        self.assertEqual(
+            sorted(started),
+            [b'batch0', b'batch1'])
+        self.assertEqual(
+            pool.num_inflight(),
+            2)
+        self.assertFalse(
+            pool.wait_idle(
+                timeout=0.05))
+        release.set()
+        self.assertTrue(
+            pool.wait_idle(
+                timeout=5.0))
+        self.assertEqual(
+            pool.committed_seq,
+            1)
+
+        # a batch that raises does not stop its sender thread
+        pool.submit(
+            payload=b'bad')
+        self.assertTrue(
+            pool.wait_idle(
+                timeout=5.0))
+        self.assertEqual(
+            pool.num_errors,
+            1)
+        self.assertEqual(
+            len([t for t in pool.threads if t.is_alive()]),
+            2)
+
+        # stop sends every submitted batch first
+        for idx in range(4):
+            pool.submit(
+                payload='more{}'.format(idx).encode('utf-8'))
+        pool.stop(
+            timeout=5.0)
+        self.assertEqual(
+            sorted(sent[2:]),
+            [b'more0', b'more1', b'more2', b'more3'])
+        self.assertEqual(
+            pool.committed_seq,
+            6)
+    # end of test_sender_pool
+
+    def test_rejected_batch_bisection(
+            self):
+        """test_rejected_batch_bisection
+        """
+        indexed = []
+        posts = []
+
+        class MockResponse(object):
+            status_code = 400
+
+            def __init__(self, body):
+                self.body = body
+
+            def json(self):
+                return self.body
+
+        def mock_hec(session, url, data, headers, verify, timeout):
+            events = split_payload(data)
+            posts.append(len(events))
+            for idx, event in enumerate(events):
+                if b'poison' in event:
+                    body = {
+                        'text': 'Event field cannot be blank',
+                        'code': 13
+                    }
+                    if report_number:
+                        # HEC indexes the events before the bad one
+                        indexed.extend(events[:idx])
+                        body['invalid-event-number'] = idx
+                    raise requests.exceptions.HTTPError(
+                        response=MockResponse(body))
+            indexed.extend(events)
+            return MockRequest()
+
+        dead_letters = []
+        self.splunk.dead_letter = (
+            lambda event, reason: dead_letters.append(event))
+        events = [
+            json.dumps({'event': 'poison' if idx in (2, 5) else idx})
+            for idx in range(8)
+        ]
+        payload = ''.join(events).encode('utf-8')
+        for report_number in (True, False):
+            indexed[:] = []
+            posts[:] = []
+            dead_letters[:] = []
+            with mock.patch(
+                    'spylunking.send_to_splunk.send_to_splunk',
+                    new=mock_hec):
+                self.assertTrue(
+                    self.splunk.send_payload(
+                        payload=payload))
+            self.assertEqual(
+                sorted(indexed),
+                sorted(
+                    event.encode('utf-8')
+                    for idx, event in enumerate(events)
+                    if idx not in (2, 5)))
+            self.assertEqual(
+                dead_letters,
+                [events[2].encode('utf-8'), events[5].encode('utf-8')])
+        # without an invalid-event-number the batch is halved
+        # until each bad event is alone
+        self.assertEqual(
+            posts,
+            [8, 4, 4, 2, 2, 2, 2, 1, 1, 1, 1])
+        self.assertEqual(
+            self.splunk.get_stats()['dead_letters'],
+            4)
+    # end of test_rejected_batch_bisection
+
+    def test_after_fork_in_child(
+            self):
+        """test_after_fork_in_child
+        """
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(
+            shutil.rmtree,
+            spool_dir)
+        splunk = SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index=SPLUNK_INDEX,
+            hostname=SPLUNK_HOSTNAME,
+            sleep_interval=30,
+            spool_dir=spool_dir)
+        splunk.queue.put_nowait('parent log')
+        org_queue = splunk.queue
+        org_session = splunk.session
+        org_channel = splunk.channel
+        org_worker = splunk.worker
+
+        # what os.register_at_fork runs in a child process
+        # only replaces the restart lock
+        splunk.after_fork_in_child()
+        self.assertIs(
+            splunk.queue,
+            org_queue)
+        self.assertIs(
+            splunk.worker,
+            org_worker)
+
+        # the first log in a child process restarts the publisher
+        splunk.runtime_pid = -1
+        splunk.check_pid()
+        self.assertEqual(
+            splunk.runtime_pid,
+            os.getpid())
+        self.assertIsNot(
+            splunk.queue,
+            org_queue)
+        self.assertTrue(
+            splunk.queue.empty())
+        self.assertIsNot(
+            splunk.session,
+            org_session)
+        self.assertNotEqual(
+            splunk.channel,
+            org_channel)
+        self.assertIsNot(
+            splunk.worker,
+            org_worker)
+        self.assertTrue(
+            splunk.worker.is_alive())
+        self.assertEqual(
+            splunk.spool.spool_dir,
+            os.path.join(
+                spool_dir,
+                'pid-{}'.format(os.getpid())))
+        splunk.shutdown()
+        org_worker.join(5)
+
+        # a multiprocessing child restarts the batching worker thread
+        splunk = SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index=SPLUNK_INDEX,
+            hostname=SPLUNK_HOSTNAME,
+            sleep_interval=30)
+        self.addCleanup(
+            splunk.shutdown)
+        parent_conn, child_conn = multiprocessing.Pipe()
+        child = multiprocessing.get_context('fork').Process(
+            target=log_in_child,
+            args=(
+                splunk,
+                child_conn))
+        child.start()
+        self.assertTrue(
+            parent_conn.poll(10))
+        self.assertEqual(
+            parent_conn.recv(),
+            (True, 30, True))
+        child.join(5)
+
+        # only a QueueManager server process sends without threads
+        with mock.patch(
+                'spylunking.splunk_publisher.in_manager_server',
+                return_value=True):
+            splunk.runtime_pid = -1
+            splunk.check_pid()
+        self.assertEqual(
+            splunk.sleep_interval,
+            0)
+        self.assertIsNone(
+            splunk.spool)
+
+        # the fork hook runs in the manager server process so it
+        # must not start another manager there
+        splunk = SplunkPublisher(
+            host=SPLUNK_HOST,
+            port=SPLUNK_PORT,
+            token=SPLUNK_TOKEN,
+            index=SPLUNK_INDEX,
+            hostname=SPLUNK_HOSTNAME,
+            sleep_interval=30,
+            queue_backend='manager')
+        self.assertIsNotNone(
+            splunk.manager)
+        splunk.shutdown()
+    # end of test_after_fork_in_child
+
+    def test_format_record_envelope(
+            self):
+        """test_format_record_envelope"""
+        record = logging.LogRecord(
+            name='test-envelope',
+            level=logging.INFO,
+            pathname='/opt/app/run.py',
+            lineno=1,
+            msg='quoted "100%" message',
+            args=None,
+            exc_info=None)
+        for source in [SPLUNK_SOURCE, None]:
+            for sort_keys in [True, False]:
+                self.splunk.source = source
+                self.splunk.sort_keys = sort_keys
+                self.splunk.build_envelope()
+                expected = json.dumps(
+                    {
+                        'time': record.created,
+                        'host': self.splunk.hostname,
+                        'index': self.splunk.index,
+                        'source': (
+                            record.pathname if source is None
+                            else source),
+                        'sourcetype': self.splunk.sourcetype,
+                        'event': self.splunk.format(record)
+                    },
+                    sort_keys=sort_keys)
+                self.assertEqual(
+                    self.splunk.format_record(record),
+                    expected)
+    # end of test_format_record_envelope
+
+    def test_object_event_format(
+            self):
+        """test_object_event_format"""
+        formatter = SplunkFormatter()
+        formatter.set_fields({
+            'env': 'dev',
+            'deployed': datetime.datetime(2018, 1, 2, 3, 4, 5)
+        })
+        self.splunk.setFormatter(
+            formatter)
+        record = logging.LogRecord(
+            name='test-object-event',
+            level=logging.INFO,
+            pathname=__file__,
+            lineno=1,
+            msg='quoted "object" message',
+            args=None,
+            exc_info=None)
+        as_string = self.splunk.format_record(
+            record)
+        self.splunk.event_format = 'object'
+        as_object = self.splunk.format_record(
+            record)
+        event = json.loads(as_object)['event']
+        self.assertEqual(
+            event['message'],
+            'quoted "object" message')
+        self.assertEqual(
+            event['deployed'],
+            '2018-01-02T03:04:05')
+        # the string event holds the same JSON encoded a second time
+        self.assertEqual(
+            set(json.loads(json.loads(as_string)['event'])),
+            set(event))
+        self.assertLess(
+            len(as_object),
+            len(as_string))
+    # end of test_object_event_format
+
+    def test_indexed_fields(
+            self):
+        """test_indexed_fields"""
+        formatter = SplunkFormatter()
+        formatter.set_fields({
+            'env': 'dev',
+            'dc': ''
+        })
+        self.splunk.setFormatter(
+            formatter)
+        record = logging.LogRecord(
+            name='test-indexed-fields',
+            level=logging.INFO,
+            pathname=__file__,
+            lineno=1,
+            msg='indexed',
+            args=None,
+            exc_info=None)
+        record.name = 'app'
+        self.assertNotIn(
+            'fields',
+            json.loads(self.splunk.format_record(record)))
+        self.splunk.indexed_fields = get_indexed_fields(
+            'name, dc,env')
+        self.splunk.build_envelope()
+        envelope = json.loads(
+            self.splunk.format_record(record))
+        # empty values are not indexed
+        self.assertEqual(
+            envelope['fields'],
+            {
+                'env': 'dev',
+                'name': 'app'
+            })
+        self.assertEqual(
+            json.loads(envelope['event'])['message'],
+            'indexed')
+        self.assertEqual(
+            sp.use_indexed_fields(
+                query=(
+                    'search index="antinex" AND name=app '
+                    'message="env=dev" env!=prod | stats count by dc'),
+                indexed_fields=self.splunk.indexed_fields),
+            (
+                'search index="antinex" AND name::app '
+                'message="env=dev" env!=prod | stats count by dc'))
+        self.assertEqual(
+            sp.use_tstats(
+                query='index="antinex" name="app" | stats count by dc, env',
+                indexed_fields=self.splunk.indexed_fields),
+            (
+                '| tstats count where index="antinex" name="app" '
+                'by dc, env'))
+        # searches that need the events stay as they are
+        self.assertIsNone(
+            sp.use_tstats(
+                query='index="antinex" levelname=ERROR | stats count',
+                indexed_fields=self.splunk.indexed_fields))
+        self.assertIsNone(
+            sp.use_tstats(
+                query='index="antinex" name=app AND name=other | stats count',
+                indexed_fields=self.splunk.indexed_fields))
+    # end of test_indexed_fields
+
 # end of TestSplunkPublisher